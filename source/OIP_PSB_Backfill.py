@@ -0,0 +1,330 @@
+import argparse
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from datetime import date, datetime
+import logging
+import multiprocessing
+import os
+import sys
+import OIP_PSB_Weekly_Report_Config as config
+from OIP_PSB_Discovery import PrelogManifest
+from OIP_PSB_Ingest import ingest_prelog_python, ingest_prelog_swap
+from OIP_PSB_JsonFile import read_json, write_json
+from OIP_PSB_Metrics import RunMetrics
+from OIP_PSB_Parser import PrelogFile
+from OIP_PSB_Validate import ExceptionPrelogValidation, check_prelog
+
+# Semaphore bounding the loads running against SQL Server at the same time, set in every worker process
+_db_semaphore = None
+
+
+def _init_worker(db_semaphore, log_filename):
+    """To set up a backfill worker process, the semaphore is shared by every worker of the pool"""
+
+    global _db_semaphore
+    _db_semaphore = db_semaphore
+    logging.basicConfig(filename=log_filename, level=logging.INFO)
+
+
+def existing_import_date(cnxn, file_name):
+    """To get the import_date a file_name is already loaded with in tOIPPreLog3, the latest one if several
+
+    Return:
+    date
+        import_date of the existing load, None if the file_name was never loaded
+    """
+
+    cursor = cnxn.cursor()
+    cursor.execute('SELECT MAX(import_date) FROM tOIPPreLog3 WHERE file_name = ?', file_name)
+    row = cursor.fetchone()
+    cursor.close()
+
+    import_date = row[0] if row is not None else None
+    return import_date.date() if isinstance(import_date, datetime) else import_date
+
+
+def load_prelog(cnxn, prelog, file_name, folder_date):
+    """To load a validated F prelog into tOIPPreLog3 in place of any earlier load of the same file_name
+
+    The weekly run stamps import_date with the date it ran, usually a day or more after the daily
+    folder, so a file it already loaded is loaded again with the import_date of that load and the
+    report of that week keeps finding it. A file never loaded gets the date of its daily folder.
+    Every row of the file_name is replaced whatever its import_date, so no load is duplicated. The
+    old rows are removed in the transaction inserting the new ones, a failed load leaves the earlier
+    one as it was: with load_mode 'swap' through the staging table of ingest_prelog_swap, otherwise
+    by a delete left uncommitted until ingest_prelog_python commits its insert. 'delta' is not used
+    as it would replace the other versions of the prelog being backfilled.
+
+    Parameter:
+    cnxn : pyodbc.Connection
+        connection to SGTAMProdOIP
+    prelog : PrelogFile
+        validated F prelog
+    file_name : str
+        value of the file_name column, e.g. 'F240308B'
+    folder_date : date
+        date of the daily folder, the import_date of a file never loaded
+
+    Return:
+    tuple
+        (import_date, number of rows inserted)
+    """
+
+    import_date = existing_import_date(cnxn, file_name) or folder_date
+
+    if config.load_mode == 'swap':
+        result = ingest_prelog_swap(cnxn, prelog, file_name, import_date, batch_size=config.ingest_batch_size, replace_file_name=True)
+        removed, rows = result['removed'], result['inserted']
+    else:
+        cursor = cnxn.cursor()
+        try:
+            # Not committed here, ingest_prelog_python commits the delete with its insert or rolls both back
+            cursor.execute('DELETE FROM tOIPPreLog3 WHERE file_name = ?', file_name)
+            removed = cursor.rowcount
+        except Exception:
+            cnxn.rollback()
+            raise
+        finally:
+            cursor.close()
+        rows = ingest_prelog_python(cnxn, prelog, file_name, import_date, batch_size=config.ingest_batch_size)
+
+    logging.info(f'{removed} rows of earlier loads replaced in tOIPPreLog3 with file_name={file_name}')
+    return import_date, rows
+
+
+def backfill_prelog(source_path, file_name, folder_date):
+    """To validate a F prelog file and load it into tOIPPreLog3, run in a worker process
+
+    The file is read from the share once through a memory map shared by the validation and the
+    load. Validation runs in parallel in every worker, the load only starts once the worker holds
+    the database semaphore, so no more than backfill_db_concurrency loads hit SQL Server at a time.
+    The load itself is load_prelog, an earlier load of the same file_name is replaced.
+
+    Parameter:
+    source_path : str
+        path of the F file on the share
+    file_name : str
+        value of the file_name column, e.g. 'F240308B'
+    folder_date : date
+        date of the daily folder, the import_date of a file never loaded
+
+    Return:
+    dict
+        outcome, never raises so the result always comes back to the main process, example :
+            {'status': 'done', 'rows': 10234, 'import_date': '2024-03-12', 'bytes': 3145728, 'sha256': '...'}
+            {'status': 'invalid', 'error': '... failed validation: ...'}
+            {'status': 'failed', 'error': 'OperationalError: ...'}
+    """
+
+    from OIP_PSB_Runtime import PipelineRuntime
+
+    try:
+        with PrelogFile(source_path) as prelog:
+            try:
+                validation_report = check_prelog(prelog, max_samples=config.validation_max_samples)
+            except ExceptionPrelogValidation as e:
+                return {'status': 'invalid', 'error': str(e)}
+
+            with _db_semaphore, PipelineRuntime() as runtime:
+                import_date, rows = load_prelog(runtime.cnxn, prelog, file_name, folder_date)
+
+        logging.info(f'{source_path} loaded with file_name={file_name} and import_date={import_date}, {rows} rows')
+        return {'status': 'done', 'rows': rows, 'import_date': import_date.isoformat(), 'bytes': validation_report['bytes'], 'sha256': validation_report['sha256']}
+
+    except Exception as e:
+        logging.exception(f'Backfill of {source_path} failed')
+        return {'status': 'failed', 'error': f'{type(e).__name__}: {e}'}
+
+
+class BackfillCheckpoint:
+    """To keep the outcome of every F file of a backfill on disk, so an interrupted backfill resumes where it stopped
+
+    A file is done once it was loaded with the size and mtime it still has on the share, failed and
+    invalid files, and files replaced on the share since their load, are loaded again on the next run.
+
+    Checkpoint layout :
+        {'files': {'2024-03-11/F240308B.TXT': {'status': 'done', 'size': 3145728, 'mtime': 1710137107.0,
+                                              'rows': 10234, 'finished_at': '2024-03-12T09:15:02'}}}
+
+    Example:
+    from OIP_PSB_Backfill import BackfillCheckpoint
+    checkpoint = BackfillCheckpoint('cache/backfill_checkpoint.json')
+    if not checkpoint.is_done('2024-03-11', 'F240308B.TXT', file_info):
+        ...
+        checkpoint.record('2024-03-11', 'F240308B.TXT', file_info, {'status': 'done', 'rows': 10234})
+    """
+
+    def __init__(self, checkpoint_path):
+        self.checkpoint_path = checkpoint_path
+        self.files = {}
+        self.load()
+
+    def load(self):
+        self.files = read_json(self.checkpoint_path, 'backfill checkpoint', {}).get('files', {})
+
+    def save(self):
+        write_json(self.checkpoint_path, {'files': self.files})
+
+    def is_done(self, folder, file_name, file_info):
+        entry = self.files.get(f'{folder}/{file_name}')
+        return entry is not None \
+            and entry['status'] == 'done' \
+            and entry['size'] == file_info['size'] \
+            and entry['mtime'] == file_info['mtime']
+
+    def record(self, folder, file_name, file_info, result):
+        """To record the outcome of a file and save the checkpoint straight away"""
+
+        self.files[f'{folder}/{file_name}'] = {
+            **result,
+            'size': file_info['size'],
+            'mtime': file_info['mtime'],
+            'finished_at': datetime.now().isoformat(timespec='seconds')
+        }
+        self.save()
+
+
+def find_prelogs(manifest, start_date, end_date):
+    """To list every version of every F file in the daily folders from start_date to end_date
+
+    The folders of the range are scanned again, the manifest only rescans the latest folders on a
+    refresh and an old folder may have received files since it was indexed.
+
+    Return:
+    list
+        (folder, file_name) from the oldest folder, latest version first within a folder
+    """
+
+    manifest.refresh()
+    folders = [folder for folder in sorted(manifest.folders) if start_date.isoformat() <= folder <= end_date.isoformat()]
+    for folder in folders:
+        manifest.folders[folder] = manifest.scan_folder(folder)
+    manifest.save()
+
+    return [(folder, file_name) for folder in folders for file_name in manifest.files(folder)]
+
+
+def backfill(start_date, end_date, workers, db_concurrency, checkpoint_path, log_filename, metrics=None):
+    """To load every F file version of a date range into tOIPPreLog3 in parallel
+
+    Files are validated and loaded by a pool of worker processes, at most db_concurrency of them load
+    into SQL Server at the same time. Copies of the same file_name in several folders are loaded one
+    after the other, from the oldest folder, as each load replaces every row of its file_name. The
+    outcome of each file is checkpointed as soon as it is known, files already done are skipped, so
+    running the same backfill again resumes it.
+
+    Parameter:
+    start_date, end_date : date
+        first and last daily folder of the backfill, included
+    workers : int
+        number of worker processes
+    db_concurrency : int
+        maximum number of loads running against SQL Server at the same time
+    checkpoint_path : str
+        JSON checkpoint of the backfill
+    log_filename : str
+        log file the workers log to
+    metrics : RunMetrics
+        stage durations and counters of the backfill, optional
+
+    Return:
+    dict
+        number of files per outcome, example :
+            {'done': 40, 'skipped': 12, 'invalid': 1, 'failed': 0}
+    """
+
+    if metrics is None:
+        metrics = RunMetrics(os.devnull)
+
+    metrics.start_stage('discovery')
+    manifest = PrelogManifest(config.download_directory, config.prelog_manifest_path)
+    prelogs = find_prelogs(manifest, start_date, end_date)
+    print(f'{len(prelogs)} F files found in the daily folders from {start_date} to {end_date}')
+    logging.info(f'{len(prelogs)} F files found in the daily folders from {start_date} to {end_date}: {prelogs}')
+    metrics.count('f_files', len(prelogs))
+
+    checkpoint = BackfillCheckpoint(checkpoint_path)
+    summary = {'done': 0, 'skipped': 0, 'invalid': 0, 'failed': 0}
+    pending = []
+    for folder, file_name in prelogs:
+        if checkpoint.is_done(folder, file_name, manifest.file_info(folder, file_name)):
+            summary['skipped'] += 1
+        else:
+            pending.append((folder, file_name))
+    print(f"{summary['skipped']} F files already loaded by a previous backfill, {len(pending)} to load")
+    logging.info(f"{summary['skipped']} F files already loaded by a previous backfill, {len(pending)} to load")
+
+    metrics.start_stage('backfill')
+    if pending:
+        # One queue per file_name, only the head of each queue is running at a time
+        queues = {}
+        for folder, file_name in pending:
+            queues.setdefault(file_name[0:8], []).append((folder, file_name))
+
+        context = multiprocessing.get_context()
+        db_semaphore = context.BoundedSemaphore(max(1, db_concurrency))
+        with ProcessPoolExecutor(max_workers=max(1, min(workers, len(queues))), mp_context=context,
+                                 initializer=_init_worker, initargs=(db_semaphore, log_filename)) as executor:
+            futures = {}
+
+            def submit_next(queue):
+                folder, file_name = queue.pop(0)
+                future = executor.submit(backfill_prelog, manifest.path(folder, file_name), file_name[0:8], date.fromisoformat(folder))
+                futures[future] = (folder, file_name)
+
+            for queue in queues.values():
+                submit_next(queue)
+
+            completed = 0
+            while futures:
+                future = next(iter(wait(futures, return_when=FIRST_COMPLETED).done))
+                folder, file_name = futures.pop(future)
+                if queues[file_name[0:8]]:
+                    submit_next(queues[file_name[0:8]])
+
+                completed += 1
+                result = future.result()
+                checkpoint.record(folder, file_name, manifest.file_info(folder, file_name), result)
+                summary[result['status']] += 1
+
+                if result['status'] == 'done':
+                    metrics.count('ingested_rows', result['rows'])
+                    metrics.count('validated_bytes', result['bytes'])
+                    print(f"[{completed}/{len(pending)}] {folder}/{file_name} loaded, {result['rows']} rows")
+                    logging.info(f"[{completed}/{len(pending)}] {folder}/{file_name} loaded, {result['rows']} rows")
+                else:
+                    print(f"[{completed}/{len(pending)}] {folder}/{file_name} {result['status']}: {result['error']}")
+                    logging.error(f"[{completed}/{len(pending)}] {folder}/{file_name} {result['status']}: {result['error']}")
+
+    metrics.end_stage()
+    for status, count in summary.items():
+        metrics.count(f'files_{status}', count)
+    return summary
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Load every F file version of a range of daily folders into tOIPPreLog3, resuming an interrupted backfill')
+    parser.add_argument('--start', required=True, type=date.fromisoformat, help='first daily folder, yyyy-mm-dd')
+    parser.add_argument('--end', required=True, type=date.fromisoformat, help='last daily folder, yyyy-mm-dd, included')
+    parser.add_argument('--workers', type=int, default=config.backfill_workers, help='number of worker processes validating and loading files')
+    parser.add_argument('--db-concurrency', type=int, default=config.backfill_db_concurrency, help='maximum number of files loaded into SQL Server at the same time')
+    parser.add_argument('--checkpoint', default=config.backfill_checkpoint_path, help='JSON checkpoint, kept between runs to resume the backfill')
+    parser.add_argument('--restart', action='store_true', help='ignore the checkpoint and load every file again')
+    args = parser.parse_args()
+
+    if args.end < args.start:
+        parser.error('--end is before --start')
+
+    log_filename = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'log', f"Backfill_{datetime.now().strftime('%Y-%m-%d %H-%M-%S')}.txt")
+    logging.basicConfig(filename=log_filename, level=logging.INFO)
+    metrics = RunMetrics(f'{os.path.splitext(log_filename)[0]}.json')
+
+    if args.restart and os.path.isfile(args.checkpoint):
+        os.remove(args.checkpoint)
+        logging.info(f'Backfill checkpoint {args.checkpoint} removed, every file is loaded again')
+
+    summary = backfill(args.start, args.end, args.workers, args.db_concurrency, args.checkpoint, log_filename, metrics)
+    metrics.finish('success' if summary['failed'] == 0 and summary['invalid'] == 0 else 'failed')
+
+    print(f'Backfill from {args.start} to {args.end} finished: {summary}')
+    logging.info(f'Backfill from {args.start} to {args.end} finished: {summary}')
+    sys.exit(0 if summary['failed'] == 0 and summary['invalid'] == 0 else 1)
@@ -0,0 +1,315 @@
+import argparse
+from datetime import date, datetime, timedelta
+import json
+import math
+import os
+import platform
+import random
+import sqlite3
+import statistics
+import time
+import pandas as pd
+from OIP_PSB_Discovery import PrelogManifest
+from OIP_PSB_Ingest import TABLE_COLUMNS, ingest_prelog_python
+from OIP_PSB_Metrics import peak_memory_bytes
+from OIP_PSB_Parser import PrelogFile
+from OIP_PSB_ReportModel import NULL_DISPLAY, SECONDARY_REPORT_COLUMN_TYPES, date_columns, shape_report_frame
+from OIP_PSB_ReportWriter import ReportWorkbookWriter
+from OIP_PSB_Validate import validate_prelog
+
+# Stages benchmarked, in run order
+STAGES = ['discovery', 'parse', 'validation', 'ingest', 'report_query', 'report_shape', 'workbook']
+
+# Value pools of the synthetic prelog, close to what the real F files contain
+CHANNEL_BELTS = ['Free-To-Air', 'Pay TV', 'Radio']
+SLOT_NAMES = ['Morning Belt', 'Afternoon Belt', 'Prime Time', 'Late Night', 'Overnight']
+GENRES = {
+    'Drama': ['Local Drama', 'Foreign Drama', 'Telemovie'],
+    'News': ['Local News', 'World News', 'Current Affairs'],
+    'Documentary': ['Nature', 'History', 'Lifestyle'],
+    'Entertainment': ['Variety', 'Reality', 'Talk Show'],
+    'Sports': ['Football', 'Badminton', 'Multi-Sports']
+}
+TITLES = [
+    'What on Earth S2', 'Let Me Tell You A Story', 'Oh Butterfly!', 'Measuring Meritocracy', 'Space Farmers',
+    'MasterChef Singapore Season 4', 'The Great Migration: New Eden', 'Pesuvom Sr 2', 'Untold Legends',
+    'The Roots Of Our Garden', 'News Tonight', 'Singapore Tonight', 'Asian Games 2023', 'Sunday Matinee'
+]
+LANGUAGES = ['English', 'Mandarin', 'Malay', 'Tamil']
+COUNTRIES = ['Singapore', 'Malaysia', 'Korea', 'Japan', 'United Kingdom', 'United States']
+PRODUCTION_TYPES = ['Local', 'Acquired', 'Co-Production']
+
+
+def generate_prelog(path, rows, seed=42, start_date=date(2024, 3, 2), days=7):
+    """To write a synthetic tab delimited F prelog file with the 25 PRELOG_COLUMNS
+
+    Rows are written channel by channel and day by day with increasing START_TIME, so CHANNEL_ID,
+    TX_DATE, START_TIME stay unique like in the real files. The number of channels grows with the
+    number of rows to keep the file within days days. The same rows and seed give the same file.
+
+    Parameter:
+    path : str
+        F file to write
+    rows : int
+        number of rows
+    seed : int
+        seed of the random generator
+    start_date : date
+        first TX_DATE
+    days : int
+        number of TX_DATE days covered
+
+    Example:
+    generate_prelog('share/2024-03-11/F080324A.TXT', 70000, seed=42)
+    """
+
+    generator = random.Random(seed)
+    channels = max(20, math.ceil(rows / (days * 80)))
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+
+    written = 0
+    with open(path, 'w', encoding='utf-8', newline='\r\n') as file:
+        while written < rows:
+            for day in range(days):
+                tx_date = (start_date + timedelta(days=day)).strftime('%Y%m%d')
+                for channel in range(channels):
+                    start_time = 0
+                    while start_time < 86400 and written < rows:
+                        duration = generator.choice([30, 60, 300, 900, 1800, 1800, 3600])
+                        genre = generator.choice(list(GENRES))
+                        title = generator.choice(TITLES)
+                        # A few programme ids are not numeric, like the Asian Games ones
+                        programme_id = f'AG-{generator.randint(1, 999)}' if title == 'Asian Games 2023' else str(generator.randint(100000, 999999))
+                        values = [
+                            f'{channel + 1:04d}',
+                            generator.choice(CHANNEL_BELTS),
+                            tx_date,
+                            f'{start_time // 3600:02d}{start_time % 3600 // 60:02d}{start_time % 60:02d}',
+                            str(duration),
+                            generator.choice(SLOT_NAMES),
+                            title,
+                            f'Episode {generator.randint(1, 200)}',
+                            genre,
+                            generator.choice(GENRES[genre]),
+                            generator.choice(['Y', 'N']),
+                            generator.choice(['Y', 'N', 'N', 'N']),
+                            generator.choice(LANGUAGES + ['']),
+                            programme_id,
+                            generator.choice(COUNTRIES),
+                            generator.choice(LANGUAGES),
+                            generator.choice(PRODUCTION_TYPES),
+                            str(generator.randint(1, 100)),
+                            generator.choice(['Y', 'N', '']),
+                            '' if generator.random() < 0.9 else str(generator.randint(100000, 999999)),
+                            str(generator.randint(10 ** 7, 10 ** 8 - 1)),
+                            f'MRK{generator.randint(1, 10 ** 6):07d}',
+                            generator.choice(['Series', 'Special', 'Film', '']),
+                            generator.choice(['Y', 'N']),
+                            generator.choice(LANGUAGES + ['', '', ''])
+                        ]
+                        file.write('\t'.join(values) + '\n')
+                        written += 1
+                        start_time += duration
+                    if written >= rows:
+                        break
+                if written >= rows:
+                    break
+            # Beyond days days, shift to the following week to keep the keys unique
+            start_date += timedelta(days=days)
+
+    return path
+
+
+def generate_share(directory_path, rows, seed=42, folders=30, run_date=date(2024, 3, 11)):
+    """To build a download share of dated folders, the latest one holding the synthetic F file of rows rows
+
+    Older folders hold small F files of older weeks, so discovery has history to go through.
+
+    Return:
+    str
+        path of the latest F file
+    """
+
+    generator = random.Random(seed)
+    for offset in range(folders - 1, 0, -1):
+        folder_date = run_date - timedelta(days=offset)
+        if generator.random() < 0.3:
+            file_date = folder_date - timedelta(days=3)
+            generate_prelog(os.path.join(directory_path, folder_date.strftime('%Y-%m-%d'), f"F{file_date.strftime('%y%m%d')}A.TXT"), 100, seed=seed + offset)
+        else:
+            os.makedirs(os.path.join(directory_path, folder_date.strftime('%Y-%m-%d')), exist_ok=True)
+
+    file_date = run_date - timedelta(days=3)
+    latest_folder = os.path.join(directory_path, run_date.strftime('%Y-%m-%d'))
+    generate_prelog(os.path.join(latest_folder, f"F{file_date.strftime('%y%m%d')}A.TXT"), max(1, rows // 10), seed=seed - 1)
+    return generate_prelog(os.path.join(latest_folder, f"F{file_date.strftime('%y%m%d')}B.TXT"), rows, seed=seed, start_date=file_date - timedelta(days=6))
+
+
+class SQLiteConnection:
+    """To stand in for the pyodbc connection of SGTAMProdOIP with sqlite3, for the ingest and report stages
+
+    The cursor accepts fast_executemany like a pyodbc cursor, tOIPPreLog3 is created with the
+    columns of TABLE_COLUMNS.
+    """
+
+    class Cursor:
+        def __init__(self, cursor):
+            self._cursor = cursor
+            self.fast_executemany = False
+
+        def __getattr__(self, name):
+            return getattr(self._cursor, name)
+
+    def __init__(self, database=':memory:'):
+        sqlite3.register_adapter(date, date.isoformat)
+        self.connection = sqlite3.connect(database)
+        self.connection.execute(f"CREATE TABLE tOIPPreLog3 ({', '.join(TABLE_COLUMNS)})")
+
+    def cursor(self):
+        return self.Cursor(self.connection.cursor())
+
+    def __getattr__(self, name):
+        return getattr(self.connection, name)
+
+
+def run_stage(results, name, repeat, function):
+    """To run a stage repeat times and record its durations
+
+    Return:
+    object
+        result of the last run of function
+    """
+
+    durations = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = function()
+        durations.append(time.perf_counter() - start)
+
+    results[name] = {
+        'durations': [round(duration, 4) for duration in durations],
+        'min': round(min(durations), 4),
+        'median': round(statistics.median(durations), 4),
+        'peak_memory_bytes': peak_memory_bytes()
+    }
+    print(f"{name:<14} min {results[name]['min']:>9.3f}s  median {results[name]['median']:>9.3f}s")
+    return result
+
+
+def benchmark(work_directory, rows, seed=42, repeat=3, folders=30, batch_size=10000, stages=STAGES):
+    """To benchmark the pipeline stages on a synthetic prelog of rows rows
+
+    The synthetic share is generated once per rows and seed under work_directory and reused by later
+    benchmarks. Ingest only covers the python engine in reload mode, delta and swap use T-SQL that
+    the sqlite stand-in does not support.
+
+    Return:
+    dict
+        durations per stage, with rows per second
+    """
+
+    directory_path = os.path.join(work_directory, f'share_{rows}_{seed}')
+    latest_F_file = None
+    if os.path.isdir(directory_path):
+        latest_folder = max(os.listdir(directory_path))
+        latest_F_file = os.path.join(directory_path, latest_folder, max(os.listdir(os.path.join(directory_path, latest_folder))))
+    if latest_F_file is None or not latest_F_file.upper().endswith('B.TXT'):
+        print(f'Generating a synthetic share with {rows} rows in {directory_path}')
+        latest_F_file = generate_share(directory_path, rows, seed=seed, folders=folders)
+
+    file_name = os.path.basename(latest_F_file)[0:8]
+    results = {}
+    state = {}
+
+    if 'discovery' in stages:
+        manifest_path = os.path.join(work_directory, f'manifest_{rows}_{seed}.json')
+
+        def discovery():
+            # Every repetition is a cold scan of the whole share
+            if os.path.isfile(manifest_path):
+                os.remove(manifest_path)
+            manifest = PrelogManifest(directory_path, manifest_path)
+            manifest.refresh()
+            return manifest.files(manifest.latest_folder())
+        run_stage(results, 'discovery', repeat, discovery)
+
+    if 'parse' in stages:
+        def parse():
+            with PrelogFile(latest_F_file) as prelog:
+                return sum(1 for _ in prelog.iter_records())
+        run_stage(results, 'parse', repeat, parse)
+
+    if 'validation' in stages:
+        run_stage(results, 'validation', repeat, lambda: validate_prelog(latest_F_file))
+
+    if any(stage in stages for stage in ['ingest', 'report_query', 'report_shape', 'workbook']):
+        def ingest():
+            state['cnxn'] = SQLiteConnection()
+            return ingest_prelog_python(state['cnxn'], latest_F_file, file_name, date(2024, 3, 11), batch_size=batch_size)
+        # The later stages need the loaded table, it is loaded once without timing if ingest is not benchmarked
+        if 'ingest' in stages:
+            run_stage(results, 'ingest', repeat, ingest)
+        else:
+            ingest()
+
+        def report_query():
+            return pd.read_sql('SELECT * FROM tOIPPreLog3', state['cnxn'].connection)
+        if 'report_query' in stages:
+            state['df'] = run_stage(results, 'report_query', repeat, report_query)
+        else:
+            state['df'] = report_query()
+
+    if 'report_shape' in stages or 'workbook' in stages:
+        def report_shape():
+            return shape_report_frame(state['df'].copy(), SECONDARY_REPORT_COLUMN_TYPES)
+        if 'report_shape' in stages:
+            shaped = run_stage(results, 'report_shape', repeat, report_shape)
+        else:
+            shaped = report_shape()
+
+        if 'workbook' in stages:
+            def workbook():
+                writer = ReportWorkbookWriter(os.path.join(work_directory, f'report_{rows}_{seed}.xlsx'), null_value=NULL_DISPLAY)
+                writer.write_frame(file_name, shaped, date_columns=date_columns(SECONDARY_REPORT_COLUMN_TYPES))
+                writer.save()
+            run_stage(results, 'workbook', repeat, workbook)
+
+    for name, result in results.items():
+        result['rows_per_second'] = round(rows / result['median']) if result['median'] > 0 else None
+
+    return {
+        'rows': rows,
+        'file': latest_F_file,
+        'bytes': os.path.getsize(latest_F_file),
+        'stages': results
+    }
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark the weekly report pipeline stages on synthetic F prelog files')
+    parser.add_argument('--rows', type=int, nargs='+', default=[70000], help='rows of the synthetic F file, several sizes can be given')
+    parser.add_argument('--seed', type=int, default=42, help='seed of the synthetic data, same seed gives the same files')
+    parser.add_argument('--repeat', type=int, default=3, help='runs of each stage, the median is reported')
+    parser.add_argument('--folders', type=int, default=30, help='daily folders of the synthetic share')
+    parser.add_argument('--batch-size', type=int, default=10000, help='rows per executemany batch of the ingest stage')
+    parser.add_argument('--stages', nargs='+', default=STAGES, choices=STAGES, help='stages to benchmark')
+    parser.add_argument('--work-directory', default=os.path.join(os.path.dirname(os.path.abspath(__file__)), 'cache', 'benchmark'), help='synthetic shares and outputs')
+    parser.add_argument('--output', default=None, help='JSON results, default benchmark_<timestamp>.json in the work directory')
+    args = parser.parse_args()
+
+    os.makedirs(args.work_directory, exist_ok=True)
+    output = args.output or os.path.join(args.work_directory, f"benchmark_{datetime.now().strftime('%Y-%m-%d %H-%M-%S')}.json")
+    results = {
+        'started_at': datetime.now().isoformat(timespec='seconds'),
+        'parameters': {key: value for key, value in vars(args).items() if key != 'output'},
+        'environment': {'python': platform.python_version(), 'pandas': pd.__version__, 'platform': platform.platform()},
+        'runs': []
+    }
+
+    for rows in args.rows:
+        print(f'--- {rows} rows ---')
+        results['runs'].append(benchmark(args.work_directory, rows, seed=args.seed, repeat=args.repeat, folders=args.folders, batch_size=args.batch_size, stages=args.stages))
+
+    with open(output, 'w', encoding='utf-8') as file:
+        json.dump(results, file, indent=1)
+    print(f'Results written to {output}')
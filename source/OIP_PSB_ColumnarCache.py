@@ -0,0 +1,166 @@
+import importlib.util
+import json
+import logging
+import os
+import time
+from OIP_PSB_Ingest import TX_DATE_INDEX, parse_tx_date
+from OIP_PSB_Parser import PRELOG_COLUMNS, PrelogColumns
+
+
+class PrelogColumnarCache:
+    """To keep every parsed and validated F prelog as a typed Parquet artifact
+
+    Artifacts are keyed by file name and sha256 of the content, e.g. F240308B_9f86d081884c7d65.parquet,
+    TX_DATE is stored as a date and the other columns as strings. The validation report is kept in the
+    Parquet metadata, so a re-run of a prelog that was already validated loads the artifact instead of
+    parsing and validating the text file again. Artifacts are evicted by age and by number of files.
+
+    pyarrow is optional, without it the cache is disabled and the text file is always parsed.
+
+    Example:
+    from OIP_PSB_ColumnarCache import PrelogColumnarCache
+    cache = PrelogColumnarCache('D:/prelogParquet', max_age_days=365)
+    prelog = cache.load('F240308B.TXT', sha256)
+    if prelog is None:
+        prelog = PrelogFile('F240308B.TXT')
+        report = check_prelog(prelog)
+        cache.store('F240308B.TXT', sha256, prelog, report)
+    """
+
+    def __init__(self, cache_directory, max_age_days=None, max_files=None, batch_rows=100000):
+        self.cache_directory = cache_directory
+        self.max_age_days = max_age_days
+        self.max_files = max_files
+        self.batch_rows = batch_rows
+
+    @property
+    def available(self):
+        return importlib.util.find_spec('pyarrow') is not None
+
+    def artifact_path(self, file_name, sha256):
+        return os.path.join(self.cache_directory, f"{os.path.splitext(file_name)[0]}_{sha256[:16]}.parquet")
+
+    def _schema(self, validation_report=None):
+        import pyarrow as pa
+
+        fields = [pa.field(column, pa.date32() if index == TX_DATE_INDEX else pa.string()) for index, column in enumerate(PRELOG_COLUMNS)]
+        metadata = None if validation_report is None else {b'validation_report': json.dumps(validation_report).encode('utf-8')}
+        return pa.schema(fields, metadata=metadata)
+
+    def load(self, file_name, sha256):
+        """To load the artifact of a prelog
+
+        Return:
+        PrelogColumns
+            typed columns read lazily from the artifact, with the stored validation report as validation_report attribute,
+            None if there is no artifact for this file name and content
+        """
+
+        path = self.artifact_path(file_name, sha256)
+        if not self.available or not os.path.isfile(path):
+            return None
+
+        import pyarrow.parquet as pq
+
+        try:
+            parquet_file = pq.ParquetFile(path)
+        except Exception as e:
+            logging.warning(f'Ignoring unreadable columnar cache artifact {path}: {e}')
+            return None
+
+        # Row groups are only read and converted while the prelog is iterated
+        prelog = PrelogColumns(path, parquet_file, batch_rows=self.batch_rows)
+        metadata = parquet_file.schema_arrow.metadata or {}
+        prelog.validation_report = json.loads(metadata[b'validation_report']) if b'validation_report' in metadata else None
+        os.utime(path)
+        logging.info(f'Opened {file_name} from columnar cache {path}, {parquet_file.metadata.num_rows} rows')
+        return prelog
+
+    def store(self, file_name, sha256, prelog, validation_report=None):
+        """To write the artifact of a prelog in row groups of batch_rows rows
+
+        Parameter:
+        file_name : str
+            F file name, e.g. 'F240308B.TXT'
+        sha256 : str
+            sha256 of the F file content
+        prelog : PrelogFile
+            the parsed prelog, streamed so the whole file is never held in memory
+        validation_report : dict
+            report of check_prelog, stored in the Parquet metadata
+
+        Return:
+        str
+            artifact path, None if pyarrow is not installed
+        """
+
+        if not self.available:
+            logging.info('pyarrow is not installed, columnar cache disabled')
+            return None
+
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        os.makedirs(self.cache_directory, exist_ok=True)
+        path = self.artifact_path(file_name, sha256)
+        temp_path = f'{path}.tmp'
+        schema = self._schema(validation_report)
+
+        def write_batch(writer, rows):
+            arrays = [list(column) for column in zip(*rows)]
+            arrays[TX_DATE_INDEX] = [parse_tx_date(value) for value in arrays[TX_DATE_INDEX]]
+            writer.write_table(pa.Table.from_arrays(arrays, schema=schema))
+
+        try:
+            with pq.ParquetWriter(temp_path, schema, compression='zstd') as writer:
+                rows = []
+                for values in prelog.iter_records():
+                    rows.append(values)
+                    if len(rows) >= self.batch_rows:
+                        write_batch(writer, rows)
+                        rows = []
+                if rows:
+                    write_batch(writer, rows)
+        except BaseException:
+            # A failed write leaves no half written artifact behind
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            raise
+
+        os.replace(temp_path, path)
+        logging.info(f'Stored {file_name} in columnar cache {path}')
+        return path
+
+    def evict(self, keep=()):
+        """To remove artifacts not used for max_age_days and the oldest ones above max_files
+
+        Return:
+        list
+            artifact paths evicted
+        """
+
+        if not os.path.isdir(self.cache_directory):
+            return []
+
+        keep = {os.path.abspath(path) for path in keep}
+        artifacts = sorted(
+            (entry.stat().st_mtime, entry.path) for entry in os.scandir(self.cache_directory)
+            if entry.name.endswith('.parquet') and os.path.abspath(entry.path) not in keep
+        )
+        evicted = []
+
+        if self.max_age_days is not None:
+            oldest_allowed = time.time() - self.max_age_days * 86400
+            evicted += [path for mtime, path in artifacts if mtime < oldest_allowed]
+
+        if self.max_files is not None:
+            remaining = [path for mtime, path in artifacts if path not in evicted]
+            excess = len(remaining) + len(keep) - self.max_files
+            if excess > 0:
+                evicted += remaining[:excess]
+
+        for path in evicted:
+            os.remove(path)
+        if evicted:
+            logging.info(f'Evicted from columnar cache: {evicted}')
+        return evicted
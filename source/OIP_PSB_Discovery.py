@@ -0,0 +1,127 @@
+from datetime import datetime
+import logging
+import os
+import re
+from OIP_PSB_JsonFile import read_json, write_json
+
+# Daily folders created in the download share, e.g. 2024-03-11
+DATED_FOLDER_PATTERN = re.compile(r'^\d{4}-\d{2}-\d{2}$')
+
+# F prelog files, e.g. F240308B.TXT (F + yymmdd + version)
+F_FILE_PATTERN = re.compile(r'^F\d{6}[A-Za-z0-9]*\.TXT$', re.IGNORECASE)
+
+
+def extract_date_and_version(file_name):
+    """To extract the date and version from a F file name, e.g. F240308B.TXT -> (2024-03-08, 'B')"""
+
+    date_str = file_name[1:7]  # Extract the date part (e.g., '230818') from the file name
+    version_str = file_name[7:-4]  # Extract the version part (e.g., 'A') from the file name
+    return datetime.strptime(date_str, "%y%m%d"), version_str
+
+
+def is_dated_folder(name):
+    """To check if a folder name is a valid yyyy-mm-dd daily folder, for any year"""
+
+    if not DATED_FOLDER_PATTERN.match(name):
+        return False
+    try:
+        datetime.strptime(name, "%Y-%m-%d")
+        return True
+    except ValueError:
+        return False
+
+
+class PrelogManifest:
+    """To keep a persisted index of the dated folders of the prelog download share and their F files
+
+    Only the root of the share is listed on every refresh, the content of a daily folder is only
+    scanned when the folder is new or is the latest one already known (files can still arrive in it),
+    so the cost of a run no longer grows with the history kept on the share.
+
+    Manifest layout :
+        {'directory_path': 'J:\\',
+         'folders': {'2024-03-11': {'F240308B.TXT': {'version': 'B', 'size': 3145728, 'mtime': 1710137107.0}}}}
+
+    Example:
+    from OIP_PSB_Discovery import PrelogManifest
+    manifest = PrelogManifest('J:\\', 'prelog_manifest.json')
+    manifest.refresh()
+    print(manifest.latest_folder(), manifest.files(manifest.latest_folder()))
+    """
+
+    def __init__(self, directory_path, manifest_path):
+        self.directory_path = directory_path
+        self.manifest_path = manifest_path
+        self.folders = {}
+        self.load()
+
+    def load(self):
+        """To load the manifest, a manifest made for another share starts empty"""
+
+        manifest = read_json(self.manifest_path, 'prelog manifest', {})
+        self.folders = manifest.get('folders', {}) if manifest.get('directory_path') == self.directory_path else {}
+
+    def save(self):
+        write_json(self.manifest_path, {'directory_path': self.directory_path, 'folders': self.folders})
+
+    def scan_folder(self, folder):
+        """To list the F files of a daily folder with their version, size and mtime"""
+
+        files = {}
+        with os.scandir(os.path.join(self.directory_path, folder)) as entries:
+            for entry in entries:
+                if not F_FILE_PATTERN.match(entry.name) or not entry.is_file():
+                    continue
+                try:
+                    extract_date_and_version(entry.name)
+                except ValueError:
+                    logging.warning(f'Ignoring {folder}/{entry.name}, its name does not hold a valid yymmdd date')
+                    continue
+                stat = entry.stat()
+                files[entry.name] = {'version': entry.name[7:-4], 'size': stat.st_size, 'mtime': stat.st_mtime}
+        return files
+
+    def refresh(self):
+        """To bring the manifest up to date with the share, rescanning only the latest known and new folders
+
+        Return:
+        list
+            daily folders that were scanned
+        """
+
+        with os.scandir(self.directory_path) as entries:
+            dated_folders = sorted(entry.name for entry in entries if is_dated_folder(entry.name) and entry.is_dir())
+
+        # Folders removed from the share are dropped from the manifest
+        for folder in set(self.folders) - set(dated_folders):
+            del self.folders[folder]
+
+        latest_known = max(self.folders) if self.folders else None
+        folders_to_scan = [folder for folder in dated_folders if latest_known is None or folder >= latest_known]
+
+        for folder in folders_to_scan:
+            self.folders[folder] = self.scan_folder(folder)
+        logging.info(f'Prelog manifest refreshed, scanned {folders_to_scan}')
+
+        self.save()
+        return folders_to_scan
+
+    def latest_folder(self):
+        """To get the latest daily folder, None if there is none"""
+
+        return max(self.folders) if self.folders else None
+
+    def files(self, folder):
+        """To get the F files of a daily folder sorted from latest to oldest version"""
+
+        return sorted(self.folders.get(folder, {}), key=extract_date_and_version, reverse=True)
+
+    def file_info(self, folder, file_name):
+        """To get the version, size and mtime recorded for a F file"""
+
+        return self.folders[folder][file_name]
+
+    def path(self, folder, file_name):
+        """To get the full path of a F file on the share"""
+
+        return os.path.join(self.directory_path, folder, file_name)
@@ -0,0 +1,411 @@
+from datetime import date, datetime
+from decimal import Decimal
+import logging
+import re
+import uuid
+from OIP_PSB_Parser import PRELOG_COLUMNS, open_prelog
+
+# Columns of tOIPPreLog3, file_name and import_date are added in front of the prelog columns on import
+TABLE_COLUMNS = ["file_name", "import_date"] + PRELOG_COLUMNS
+
+TX_DATE_INDEX = PRELOG_COLUMNS.index("TX_DATE")
+
+# Text compared as a number by the delta ingest in key and numeric columns, e.g. '0600' or '12.50'
+NUMBER_PATTERN = re.compile(r'^[+-]?\d+(\.\d+)?$')
+
+
+def parse_tx_date(value):
+    """To convert a TX_DATE string in yyyyMMdd format to date, returns None if it cannot be parsed (same as Spark to_date)"""
+
+    # Already typed, e.g. read back from the columnar cache
+    if isinstance(value, date):
+        return value
+    # strptime also accepts '2024038' or '202438', Spark only parses exactly 8 digits
+    if not isinstance(value, str) or len(value) != 8 or not value.isdigit():
+        return None
+    try:
+        return datetime.strptime(value, "%Y%m%d").date()
+    except (TypeError, ValueError):
+        return None
+
+
+def read_prelog_rows(csv_file_path, file_name, import_date):
+    """To stream the rows of a F prelog file as tuples ready to be inserted into tOIPPreLog3
+
+    Parameter:
+    csv_file_path : str or PrelogFile
+        path of the tab delimited F prelog file, or the PrelogFile already opened for it
+    file_name : str
+        value of the file_name column, e.g. 'F240308B'
+    import_date : date
+        value of the import_date column
+
+    Return:
+    generator
+        one tuple per non-empty line, in the order of TABLE_COLUMNS.
+        empty fields become None and TX_DATE is converted from yyyyMMdd to date.
+    """
+
+    # Same as Spark with a fixed schema, missing fields are null and extra fields are dropped
+    with open_prelog(csv_file_path) as prelog:
+        for values in prelog.iter_records():
+            values = list(values)
+            values[TX_DATE_INDEX] = parse_tx_date(values[TX_DATE_INDEX])
+            yield (file_name, import_date, *values)
+
+
+def ingest_prelog_python(cnxn, csv_file_path, file_name, import_date, batch_size=10000, table='tOIPPreLog3'):
+    """To load a F prelog file into tOIPPreLog3 over pyodbc without Spark
+
+    The file is streamed and inserted in batches of batch_size rows with fast_executemany,
+    all batches are committed in a single transaction so a failure leaves no partial load behind.
+
+    Parameter:
+    cnxn : pyodbc.Connection
+        open connection to the prelog database
+    csv_file_path : str or PrelogFile
+        path of the tab delimited F prelog file, or the PrelogFile already opened for it
+    file_name : str
+        value of the file_name column, e.g. 'F240308B'
+    import_date : date
+        value of the import_date column
+    batch_size : int
+        number of rows sent per executemany call
+    table : str
+        target table
+
+    Return:
+    int
+        number of rows inserted
+    """
+
+    query_insert = f"INSERT INTO {table} ({', '.join(TABLE_COLUMNS)}) VALUES ({', '.join(['?'] * len(TABLE_COLUMNS))})"
+
+    cursor = cnxn.cursor()
+    cursor.fast_executemany = True
+    row_count = 0
+    batch = []
+    try:
+        for row in read_prelog_rows(csv_file_path, file_name, import_date):
+            batch.append(row)
+            if len(batch) >= batch_size:
+                cursor.executemany(query_insert, batch)
+                row_count += len(batch)
+                logging.info(f'Inserted {row_count} rows into {table}')
+                batch = []
+
+        if batch:
+            cursor.executemany(query_insert, batch)
+            row_count += len(batch)
+
+        cnxn.commit()
+    except Exception:
+        cnxn.rollback()
+        raise
+    finally:
+        cursor.close()
+
+    return row_count
+
+
+# Columns identifying a programme slot across versions of the same prelog
+ROW_KEY_COLUMNS = ["CHANNEL_ID", "TX_DATE", "START_TIME"]
+
+
+def find_previous_load(cnxn, file_name, table='tOIPPreLog3'):
+    """To find the latest load of any version of the same prelog, e.g. F240308A when loading F240308B
+
+    Parameter:
+    cnxn : pyodbc.Connection
+        open connection to the prelog database
+    file_name : str
+        file_name being loaded, the first 7 characters (F + yymmdd) identify the prelog
+    table : str
+        prelog table
+
+    Return:
+    tuple
+        (file_name, import_date) of the latest load, None if the prelog was never loaded
+    """
+
+    query_previous = f"""
+    SELECT TOP 1 file_name, import_date FROM {table}
+    WHERE file_name LIKE ?
+    ORDER BY import_date DESC, file_name DESC
+    """
+
+    cursor = cnxn.cursor()
+    try:
+        cursor.execute(query_previous, f"{file_name[0:7]}%")
+        row = cursor.fetchone()
+    finally:
+        cursor.close()
+
+    return None if row is None else (row[0], _normalize_value(row[1], numeric=False))
+
+
+def _row_key(values):
+    """To get the ROW_KEY_COLUMNS values of a row of PRELOG_COLUMNS values"""
+
+    return tuple(values[PRELOG_COLUMNS.index(column)] for column in ROW_KEY_COLUMNS)
+
+
+def _normalize_value(value, numeric):
+    """To compare a value parsed from the file with the value read back from SQL Server
+
+    Dates and datetimes become dates. In a numeric column (numeric is True), numbers and numeric
+    text become Decimal so '0600', 600 and 600.0 are equal, any other value is kept as it is and
+    text is compared exactly by _same_values.
+    """
+
+    if value is None:
+        return None
+    if isinstance(value, datetime):
+        return value.date()
+    if isinstance(value, date) or not numeric:
+        return value
+    if isinstance(value, (int, float, Decimal)) and not isinstance(value, bool):
+        return Decimal(str(value))
+    if isinstance(value, str) and NUMBER_PATTERN.match(value.strip()):
+        return Decimal(value.strip())
+    return value
+
+
+def _numeric_columns(rows):
+    """To get the key columns and the columns SQL Server returned numbers for, compared as numbers by the delta ingest"""
+
+    numeric = set(ROW_KEY_COLUMNS)
+    for index, column in enumerate(PRELOG_COLUMNS):
+        values = [row[index] for row in rows if row[index] is not None]
+        if values and all(isinstance(value, (int, float, Decimal)) and not isinstance(value, bool) for value in values):
+            numeric.add(column)
+    return numeric
+
+
+def _same_values(old, new):
+    """To compare normalized values of the table (old) and of the file (new)
+
+    Text is compared exactly, only the trailing spaces a CHAR column pads the stored value with are ignored.
+    """
+
+    return all(
+        old_value == new_value or (isinstance(old_value, str) and isinstance(new_value, str) and old_value.rstrip(' ') == new_value)
+        for old_value, new_value in zip(old, new)
+    )
+
+
+def _index_rows(rows, numeric_columns):
+    """To index rows of PRELOG_COLUMNS values by their normalized key
+
+    Return:
+    dict
+        normalized key -> (values, normalized values), None if a key is duplicated or incomplete
+    """
+
+    numeric = [column in numeric_columns for column in PRELOG_COLUMNS]
+    indexed = {}
+    for values in rows:
+        normalized = tuple(_normalize_value(value, is_numeric) for value, is_numeric in zip(values, numeric))
+        key = _row_key(normalized)
+        if None in key or key in indexed:
+            return None
+        indexed[key] = (values, normalized)
+    return indexed
+
+
+def ingest_prelog_delta(cnxn, csv_file_path, file_name, import_date, batch_size=10000, table='tOIPPreLog3'):
+    """To load a new version of a F prelog file by sending only its differences to the previous load
+
+    Rows are keyed by CHANNEL_ID, TX_DATE and START_TIME. Key columns and the columns SQL Server
+    returns as numbers are compared as numbers, dates as dates and text exactly (see _normalize_value
+    and _same_values), so the result is the same as a full reload of the file. When the previous
+    load has another file_name / import_date, it is kept as it is and its rows are copied under the
+    new file_name / import_date by a single INSERT ... SELECT on the server. The removed rows are then
+    deleted, the changed rows updated and the new rows inserted under the new file_name / import_date,
+    all in a single transaction, so only the changed rows are sent over the connection. The transaction
+    is rolled back if the rows touched by the statements are not the rows of the diff.
+
+    It falls back to ingest_prelog_python (full insert, after removing the rows of the same
+    file_name / import_date) when there is no previous load or when the keys are not unique.
+
+    Parameter:
+    cnxn : pyodbc.Connection
+        open connection to the prelog database
+    csv_file_path : str or PrelogFile
+        path of the tab delimited F prelog file, or the PrelogFile already opened for it
+    file_name : str
+        value of the file_name column, e.g. 'F240308B'
+    import_date : date
+        value of the import_date column
+    batch_size : int
+        number of rows sent per executemany call
+    table : str
+        target table
+
+    Return:
+    dict
+        number of rows per change, copied is the number of rows of the previous load copied on the server, example :
+            {'previous_load': ('F240308A', date(2024, 3, 8)), 'copied': 10233, 'inserted': 12, 'updated': 40,
+             'removed': 3, 'unchanged': 10180, 'full_reload': False}
+    """
+
+    result = {'previous_load': None, 'copied': 0, 'inserted': 0, 'updated': 0, 'removed': 0, 'unchanged': 0, 'full_reload': False}
+    key_filter = ' AND '.join(f"{column} = ?" for column in ROW_KEY_COLUMNS)
+
+    previous_load = find_previous_load(cnxn, file_name, table=table)
+    result['previous_load'] = previous_load
+
+    old_rows = new_rows = None
+    if previous_load is not None:
+        query_existing = f"SELECT {', '.join(PRELOG_COLUMNS)} FROM {table} WHERE file_name = ? AND import_date = ?"
+        cursor = cnxn.cursor()
+        try:
+            cursor.execute(query_existing, *previous_load)
+            existing = [tuple(row) for row in cursor.fetchall()]
+        finally:
+            cursor.close()
+
+        numeric_columns = _numeric_columns(existing)
+        old_rows = _index_rows(existing, numeric_columns)
+        new_rows = _index_rows((row[2:] for row in read_prelog_rows(csv_file_path, file_name, import_date)), numeric_columns)
+
+    if old_rows is None or new_rows is None:
+        reason = 'no previous load of this prelog' if previous_load is None else 'row keys are not unique'
+        logging.info(f'Delta ingest not possible for {file_name} ({reason}), loading the full file')
+        cursor = cnxn.cursor()
+        try:
+            cursor.execute(f"DELETE FROM {table} WHERE file_name = ? AND import_date = ?", file_name, import_date)
+        finally:
+            cursor.close()
+        result['inserted'] = ingest_prelog_python(cnxn, csv_file_path, file_name, import_date, batch_size=batch_size, table=table)
+        result['full_reload'] = True
+        return result
+
+    # Keys of the removed rows are taken from the table, with their column types
+    removed = [_row_key(old_rows[key][0]) for key in old_rows if key not in new_rows]
+    inserted = [values for key, (values, _) in new_rows.items() if key not in old_rows]
+    updated = [values for key, (values, normalized) in new_rows.items() if key in old_rows and not _same_values(old_rows[key][1], normalized)]
+    result['removed'] = len(removed)
+    result['inserted'] = len(inserted)
+    result['updated'] = len(updated)
+    result['unchanged'] = len(new_rows) - len(inserted) - len(updated)
+    logging.info(f'Delta of {file_name} against {previous_load}: {result}')
+
+    value_columns = [column for column in PRELOG_COLUMNS if column not in ROW_KEY_COLUMNS]
+    query_clear = f"DELETE FROM {table} WHERE file_name = ? AND import_date = ?"
+    query_copy = f"INSERT INTO {table} ({', '.join(TABLE_COLUMNS)}) SELECT ?, ?, {', '.join(PRELOG_COLUMNS)} FROM {table} WHERE file_name = ? AND import_date = ?"
+    query_delete = f"DELETE FROM {table} WHERE file_name = ? AND import_date = ? AND {key_filter}"
+    query_update = f"UPDATE {table} SET {', '.join(f'{column} = ?' for column in value_columns)} WHERE file_name = ? AND import_date = ? AND {key_filter}"
+    query_insert = f"INSERT INTO {table} ({', '.join(TABLE_COLUMNS)}) VALUES ({', '.join(['?'] * len(TABLE_COLUMNS))})"
+
+    def executemany(cursor, query, params, statement):
+        """To send params in batches, raises if the driver reports another number of rows touched than sent"""
+
+        touched = 0
+        for start in range(0, len(params), batch_size):
+            cursor.executemany(query, params[start:start + batch_size])
+            # -1 when the driver does not report it, the final count still checks the result
+            touched = -1 if touched < 0 or cursor.rowcount < 0 else touched + cursor.rowcount
+        if touched >= 0 and touched != len(params):
+            raise RuntimeError(f'Delta of {file_name}: {statement} touched {touched} rows of {table} instead of {len(params)}')
+
+    cursor = cnxn.cursor()
+    cursor.fast_executemany = True
+    try:
+        if previous_load != (file_name, import_date):
+            # The previous version stays in the table, the new one starts as a server side copy of it
+            cursor.execute(query_clear, file_name, import_date)
+            cursor.execute(query_copy, file_name, import_date, *previous_load)
+            result['copied'] = cursor.rowcount
+            if result['copied'] >= 0 and result['copied'] != len(old_rows):
+                raise RuntimeError(f'Delta of {file_name}: copied {result["copied"]} rows of {previous_load} instead of {len(old_rows)}')
+
+        executemany(cursor, query_delete, [(file_name, import_date, *key) for key in removed], 'DELETE')
+        executemany(cursor, query_update, [
+            (*[values[PRELOG_COLUMNS.index(column)] for column in value_columns], file_name, import_date, *_row_key(values))
+            for values in updated
+        ], 'UPDATE')
+        executemany(cursor, query_insert, [(file_name, import_date, *values) for values in inserted], 'INSERT')
+
+        # The new load must hold exactly the rows of the file before anything is committed
+        cursor.execute(f"SELECT COUNT(*) FROM {table} WHERE file_name = ? AND import_date = ?", file_name, import_date)
+        loaded = cursor.fetchone()[0]
+        if loaded != len(new_rows):
+            raise RuntimeError(f'Delta of {file_name}: {loaded} rows in {table} after the delta instead of the {len(new_rows)} rows of the file')
+
+        cnxn.commit()
+    except Exception:
+        cnxn.rollback()
+        raise
+    finally:
+        cursor.close()
+
+    return result
+
+
+def ingest_prelog_swap(cnxn, csv_file_path, file_name, import_date, batch_size=10000, table='tOIPPreLog3', replace_file_name=False):
+    """To reload a F prelog file through a staging table and switch it in with one set-based transaction
+
+    The file is bulk loaded into a staging table first, tOIPPreLog3 is only touched afterwards by
+    a single DELETE of the rows of the same file_name / import_date and a single INSERT ... SELECT from
+    the staging table, committed together. A failure at any point leaves tOIPPreLog3 as it was and
+    a re-run gives the same result, so there is no need for the separate COUNT(*) / DELETE check.
+    With replace_file_name, the DELETE removes the rows of the file_name under every import_date.
+
+    Parameter:
+    cnxn : pyodbc.Connection
+        open connection to the prelog database
+    csv_file_path : str or PrelogFile
+        path of the tab delimited F prelog file, or the PrelogFile already opened for it
+    file_name : str
+        value of the file_name column, e.g. 'F240308B'
+    import_date : date
+        value of the import_date column
+    batch_size : int
+        number of rows sent per executemany call into the staging table
+    table : str
+        target table
+    replace_file_name : bool
+        replace every earlier load of the file_name, not only the one of import_date
+
+    Return:
+    dict
+        number of rows, example :
+            {'staged': 10234, 'removed': 10230, 'inserted': 10234}
+    """
+
+    # A global temp table with a name of its own: fast_executemany describes the parameters with
+    # sp_describe_undeclared_parameters, which cannot see a session (#) temp table, and the unique
+    # name keeps concurrent loads (e.g. the backfill workers) from sharing it
+    staging_table = f"##{table}_Staging_{uuid.uuid4().hex}"
+    columns = ', '.join(TABLE_COLUMNS)
+
+    cursor = cnxn.cursor()
+    try:
+        cursor.execute(f"SELECT TOP 0 {columns} INTO {staging_table} FROM {table}")
+        cnxn.commit()
+
+        staged = ingest_prelog_python(cnxn, csv_file_path, file_name, import_date, batch_size=batch_size, table=staging_table)
+        logging.info(f'Staged {staged} rows into {staging_table}')
+
+        try:
+            if replace_file_name:
+                cursor.execute(f"DELETE FROM {table} WHERE file_name = ?", file_name)
+            else:
+                cursor.execute(f"DELETE FROM {table} WHERE file_name = ? AND import_date = ?", file_name, import_date)
+            removed = cursor.rowcount
+            cursor.execute(f"INSERT INTO {table} ({columns}) SELECT {columns} FROM {staging_table}")
+            inserted = cursor.rowcount
+            cnxn.commit()
+        except Exception:
+            cnxn.rollback()
+            raise
+    finally:
+        # The temp table would also go away with the connection, drop it now so it does not hold tempdb for the rest of the run
+        try:
+            cursor.execute(f"IF OBJECT_ID('tempdb..{staging_table}') IS NOT NULL DROP TABLE {staging_table}")
+            cnxn.commit()
+        finally:
+            cursor.close()
+
+    return {'staged': staged, 'removed': removed, 'inserted': inserted}
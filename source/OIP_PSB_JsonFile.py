@@ -0,0 +1,41 @@
+import json
+import logging
+import os
+
+
+def read_json(path, description, default=None):
+    """To read a JSON index / state file, default is returned when the file is missing or unreadable
+
+    Parameter:
+    path : str
+        JSON file
+    description : str
+        what the file is, for the warning logged when it cannot be read, e.g. 'prelog manifest'
+    default : object
+        returned when the file is missing or unreadable
+
+    Example:
+    from OIP_PSB_JsonFile import read_json, write_json
+    index = read_json('cache/prelog_cache_index.json', 'prelog cache index', {})
+    write_json('cache/prelog_cache_index.json', index)
+    """
+
+    if not os.path.isfile(path):
+        return default
+
+    try:
+        with open(path, 'r', encoding='utf-8') as file:
+            return json.load(file)
+    except (OSError, ValueError) as e:
+        logging.warning(f'Ignoring unreadable {description} {path}: {e}')
+        return default
+
+
+def write_json(path, data, sort_keys=True):
+    """To write a JSON file through a temp file replaced in one step, so a stopped process never leaves it half written"""
+
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    temp_path = f'{path}.tmp'
+    with open(temp_path, 'w', encoding='utf-8') as file:
+        json.dump(data, file, indent=1, sort_keys=sort_keys)
+    os.replace(temp_path, path)
@@ -0,0 +1,287 @@
+import argparse
+from contextlib import contextmanager
+from datetime import datetime
+import json
+import logging
+import os
+import statistics
+import threading
+import time
+
+
+def peak_memory_bytes():
+    """To get the memory high-water mark of the process in bytes, None if it cannot be measured
+
+    resource is used on unix, psutil (peak working set) on Windows if it is installed.
+    """
+
+    try:
+        import resource
+        import sys
+
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # ru_maxrss is in kilobytes on linux and in bytes on macOS
+        return peak if sys.platform == 'darwin' else peak * 1024
+    except ImportError:
+        pass
+
+    try:
+        import psutil
+    except ImportError:
+        return None
+
+    memory_info = psutil.Process().memory_info()
+    return getattr(memory_info, 'peak_wset', memory_info.rss)
+
+
+class RunMetrics:
+    """To time the stages of a run and record their counters in a JSON run record
+
+    A stage lasts from start_stage until the next start_stage or end_stage (or is used as a context
+    manager with stage). Counters (rows, bytes, SQL round trips, ...) are added to the running stage
+    and to the run totals, a counter is named after what it measures (validated_rows, ingested_rows,
+    report_rows, ...) so the run total of a name never adds up different things. finish writes the
+    run record next to the text log and appends it to the run history, that is compared across runs
+    with python OIP_PSB_Metrics.py.
+
+    Parameter:
+    record_path : str
+        JSON run record, e.g. the log file name with a .json extension
+    history_path : str
+        JSON lines history the run record is appended to, None to not keep a history
+
+    Example:
+    from OIP_PSB_Metrics import RunMetrics
+    metrics = RunMetrics('log/run.json', 'log/run_history.jsonl')
+    metrics.start_stage('discovery')
+    metrics.count('files', 3)
+    with metrics.stage('report'):
+        metrics.count('report_rows', 10234)
+    metrics.finish('success')
+    """
+
+    def __init__(self, record_path, history_path=None):
+        self.record_path = record_path
+        self.history_path = history_path
+        self.status = None
+        self.record = {
+            'run': os.path.splitext(os.path.basename(record_path))[0],
+            'started_at': datetime.now().isoformat(timespec='seconds'),
+            'finished_at': None,
+            'status': None,
+            'duration': None,
+            'peak_memory_bytes': None,
+            'counters': {},
+            'stages': []
+        }
+        self._start = time.perf_counter()
+        self._stage = None
+        self._stage_start = None
+        self._lock = threading.Lock()
+        # Objects with start_stage(name) / end_stage(name) called around every stage, e.g. StageProfiler
+        self.stage_hooks = []
+
+    def start_stage(self, name):
+        """To start a stage, the running stage is ended first"""
+
+        self.end_stage()
+        self._stage = {
+            'name': name,
+            'started_at': datetime.now().isoformat(timespec='seconds'),
+            'duration': None,
+            'peak_memory_bytes': None,
+            'counters': {}
+        }
+        for hook in self.stage_hooks:
+            hook.start_stage(name)
+        self._stage_start = time.perf_counter()
+        logging.info(f'Stage {name} started')
+
+    def end_stage(self, error=None):
+        """To end the running stage, if any"""
+
+        if self._stage is None:
+            return
+
+        stage, self._stage = self._stage, None
+        stage['duration'] = round(time.perf_counter() - self._stage_start, 3)
+        for hook in self.stage_hooks:
+            hook.end_stage(stage['name'])
+        stage['peak_memory_bytes'] = peak_memory_bytes()
+        if error is not None:
+            stage['error'] = error
+        self.record['stages'].append(stage)
+        logging.info(f"Stage {stage['name']} took {stage['duration']}s, counters {stage['counters']}, peak memory {stage['peak_memory_bytes']}")
+
+    @contextmanager
+    def stage(self, name):
+        """To time a block as a stage"""
+
+        self.start_stage(name)
+        try:
+            yield self
+        except BaseException as e:
+            self.end_stage(error=type(e).__name__)
+            raise
+        self.end_stage()
+
+    def count(self, name, value=1):
+        """To add value to a counter of the running stage and of the run, thread safe"""
+
+        with self._lock:
+            if self._stage is not None:
+                self._stage['counters'][name] = self._stage['counters'].get(name, 0) + value
+            self.record['counters'][name] = self.record['counters'].get(name, 0) + value
+
+    def finish(self, status=None):
+        """To end the run, write the run record and append it to the history
+
+        Return:
+        dict
+            the run record
+        """
+
+        self.end_stage()
+        self.record['status'] = status or self.status
+        self.record['finished_at'] = datetime.now().isoformat(timespec='seconds')
+        self.record['duration'] = round(time.perf_counter() - self._start, 3)
+        self.record['peak_memory_bytes'] = peak_memory_bytes()
+
+        os.makedirs(os.path.dirname(os.path.abspath(self.record_path)), exist_ok=True)
+        with open(self.record_path, 'w', encoding='utf-8') as file:
+            json.dump(self.record, file, indent=1)
+
+        if self.history_path is not None:
+            with open(self.history_path, 'a', encoding='utf-8') as file:
+                file.write(json.dumps(self.record) + '\n')
+
+        logging.info(f"Run record written to {self.record_path}, {self.record['status']} in {self.record['duration']}s")
+        return self.record
+
+
+class CountingCursor:
+    """To count the SQL statements sent by a pyodbc cursor, everything else is passed to the cursor"""
+
+    COUNTED = ('execute', 'executemany')
+
+    def __init__(self, cursor, metrics):
+        object.__setattr__(self, '_cursor', cursor)
+        object.__setattr__(self, '_metrics', metrics)
+
+    def __getattr__(self, name):
+        attribute = getattr(self._cursor, name)
+        if name not in self.COUNTED:
+            return attribute
+
+        def counted(*args, **kwargs):
+            self._metrics.count('sql_round_trips')
+            return attribute(*args, **kwargs)
+        return counted
+
+    def __setattr__(self, name, value):
+        setattr(self._cursor, name, value)
+
+    def __iter__(self):
+        return iter(self._cursor)
+
+
+class CountingConnection:
+    """To count the SQL round trips of a pyodbc connection and of its cursors
+
+    Example:
+    cnxn = CountingConnection(pyodbc.connect(connection_string), metrics)
+    """
+
+    def __init__(self, cnxn, metrics):
+        object.__setattr__(self, '_cnxn', cnxn)
+        object.__setattr__(self, '_metrics', metrics)
+
+    def cursor(self):
+        return CountingCursor(self._cnxn.cursor(), self._metrics)
+
+    def execute(self, *args, **kwargs):
+        self._metrics.count('sql_round_trips')
+        return CountingCursor(self._cnxn.execute(*args, **kwargs), self._metrics)
+
+    def commit(self):
+        self._metrics.count('sql_round_trips')
+        return self._cnxn.commit()
+
+    def rollback(self):
+        self._metrics.count('sql_round_trips')
+        return self._cnxn.rollback()
+
+    def __getattr__(self, name):
+        return getattr(self._cnxn, name)
+
+    def __setattr__(self, name, value):
+        setattr(self._cnxn, name, value)
+
+
+def read_history(history_path):
+    """To read the run records of the history, unreadable lines are skipped"""
+
+    records = []
+    if not os.path.isfile(history_path):
+        return records
+
+    with open(history_path, 'r', encoding='utf-8') as file:
+        for line in file:
+            try:
+                records.append(json.loads(line))
+            except ValueError:
+                continue
+    return records
+
+
+def format_history(records, last=10):
+    """To format the last runs as a table of stage durations, with the latest run against the median of the others"""
+
+    records = records[-last:]
+    if not records:
+        return 'No run recorded'
+
+    stage_names = []
+    for record in records:
+        stage_names += [stage['name'] for stage in record['stages'] if stage['name'] not in stage_names]
+
+    def durations(record):
+        totals = {}
+        for stage in record['stages']:
+            totals[stage['name']] = totals.get(stage['name'], 0) + stage['duration']
+        return totals
+
+    header = ['run', 'status'] + stage_names + ['total', 'peak MB']
+    rows = []
+    for record in records:
+        stage_durations = durations(record)
+        peak = record.get('peak_memory_bytes')
+        rows.append(
+            [record['run'], str(record['status'])]
+            + [f"{stage_durations[name]:.2f}" if name in stage_durations else '-' for name in stage_names]
+            + [f"{record['duration']:.2f}", '-' if peak is None else f"{peak / 1024 ** 2:.0f}"]
+        )
+
+    if len(records) > 1:
+        latest = durations(records[-1])
+        row = ['latest vs median', '']
+        for name in stage_names:
+            previous = [durations(record)[name] for record in records[:-1] if name in durations(record)]
+            row.append(f"{latest[name] - statistics.median(previous):+.2f}" if name in latest and previous else '-')
+        row.append(f"{records[-1]['duration'] - statistics.median(record['duration'] for record in records[:-1]):+.2f}")
+        row.append('')
+        rows.append(row)
+
+    widths = [max(len(str(value)) for value in column) for column in zip(header, *rows)]
+    return '\n'.join('  '.join(str(value).ljust(width) for value, width in zip(row, widths)) for row in [header] + rows)
+
+
+if __name__ == '__main__':
+    import OIP_PSB_Weekly_Report_Config as config
+
+    parser = argparse.ArgumentParser(description='Compare the stage durations of the last weekly report runs')
+    parser.add_argument('--history', default=config.run_history_path, help='run history, JSON lines')
+    parser.add_argument('--last', type=int, default=10, help='number of runs shown')
+    args = parser.parse_args()
+
+    print(format_history(read_history(args.history), last=args.last))
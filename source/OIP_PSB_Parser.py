@@ -0,0 +1,209 @@
+from contextlib import contextmanager
+import mmap
+import os
+
+# Columns of the F prelog file in file order, must match that of the SQL DATABASE
+PRELOG_COLUMNS = [
+    "CHANNEL_ID",
+    "CHANNEL_BELT",
+    "TX_DATE",
+    "START_TIME",
+    "SLOT_DURATION",
+    "SLOT_NAME",
+    "MAIN_TITLE",
+    "EPISODE_TITLE",
+    "GENRE",
+    "SUB_GENRE",
+    "REPEAT",
+    "LIVE_FLAG",
+    "SUBTITLE_LANGUAGE",
+    "PROGRAMME_ID",
+    "COUNTRY_DESC",
+    "LANGUAGE_DESC",
+    "PRODUCTION_TYPE_DESC",
+    "LOADING_FACTOR",
+    "SPONSORED_FLAG",
+    "LIVE_PROGRAMME_ID",
+    "REFERENCE_ID",
+    "MASTER_REFERENCE_KEY",
+    "PRODUCTION_SUB_TYPE",
+    "PSB_SURVEY",
+    "ALTERNATE_LANGUAGE"
+]
+
+
+class PrelogFile:
+    """To read a tab delimited F prelog file through a memory map
+
+    Row and field boundaries are found on the raw bytes of the mapped file and only the requested
+    columns are decoded, so the file content itself never has to be loaded into Python memory.
+    One PrelogFile is meant to be opened once per run and shared by the validator, the loader and
+    any local report logic, columns read with read_columns are kept and handed out without copying.
+
+    Example:
+    from OIP_PSB_Parser import PrelogFile
+    with PrelogFile('F240308B.TXT') as prelog:
+        for channel_id, tx_date in prelog.iter_records(['CHANNEL_ID', 'TX_DATE']):
+            print(channel_id, tx_date)
+        columns = prelog.read_columns(['MAIN_TITLE'])
+        print(len(columns['MAIN_TITLE']))
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._columns = {}
+        self._file = open(path, 'rb')
+        try:
+            self.size = os.fstat(self._file.fileno()).st_size
+            # mmap cannot map an empty file
+            self._mm = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ) if self.size > 0 else None
+        except Exception:
+            self._file.close()
+            raise
+
+    def close(self):
+        if self._mm is not None:
+            self._mm.close()
+            self._mm = None
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def iter_lines(self, checksum=None):
+        """To iterate over the raw lines of the file
+
+        Parameter:
+        checksum : hashlib object
+            optional, updated with the bytes of every line including its line terminator,
+            so the file content can be hashed in the same pass
+
+        Return:
+        generator
+            (line number, line bytes without the line terminator), blank lines included
+        """
+
+        mm = self._mm
+        if mm is None:
+            return
+
+        size = len(mm)
+        position = 0
+        line_no = 0
+        while position < size:
+            end = mm.find(b'\n', position)
+            next_position = size if end == -1 else end + 1
+            raw_line = mm[position:next_position]
+            if checksum is not None:
+                checksum.update(raw_line)
+
+            line_no += 1
+            yield line_no, raw_line.rstrip(b'\r\n')
+            position = next_position
+
+    def iter_records(self, names=None):
+        """To iterate over the non-blank rows decoding only the requested columns
+
+        Parameter:
+        names : list
+            columns to decode, all PRELOG_COLUMNS if not given
+
+        Return:
+        generator
+            one tuple of str per row in the order of names, empty or missing fields are None
+        """
+
+        indexes = [PRELOG_COLUMNS.index(name) for name in names] if names else list(range(len(PRELOG_COLUMNS)))
+        for line_no, line in self.iter_lines():
+            if not line.strip():
+                continue
+            fields = line.split(b'\t')
+            field_count = len(fields)
+            yield tuple(
+                (fields[index].decode('utf-8') or None) if index < field_count else None
+                for index in indexes
+            )
+
+    def read_columns(self, names=None):
+        """To read columns into lists, each column is only read once per PrelogFile
+
+        Parameter:
+        names : list
+            columns to read, all PRELOG_COLUMNS if not given
+
+        Return:
+        dict
+            column name -> list of str / None, one value per non-blank row
+        """
+
+        names = list(names) if names else list(PRELOG_COLUMNS)
+        missing = [name for name in names if name not in self._columns]
+        if missing:
+            arrays = [[] for _ in missing]
+            appends = [array.append for array in arrays]
+            for values in self.iter_records(missing):
+                for append, value in zip(appends, values):
+                    append(value)
+            self._columns.update(zip(missing, arrays))
+
+        return {name: self._columns[name] for name in names}
+
+
+@contextmanager
+def open_prelog(source):
+    """To use either an already open PrelogFile / PrelogColumns or a path, a path is opened and closed here"""
+
+    if isinstance(source, (PrelogFile, PrelogColumns)):
+        yield source
+    else:
+        with PrelogFile(source) as prelog:
+            yield prelog
+
+
+class PrelogColumns:
+    """To serve already parsed prelog columns with the same reading interface as PrelogFile
+
+    Used for prelogs loaded back from the columnar cache, values can already be typed (TX_DATE as date).
+    Columns are read from the source batch by batch while records are iterated, so only one batch
+    of Python values is held at a time, read_columns materializes the columns asked for only.
+
+    Parameter:
+    path : str
+        where the columns were loaded from
+    source : pyarrow.parquet.ParquetFile
+        columnar source with iter_batches(batch_size, columns), all PRELOG_COLUMNS
+    batch_rows : int
+        number of rows converted to Python values at a time
+    """
+
+    def __init__(self, path, source, batch_rows=65536):
+        self.path = path
+        self._source = source
+        self.batch_rows = batch_rows
+
+    def close(self):
+        close = getattr(self._source, 'close', None)
+        if close is not None:
+            close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def iter_records(self, names=None):
+        names = list(names) if names else list(PRELOG_COLUMNS)
+        for batch in self._source.iter_batches(batch_size=self.batch_rows, columns=names):
+            yield from zip(*[batch.column(index).to_pylist() for index in range(len(names))])
+
+    def read_columns(self, names=None):
+        names = list(names) if names else list(PRELOG_COLUMNS)
+        columns = {name: [] for name in names}
+        for batch in self._source.iter_batches(batch_size=self.batch_rows, columns=names):
+            for index, name in enumerate(names):
+                columns[name] += batch.column(index).to_pylist()
+        return columns
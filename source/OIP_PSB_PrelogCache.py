@@ -0,0 +1,225 @@
+from datetime import datetime
+import hashlib
+import logging
+import os
+import shutil
+import time
+from OIP_PSB_JsonFile import read_json, write_json
+
+
+class PrelogCache:
+    """To keep local copies of the F prelog files of the download share
+
+    Every cached file is recorded in an index keyed by file name with the size and mtime of the
+    source on the share and the size and sha256 of the local copy. A file whose source size and
+    mtime did not change is not copied again. Changed files are copied in chunks into a .part file,
+    the sha256 of the bytes read from the share is checked against the file that landed on disk and
+    only then is the copy moved in place. A .part left by an interrupted copy is resumed when the
+    source still has the size and mtime it was started from and the last chunk already copied still
+    matches the share, like an unchanged cached file is trusted on its size and mtime. Otherwise it
+    is started over. Old entries are evicted by age and by total size.
+
+    Example:
+    from OIP_PSB_PrelogCache import PrelogCache
+    cache = PrelogCache('D:/prelogFiles', max_age_days=90, max_total_bytes=2 * 1024 ** 3)
+    local_path = cache.fetch('J:\\2024-03-11\\F240308B.TXT')
+    cache.evict(keep=[local_path])
+    """
+
+    INDEX_NAME = 'prelog_cache_index.json'
+
+    def __init__(self, cache_directory, chunk_size=8 * 1024 * 1024, max_age_days=None, max_total_bytes=None):
+        self.cache_directory = cache_directory
+        self.chunk_size = chunk_size
+        self.max_age_days = max_age_days
+        self.max_total_bytes = max_total_bytes
+        self.index_path = os.path.join(cache_directory, self.INDEX_NAME)
+        self.index = {}
+        self.load()
+
+    def load(self):
+        self.index = read_json(self.index_path, 'prelog cache index', {})
+
+    def save(self):
+        write_json(self.index_path, self.index)
+
+    def is_cached(self, file_name, source_size, source_mtime):
+        """To check if the local copy of file_name matches the given source size and mtime"""
+
+        entry = self.index.get(file_name)
+        local_path = os.path.join(self.cache_directory, file_name)
+        return entry is not None \
+            and entry['source_size'] == source_size \
+            and entry['source_mtime'] == source_mtime \
+            and os.path.isfile(local_path) \
+            and os.path.getsize(local_path) == entry['size']
+
+    def fetch(self, source_path, source_size=None, source_mtime=None):
+        """To get a verified local copy of a F prelog file, copying it only if it changed
+
+        Parameter:
+        source_path : str
+            path of the F file on the download share
+        source_size : int
+            size of the source, from the prelog manifest, the source is stat-ed if not given
+        source_mtime : float
+            mtime of the source, from the prelog manifest, the source is stat-ed if not given
+
+        Return:
+        str
+            path of the local copy
+        """
+
+        file_name = os.path.basename(source_path)
+        local_path = os.path.join(self.cache_directory, file_name)
+
+        if source_size is None or source_mtime is None:
+            stat = os.stat(source_path)
+            source_size, source_mtime = stat.st_size, stat.st_mtime
+
+        if self.is_cached(file_name, source_size, source_mtime):
+            print(f'{file_name} is unchanged, using the cached copy {local_path}')
+            logging.info(f'{file_name} is unchanged, using the cached copy {local_path}')
+        else:
+            sha256 = self._copy(source_path, local_path, source_size, source_mtime)
+            self.index[file_name] = {
+                'source_size': source_size,
+                'source_mtime': source_mtime,
+                'size': os.path.getsize(local_path),
+                'sha256': sha256,
+                'cached_at': datetime.now().isoformat(timespec='seconds')
+            }
+
+        self.index[file_name]['last_used'] = time.time()
+        self.save()
+        return local_path
+
+    def sha256(self, file_name):
+        """To get the sha256 of a cached file as recorded when it was copied"""
+
+        return self.index[file_name]['sha256']
+
+    def _copy(self, source_path, local_path, source_size, source_mtime):
+        """To copy source_path to local_path in chunks, resuming an interrupted copy, and verify what landed on disk
+
+        Return:
+        str
+            sha256 of the copied content
+        """
+
+        os.makedirs(self.cache_directory, exist_ok=True)
+        part_path = f'{local_path}.part'
+        part_meta_path = f'{part_path}.json'
+        part_meta = {'source_size': source_size, 'source_mtime': source_mtime}
+        checksum = hashlib.sha256()
+
+        offset = 0
+        if os.path.isfile(part_path) and read_json(part_meta_path, 'partial copy metadata') == part_meta:
+            offset = self._resume_offset(source_path, part_path, source_size)
+        if offset == 0:
+            write_json(part_meta_path, part_meta)
+        else:
+            # The bytes already copied are trusted like a cached file, the source has the same size and mtime and their last chunk matches
+            self._hash_file(part_path, checksum)
+
+        print(f'Copying {source_path} to {local_path}' + (f', resuming at byte {offset}' if offset else ''))
+        logging.info(f'Copying {source_path} to {local_path}' + (f', resuming at byte {offset}' if offset else ''))
+        with open(source_path, 'rb') as source, open(part_path, 'ab' if offset else 'wb') as target:
+            source.seek(offset)
+            while True:
+                chunk = source.read(self.chunk_size)
+                if not chunk:
+                    break
+                target.write(chunk)
+                checksum.update(chunk)
+
+        # Verify what landed on disk against what was read from the share
+        sha256 = checksum.hexdigest()
+        written = hashlib.sha256()
+        self._hash_file(part_path, written)
+        if os.path.getsize(part_path) != source_size or written.hexdigest() != sha256:
+            os.remove(part_path)
+            os.remove(part_meta_path)
+            raise IOError(f'Copy of {source_path} failed verification, expected {source_size} bytes with sha256 {sha256}')
+
+        os.replace(part_path, local_path)
+        os.remove(part_meta_path)
+        shutil.copystat(source_path, local_path)
+        print(f'Copied {source_path} to {local_path}, sha256 {sha256}')
+        logging.info(f'Copied {source_path} to {local_path}, sha256 {sha256}')
+        return sha256
+
+    def _resume_offset(self, source_path, part_path, source_size):
+        """To get the size of a partial copy that can be resumed, 0 if it has to be started over
+
+        The last chunk of the partial copy is read again from the share and compared, so a copy cut
+        in the middle of a write or a share file rewritten with the same size and mtime is not resumed.
+        """
+
+        offset = os.path.getsize(part_path)
+        if offset == 0 or offset > source_size:
+            return 0
+
+        tail = min(self.chunk_size, offset)
+        with open(source_path, 'rb') as source, open(part_path, 'rb') as part:
+            source.seek(offset - tail)
+            part.seek(offset - tail)
+            if source.read(tail) != part.read(tail):
+                logging.info(f'Partial copy {part_path} does not match {source_path}, copying it again')
+                return 0
+        return offset
+
+    def _hash_file(self, path, checksum):
+        """To feed the content of path into checksum, returns the number of bytes read"""
+
+        size = 0
+        with open(path, 'rb') as file:
+            while True:
+                chunk = file.read(self.chunk_size)
+                if not chunk:
+                    break
+                checksum.update(chunk)
+                size += len(chunk)
+        return size
+
+    def evict(self, keep=()):
+        """To remove cached files not used for max_age_days and the least recently used ones above max_total_bytes
+
+        Parameter:
+        keep : list
+            local paths or file names that must not be evicted, e.g. the file of the current run
+
+        Return:
+        list
+            file names evicted
+        """
+
+        keep = {os.path.basename(path) for path in keep}
+        evicted = []
+
+        def remove(file_name):
+            local_path = os.path.join(self.cache_directory, file_name)
+            if os.path.isfile(local_path):
+                os.remove(local_path)
+            del self.index[file_name]
+            evicted.append(file_name)
+
+        if self.max_age_days is not None:
+            oldest_allowed = time.time() - self.max_age_days * 86400
+            for file_name, entry in list(self.index.items()):
+                if file_name not in keep and entry.get('last_used', 0) < oldest_allowed:
+                    remove(file_name)
+
+        if self.max_total_bytes is not None:
+            total_bytes = sum(entry['size'] for entry in self.index.values())
+            for file_name, entry in sorted(self.index.items(), key=lambda item: item[1].get('last_used', 0)):
+                if total_bytes <= self.max_total_bytes:
+                    break
+                if file_name not in keep:
+                    total_bytes -= entry['size']
+                    remove(file_name)
+
+        if evicted:
+            logging.info(f'Evicted from prelog cache: {evicted}')
+            self.save()
+        return evicted
@@ -0,0 +1,104 @@
+import cProfile
+import io
+import logging
+import os
+import pstats
+import tracemalloc
+
+
+class StageProfiler:
+    """To profile every stage of a run with cProfile and tracemalloc
+
+    Added to the stage_hooks of a RunMetrics, each stage is profiled from its start to its end and
+    leaves two files in output_directory:
+        <prefix>_<stage>.prof         cProfile dump, e.g. for snakeviz or pstats
+        <prefix>_<stage>_profile.txt  top functions by cumulative time and top allocations of the stage
+
+    Only the main thread is profiled by cProfile, work run on other threads (concurrent report
+    queries, outbox) shows as time spent waiting on them. tracemalloc sees allocations of every
+    thread. Profiling slows the run down, it is meant for investigating a slow run.
+
+    Parameter:
+    output_directory : str
+        directory of the profile files, e.g. the log directory
+    prefix : str
+        start of the profile file names, e.g. the log file name without extension
+    top : int
+        number of functions and allocation lines listed in the summaries
+    frames : int
+        frames kept per allocation traceback by tracemalloc
+
+    Example:
+    from OIP_PSB_Profile import StageProfiler
+    metrics.stage_hooks.append(StageProfiler('log', 'WeeklyPSBProgramTitleReport_2024-03-11 14-45-19'))
+    """
+
+    def __init__(self, output_directory, prefix, top=30, frames=1):
+        self.output_directory = output_directory
+        self.prefix = prefix
+        self.top = top
+        self.frames = frames
+        self._profile = None
+        self._snapshot = None
+        self._started_tracemalloc = False
+
+    def start_stage(self, name):
+        if not tracemalloc.is_tracing():
+            tracemalloc.start(self.frames)
+            self._started_tracemalloc = True
+        tracemalloc.reset_peak()
+        self._snapshot = tracemalloc.take_snapshot()
+
+        self._profile = cProfile.Profile()
+        self._profile.enable()
+
+    def end_stage(self, name):
+        if self._profile is None:
+            return
+
+        self._profile.disable()
+        profile, self._profile = self._profile, None
+        current, peak = tracemalloc.get_traced_memory()
+        allocations = tracemalloc.take_snapshot().compare_to(self._snapshot, 'lineno')
+        self._snapshot = None
+
+        os.makedirs(self.output_directory, exist_ok=True)
+        base_path = os.path.join(self.output_directory, f'{self.prefix}_{name}')
+        profile.dump_stats(f'{base_path}.prof')
+
+        stats_text = io.StringIO()
+        pstats.Stats(profile, stream=stats_text).sort_stats('cumulative').print_stats(self.top)
+
+        with open(f'{base_path}_profile.txt', 'w', encoding='utf-8') as file:
+            file.write(f'Stage {name}\n')
+            file.write(f'Traced memory at end of stage: {current / 1024 ** 2:.1f} MB, peak during stage: {peak / 1024 ** 2:.1f} MB\n\n')
+            file.write(f'Top {self.top} allocations of the stage, by size difference:\n')
+            for statistic in allocations[:self.top]:
+                file.write(f'    {statistic}\n')
+            file.write(f'\nTop {self.top} functions by cumulative time:\n')
+            file.write(stats_text.getvalue())
+
+        logging.info(f'Profile of stage {name} written to {base_path}.prof and {base_path}_profile.txt')
+
+    def close(self):
+        """To stop tracemalloc if it was started by the profiler"""
+
+        if self._started_tracemalloc:
+            tracemalloc.stop()
+            self._started_tracemalloc = False
+
+
+def profiling_requested(argv, environ=os.environ):
+    """To check if profiling was asked with the --profile flag or the OIP_PSB_PROFILE environment variable
+
+    Example:
+    python OIP_PSB_Weekly_Report.py --profile
+    set OIP_PSB_PROFILE=1
+    """
+
+    import argparse
+
+    parser = argparse.ArgumentParser(add_help=False)
+    parser.add_argument('--profile', action='store_true')
+    args, _ = parser.parse_known_args(argv)
+    return args.profile or environ.get('OIP_PSB_PROFILE', '').strip().lower() in ('1', 'true', 'yes', 'on')
@@ -0,0 +1,165 @@
+from datetime import datetime
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+import pandas as pd
+from OIP_PSB_JsonFile import read_json, write_json
+
+
+class ReportResultCache:
+    """To keep the results of the weekly report stored procedures between runs
+
+    Results are keyed by procedure, parameters and a load fingerprint of the tOIPPreLog3 rows of the
+    file_name / import_date being reported (row count and CHECKSUM_AGG of the rows). Any ingest that
+    changes those rows changes the fingerprint, so the cached result is no longer picked up and the
+    procedure runs again. A re-run on unchanged data (resend the email, rebuild the workbook) reads
+    the result from disk instead. max_age_hours also bounds how long a result is trusted, for changes
+    the procedures pick up from other tables. The index is guarded by a lock, so procedures can be read
+    from several threads.
+
+    Example:
+    from OIP_PSB_ReportCache import ReportResultCache
+    cache = ReportResultCache('D:/reportCache', max_age_hours=168)
+    fingerprint = cache.load_fingerprint(cnxn, 'F240308B', '2024-03-11')
+    df = cache.read_sql(cnxn, 'SP_OIP_PSB_Weekly_Report_Main', ['F240308B', '2024-03-11'], fingerprint)
+    """
+
+    INDEX_NAME = 'report_cache_index.json'
+
+    def __init__(self, cache_directory, max_age_hours=None):
+        self.cache_directory = cache_directory
+        self.max_age_hours = max_age_hours
+        self.index_path = os.path.join(cache_directory, self.INDEX_NAME)
+        self.index = {}
+        self._lock = threading.RLock()
+        self.load()
+
+    def load(self):
+        self.index = read_json(self.index_path, 'report cache index', {})
+
+    def save(self):
+        write_json(self.index_path, self.index)
+
+    @staticmethod
+    def load_fingerprint(cnxn, file_name, import_date, table='tOIPPreLog3'):
+        """To fingerprint the rows of a load, changes whenever an ingest changes them
+
+        Return:
+        str
+            e.g. '10234:-1734528561'
+        """
+
+        query_fingerprint = f"""
+        SELECT COUNT(*), CHECKSUM_AGG(BINARY_CHECKSUM(*)) FROM {table}
+        WHERE file_name = ? AND import_date = ?
+        """
+
+        cursor = cnxn.cursor()
+        try:
+            cursor.execute(query_fingerprint, file_name, import_date)
+            row_count, checksum = cursor.fetchone()
+        finally:
+            cursor.close()
+
+        return f'{row_count}:{checksum}'
+
+    @staticmethod
+    def key(procedure, params, fingerprint):
+        return hashlib.sha256(json.dumps([procedure, [str(param) for param in params], fingerprint]).encode('utf-8')).hexdigest()
+
+    def get(self, procedure, params, fingerprint):
+        """To get a cached result, None if there is none or it expired"""
+
+        key = self.key(procedure, params, fingerprint)
+        with self._lock:
+            entry = self.index.get(key)
+            if entry is None:
+                return None
+
+            path = os.path.join(self.cache_directory, entry['file'])
+            expired = self.max_age_hours is not None and time.time() - entry['created'] > self.max_age_hours * 3600
+            if expired or not os.path.isfile(path):
+                self.remove(key)
+                return None
+
+        return pd.read_pickle(path)
+
+    def put(self, procedure, params, fingerprint, df):
+        """To cache the result of a procedure"""
+
+        os.makedirs(self.cache_directory, exist_ok=True)
+        key = self.key(procedure, params, fingerprint)
+        file = f'{key}.pkl'
+        path = os.path.join(self.cache_directory, file)
+        df.to_pickle(f'{path}.tmp')
+
+        with self._lock:
+            os.replace(f'{path}.tmp', path)
+
+            # Only the latest result of a procedure and parameters is kept, the entry being written
+            # shares its pickle file with an earlier entry of the same key, that one must not be removed
+            for old_key, entry in list(self.index.items()):
+                if old_key != key and entry['procedure'] == procedure and entry['params'] == [str(param) for param in params]:
+                    self.remove(old_key, save=False)
+
+            self.index[key] = {
+                'procedure': procedure,
+                'params': [str(param) for param in params],
+                'fingerprint': fingerprint,
+                'file': file,
+                'created': time.time(),
+                'created_at': datetime.now().isoformat(timespec='seconds')
+            }
+            self.save()
+
+    def remove(self, key, save=True):
+        with self._lock:
+            entry = self.index.pop(key, None)
+            if entry is not None:
+                path = os.path.join(self.cache_directory, entry['file'])
+                if os.path.isfile(path):
+                    os.remove(path)
+                if save:
+                    self.save()
+
+    def read_sql(self, cnxn, procedure, params, fingerprint):
+        """To get the result of a stored procedure from the cache or by executing it
+
+        Parameter:
+        cnxn : pyodbc.Connection
+            open connection to the prelog database
+        procedure : str
+            stored procedure name
+        params : list
+            stored procedure parameters
+        fingerprint : str
+            load fingerprint of load_fingerprint
+
+        Return:
+        DataFrame
+            result of the stored procedure
+        """
+
+        df = self.get(procedure, params, fingerprint)
+        if df is not None:
+            print(f'{procedure} {params} unchanged since the last run, using the cached result')
+            logging.info(f'{procedure} {params} unchanged since the last run, using the cached result')
+            return df
+
+        return self.execute(cnxn, procedure, params, fingerprint)
+
+    def execute(self, cnxn, procedure, params, fingerprint):
+        """To execute a stored procedure and cache its result, without looking in the cache first
+
+        Return:
+        DataFrame
+            result of the stored procedure
+        """
+
+        query = f"EXEC {procedure} {', '.join(['?'] * len(params))}"
+        df = pd.read_sql(query, cnxn, params=params)
+        self.put(procedure, params, fingerprint, df)
+        return df
@@ -0,0 +1,194 @@
+from concurrent.futures import ThreadPoolExecutor
+import logging
+import pandas as pd
+
+# How empty values are shown in the report workbook
+NULL_DISPLAY = 'NULL'
+
+# Typed columns of each report, the other columns are kept as returned by the stored procedure
+# 'date'        : datetime64, written as a date cell
+# 'int'         : nullable Int64, to prevent type error in excel
+# 'int_or_text' : Int64 where the value is numeric, the text otherwise (PROGRAMME_ID, due to Asian Games)
+MAIN_REPORT_COLUMN_TYPES = {
+    'Broadcast Date': 'date',
+    'Start Date': 'date',
+    'End Date': 'date',
+    'Program ID': 'int',
+    'Content ID': 'int'
+}
+
+SECONDARY_REPORT_COLUMN_TYPES = {
+    'import_date': 'date',
+    'TX_DATE': 'date',
+    'START_TIME': 'int',
+    'SLOT_DURATION': 'int',
+    'PROGRAMME_ID': 'int_or_text',
+    'LOADING_FACTOR': 'int'
+}
+
+# Stored procedures of the report, written to the workbook in this order, '{file_name}' is replaced by the prelog file_name
+REPORTS = [
+    {'procedure': 'SP_OIP_PSB_Weekly_Report_Main', 'sheet_name': 'Main Report', 'column_types': MAIN_REPORT_COLUMN_TYPES},
+    {'procedure': 'SP_OIP_PSB_Weekly_Report_Secondary', 'sheet_name': '{file_name}', 'column_types': SECONDARY_REPORT_COLUMN_TYPES}
+]
+
+
+def date_columns(column_types):
+    """To get the columns typed as 'date'"""
+
+    return [column for column, column_type in column_types.items() if column_type == 'date']
+
+
+def shape_report_frame(df, column_types):
+    """To give the typed columns of a stored procedure result their report dtype
+
+    Every conversion is vectorized per column and done in place, nulls stay as NaT / <NA> / None
+    and are only turned into NULL_DISPLAY by the workbook writer. A value that is not empty but
+    cannot be converted raises ValueError instead of being shown as NULL in the report.
+
+    Parameter:
+    df : DataFrame
+        result of a report stored procedure
+    column_types : dict
+        column name -> 'date', 'int' or 'int_or_text', columns missing from df are ignored
+
+    Return:
+    DataFrame
+        df with the typed columns converted
+    """
+
+    for column, column_type in column_types.items():
+        if column not in df.columns:
+            continue
+
+        series = df[column]
+        if column_type == 'date':
+            converted = pd.to_datetime(series, errors='coerce')
+            _check_coerced(column, series, converted)
+            df[column] = converted
+        elif column_type == 'int':
+            # A number with a fraction, e.g. 12.5, is not an int either
+            numbers = pd.to_numeric(series, errors='coerce')
+            numbers = numbers.where(numbers % 1 == 0)
+            _check_coerced(column, series, numbers)
+            df[column] = numbers.astype('Int64')
+        elif column_type == 'int_or_text':
+            # Only whole numbers become ints, anything else (text, 12.5) is written through as it came
+            numbers = pd.to_numeric(series, errors='coerce')
+            integral = numbers % 1 == 0
+            df[column] = numbers.where(integral).astype('Int64').astype(object).where(integral, series)
+        else:
+            raise ValueError(f'Unknown column type {column_type} for {column}')
+
+    return df
+
+
+def _check_coerced(column, series, converted, max_samples=5):
+    """To raise ValueError if values of series that are not empty became null when converted"""
+
+    empty = series.isna() | (series.astype(str).str.strip() == '')
+    invalid = series[converted.isna() & ~empty]
+    if len(invalid):
+        message = f'{len(invalid)} values of {column} cannot be converted, e.g. {invalid.head(max_samples).tolist()}'
+        logging.error(message)
+        raise ValueError(message)
+
+
+def read_reports(connection, report_cache, reports, params, fingerprint, max_workers=2):
+    """To run the report stored procedures concurrently, each on its own pooled connection
+
+    Procedures are independent, so the report stage takes about as long as the slowest one instead
+    of the sum of all of them. Results already in the report cache are returned without taking a
+    connection.
+
+    Parameter:
+    connection : callable
+        context manager factory lending a connection, e.g. PipelineRuntime.connection
+    report_cache : ReportResultCache
+        cache of the procedure results
+    reports : list
+        report definitions, e.g. REPORTS
+    params : list
+        stored procedure parameters
+    fingerprint : str
+        load fingerprint of ReportResultCache.load_fingerprint
+    max_workers : int
+        maximum number of procedures running at the same time
+
+    Return:
+    dict
+        procedure -> DataFrame
+
+    Example:
+    results = read_reports(runtime.connection, report_cache, REPORTS, ['F240308B', '2024-03-11'], fingerprint, max_workers=2)
+    """
+
+    def read(procedure):
+        df = report_cache.get(procedure, params, fingerprint)
+        if df is not None:
+            logging.info(f'{procedure} {params} unchanged since the last run, using the cached result')
+            return df
+
+        with connection() as cnxn:
+            logging.info(f'Executing {procedure} {params}')
+            return report_cache.execute(cnxn, procedure, params, fingerprint)
+
+    procedures = [report['procedure'] for report in reports]
+    with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(procedures))), thread_name_prefix='report') as executor:
+        futures = {procedure: executor.submit(read, procedure) for procedure in procedures}
+        return {procedure: future.result() for procedure, future in futures.items()}
+
+
+def stream_report(cnxn, writer, report, sheet_name, params, chunk_size=50000):
+    """To fetch a report stored procedure in chunks straight into a sheet of the workbook
+
+    Rows are fetched with fetchmany, each chunk is shaped like a whole frame (shape_report_frame)
+    and appended to the write-only sheet, so memory depends on chunk_size and not on the number
+    of rows returned. The report cache is not used in this mode.
+
+    Parameter:
+    cnxn : pyodbc.Connection
+        open connection to the prelog database
+    writer : ReportWorkbookWriter
+        workbook being written
+    report : dict
+        report definition, e.g. REPORTS[1]
+    sheet_name : str
+        name of the sheet
+    params : list
+        stored procedure parameters
+    chunk_size : int
+        number of rows fetched and written at a time
+
+    Return:
+    int
+        number of rows written
+    """
+
+    query = f"EXEC {report['procedure']} {', '.join(['?'] * len(params))}"
+    report_date_columns = date_columns(report['column_types'])
+    row_count = 0
+
+    cursor = cnxn.cursor()
+    try:
+        cursor.execute(query, *params)
+        # Skip the row counts of statements run before the result set of the procedure
+        while cursor.description is None and cursor.nextset():
+            pass
+        if cursor.description is None:
+            raise ValueError(f"{report['procedure']} did not return a result set")
+
+        columns = [column[0] for column in cursor.description]
+        sheet = writer.create_sheet(sheet_name, columns, report_date_columns)
+        while True:
+            rows = cursor.fetchmany(chunk_size)
+            if not rows:
+                break
+            chunk = shape_report_frame(pd.DataFrame.from_records([tuple(row) for row in rows], columns=columns), report['column_types'])
+            writer.append_rows(sheet, writer.frame_rows(chunk, report_date_columns))
+            row_count += len(rows)
+            logging.info(f'{row_count} rows of {report["procedure"]} written to sheet {sheet_name}')
+    finally:
+        cursor.close()
+
+    return row_count
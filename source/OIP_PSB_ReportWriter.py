@@ -0,0 +1,122 @@
+from datetime import date, datetime
+import logging
+from openpyxl import Workbook
+from openpyxl.cell import WriteOnlyCell
+from openpyxl.styles import Alignment, Border, Font, Side
+from openpyxl.utils import get_column_letter
+import pandas as pd
+
+# Number format of the date cells in the report
+DATE_FORMAT = 'MM/DD/YYYY'
+
+# Same look as the header row written by pandas to_excel
+HEADER_FONT = Font(bold=True)
+HEADER_BORDER = Border(top=Side(style='thin'), bottom=Side(style='thin'), left=Side(style='thin'), right=Side(style='thin'))
+HEADER_ALIGNMENT = Alignment(horizontal='center', vertical='top')
+
+
+class ReportWorkbookWriter:
+    """To write the report workbook in a single streaming pass
+
+    The workbook is created in openpyxl write-only mode, rows are streamed to each sheet as they are
+    appended and date cells get their number format as they are written, so the workbook is saved
+    once and never loaded back for formatting.
+
+    Example:
+    from OIP_PSB_ReportWriter import ReportWorkbookWriter
+    writer = ReportWorkbookWriter('PSB Program Title Report.xlsx')
+    writer.write_frame('Main Report', pandas_df_main, date_columns=['Broadcast Date'])
+    writer.write_list('Exclusive Titles', 'Main Title', ['Space Farmers'])
+    writer.save()
+    """
+
+    def __init__(self, path, date_format=DATE_FORMAT, date_column_width=15, null_value=None):
+        self.path = path
+        self.date_format = date_format
+        self.null_value = null_value
+        self.date_column_width = date_column_width
+        self.workbook = Workbook(write_only=True)
+        self._date_indexes = {}
+
+    def _header_cells(self, sheet, columns):
+        cells = []
+        for column in columns:
+            cell = WriteOnlyCell(sheet, value=column)
+            cell.font = HEADER_FONT
+            cell.border = HEADER_BORDER
+            cell.alignment = HEADER_ALIGNMENT
+            cells.append(cell)
+        return cells
+
+    def create_sheet(self, sheet_name, columns, date_columns=()):
+        """To add a sheet with its header row, date columns are widened
+
+        Return:
+        WriteOnlyWorksheet
+            the sheet, to be passed to append_rows
+        """
+
+        sheet = self.workbook.create_sheet(sheet_name)
+        self._date_indexes[sheet_name] = [index for index, column in enumerate(columns) if column in date_columns]
+        for index in self._date_indexes[sheet_name]:
+            sheet.column_dimensions[get_column_letter(index + 1)].width = self.date_column_width
+        sheet.append(self._header_cells(sheet, columns))
+        return sheet
+
+    def append_rows(self, sheet, rows):
+        """To stream rows to a sheet, date values of the date columns are written as formatted date cells"""
+
+        date_indexes = self._date_indexes[sheet.title]
+        for row in rows:
+            row = list(row)
+            for index in date_indexes:
+                value = row[index]
+                if isinstance(value, (date, datetime)):
+                    cell = WriteOnlyCell(sheet, value=value.date() if isinstance(value, datetime) else value)
+                    cell.number_format = self.date_format
+                    row[index] = cell
+            sheet.append(row)
+
+    def write_frame(self, sheet_name, df, date_columns=()):
+        """To write a DataFrame to a new sheet
+
+        Parameter:
+        sheet_name : str
+            name of the sheet
+        df : DataFrame
+            data, datetime64 columns listed in date_columns are written as dates
+        date_columns : list
+            columns written with the date number format
+        """
+
+        sheet = self.create_sheet(sheet_name, list(df.columns), date_columns)
+        self.append_rows(sheet, self.frame_rows(df, date_columns))
+        logging.info(f'{len(df)} rows written to sheet {sheet_name}')
+
+    def frame_rows(self, df, date_columns=()):
+        """To turn a typed DataFrame into rows of cell values
+
+        Conversions are done once per column, datetime64 columns become dates and
+        nulls of any dtype become null_value.
+        """
+
+        columns = []
+        for column in df.columns:
+            series = df[column]
+            if column in date_columns and pd.api.types.is_datetime64_any_dtype(series):
+                values = series.dt.date.astype(object).where(series.notna(), self.null_value)
+            else:
+                values = series.astype(object).where(series.notna(), self.null_value)
+            columns.append(values.tolist())
+
+        return zip(*columns)
+
+    def write_list(self, sheet_name, header, values):
+        """To write a single column list to a new sheet, e.g. the 'Exclusive Titles' sheet"""
+
+        sheet = self.create_sheet(sheet_name, [header])
+        self.append_rows(sheet, ([value] for value in values))
+
+    def save(self):
+        self.workbook.save(self.path)
+        logging.info(f'Workbook saved to {self.path}')
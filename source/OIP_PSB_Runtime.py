@@ -0,0 +1,143 @@
+from contextlib import contextmanager
+import logging
+import threading
+import pyodbc
+from SGTAMProdTask import SGTAMProd
+import OIP_PSB_Weekly_Report_Config as config
+
+
+class PipelineRuntime:
+    """To own the resources used across the ingest, report and email stages of a run
+
+    SparkSession, SQL connection and SGTAMProd are only created on first use and are reused
+    by every stage afterwards, close() releases all of them once at the end of the run.
+
+    connection() lends a connection of a small pool to work running on other threads (pyodbc
+    connections are not shared between threads), connections are returned to the pool after use
+    so concurrent report queries do not reconnect for every query.
+
+    Example:
+    from OIP_PSB_Runtime import PipelineRuntime
+    with PipelineRuntime() as runtime:
+        cursor = runtime.cnxn.cursor()
+        cursor.execute('SELECT COUNT(*) FROM tOIPPreLog3')
+        print(cursor.fetchone()[0])
+    """
+
+    def __init__(self, metrics=None):
+        self.metrics = metrics
+        self._cnxn = None
+        self._spark = None
+        self._sgtam = None
+        self._pool = []
+        self._pool_lock = threading.Lock()
+
+    @property
+    def connection_string(self):
+        return f"DRIVER={config.driver};SERVER={config.server};DATABASE={config.database};UID={config.username};PWD={config.password}"
+
+    @property
+    def cnxn(self):
+        """pyodbc connection to SGTAMProdOIP, opened on first use"""
+
+        if self._cnxn is None:
+            print('Creating SQL connection to SGTAMProdOIP')
+            logging.info('Creating SQL connection to SGTAMProdOIP')
+            self._cnxn = self._connect()
+        return self._cnxn
+
+    def _connect(self):
+        cnxn = pyodbc.connect(self.connection_string)
+        if self.metrics is not None:
+            # Count the SQL round trips of every stage
+            from OIP_PSB_Metrics import CountingConnection
+            cnxn = CountingConnection(cnxn, self.metrics)
+        return cnxn
+
+    def acquire(self):
+        """To take an idle pooled connection, a new one is opened if none is idle"""
+
+        with self._pool_lock:
+            if self._pool:
+                return self._pool.pop()
+
+        logging.info('Opening pooled SQL connection to SGTAMProdOIP')
+        return self._connect()
+
+    def release(self, cnxn):
+        """To return a connection taken with acquire to the pool"""
+
+        with self._pool_lock:
+            self._pool.append(cnxn)
+
+    @contextmanager
+    def connection(self):
+        """To use a pooled connection, a connection that raised is closed instead of being pooled again
+
+        Example:
+        with runtime.connection() as cnxn:
+            df = pd.read_sql('EXEC SP_OIP_PSB_Weekly_Report_Main ?, ?', cnxn, params=params)
+        """
+
+        cnxn = self.acquire()
+        try:
+            yield cnxn
+        except Exception:
+            cnxn.close()
+            raise
+        self.release(cnxn)
+
+    @property
+    def spark(self):
+        """SparkSession with the mssql-jdbc driver on the classpath, started on first use"""
+
+        if self._spark is None:
+            from pyspark.sql import SparkSession
+
+            print('Create new Sparks session')
+            logging.info('Create new Sparks session')
+            self._spark = SparkSession.builder \
+                .appName('OIP PSB Weekly Report') \
+                .config("spark.driver.extraClassPath", config.spark_jdbc_jar) \
+                .getOrCreate()
+        return self._spark
+
+    @property
+    def sgtam(self):
+        """SGTAMProd helper used for sending emails"""
+
+        if self._sgtam is None:
+            self._sgtam = SGTAMProd()
+        return self._sgtam
+
+    def close(self):
+        """To stop the SparkSession and close the SQL connections and SGTAMProd engines if they were created"""
+
+        if self._spark is not None:
+            self._spark.stop()
+            self._spark = None
+            print('PySpark connection stopped')
+            logging.info('PySpark connection stopped')
+
+        if self._cnxn is not None:
+            self._cnxn.close()
+            self._cnxn = None
+            print('SQL connection closed.')
+            logging.info('SQL connection closed.')
+
+        with self._pool_lock:
+            pool, self._pool = self._pool, []
+        for cnxn in pool:
+            cnxn.close()
+        if pool:
+            logging.info(f'{len(pool)} pooled SQL connections closed.')
+
+        if self._sgtam is not None:
+            self._sgtam.close()
+            self._sgtam = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
@@ -0,0 +1,77 @@
+from datetime import date
+import os
+import sqlite3
+import tempfile
+import unittest
+from OIP_PSB_Ingest import TABLE_COLUMNS
+from OIP_PSB_Parser import PRELOG_COLUMNS
+
+# Typed like tOIPPreLog3, so values read back are not the text of the file
+COLUMN_TYPES = {'import_date': 'DATE', 'CHANNEL_ID': 'INTEGER', 'TX_DATE': 'DATE', 'START_TIME': 'INTEGER', 'SLOT_DURATION': 'INTEGER'}
+
+
+class RecordingConnection:
+    """sqlite3 connection standing in for pyodbc, counting the rows sent by execute and executemany"""
+
+    class Cursor:
+        def __init__(self, connection, cursor):
+            self._connection = connection
+            self._cursor = cursor
+            self.fast_executemany = False
+
+        def execute(self, query, *params):
+            self._connection.rows_sent += 1 if params and query.lstrip().upper().startswith(('INSERT', 'UPDATE', 'DELETE')) else 0
+            self._cursor.execute(query, params)
+            return self
+
+        def executemany(self, query, params):
+            self._connection.rows_sent += len(params)
+            self._cursor.executemany(query, params)
+
+        def __getattr__(self, name):
+            return getattr(self._cursor, name)
+
+    def __init__(self):
+        sqlite3.register_adapter(date, date.isoformat)
+        self.connection = sqlite3.connect(':memory:', detect_types=sqlite3.PARSE_DECLTYPES)
+        columns = ', '.join(f"{column} {COLUMN_TYPES.get(column, 'TEXT')}" for column in TABLE_COLUMNS)
+        self.connection.execute(f"CREATE TABLE tOIPPreLog3 ({columns})")
+        self.rows_sent = 0
+
+    def cursor(self):
+        return self.Cursor(self, self.connection.cursor())
+
+    def rows(self, file_name, import_date):
+        cursor = self.connection.execute('SELECT * FROM tOIPPreLog3 WHERE file_name = ? AND import_date = ? ORDER BY CHANNEL_ID, START_TIME', (file_name, import_date))
+        return cursor.fetchall()
+
+    def __getattr__(self, name):
+        return getattr(self.connection, name)
+
+
+def prelog_line(channel_id, start_time, title='Space Farmers'):
+    """To build a tab delimited F prelog line of one slot on 2024-03-08"""
+
+    values = dict.fromkeys(PRELOG_COLUMNS, '')
+    values.update({'CHANNEL_ID': f'{channel_id:03d}', 'TX_DATE': '20240308', 'START_TIME': f'{start_time:04d}', 'SLOT_DURATION': '30', 'MAIN_TITLE': title})
+    return '\t'.join(values[column] for column in PRELOG_COLUMNS)
+
+
+class PipelineTestCase(unittest.TestCase):
+    """TestCase with a temporary directory, removed after the cleanups added by the test itself"""
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        # Cleanups run last added first, anything a test opens in the directory is closed before it goes
+        self.addCleanup(self.directory.cleanup)
+
+    def path(self, *names):
+        return os.path.join(self.directory.name, *names)
+
+    def write_prelog(self, file_name, lines):
+        """To write lines as a F prelog file in the temporary directory, returns its path"""
+
+        path = self.path(file_name)
+        with open(path, 'w', encoding='utf-8') as file:
+            file.write('\n'.join(lines) + '\n')
+        return path
@@ -0,0 +1,128 @@
+import hashlib
+import logging
+from OIP_PSB_Ingest import TX_DATE_INDEX, parse_tx_date
+from OIP_PSB_Parser import PRELOG_COLUMNS, open_prelog
+
+
+################################################################################################################
+# Declare custom exception for a F file that fails validation
+class ExceptionPrelogValidation(Exception):
+    def __init__(self, message, report):
+        super().__init__(message)
+        self.report = report
+################################################################################################################
+
+
+def validate_prelog(csv_file_path, max_samples=10):
+    """To validate a F prelog file in a single streaming pass before it is written to SQL Server
+
+    In one read of the file it counts the rows, checks that every non-empty line has exactly
+    25 tab separated fields, flags TX_DATE values that cannot be parsed as yyyyMMdd and computes
+    the sha256 checksum of the file content.
+
+    Parameter:
+    csv_file_path : str or PrelogFile
+        path of the tab delimited F prelog file, or the PrelogFile already opened for it
+    max_samples : int
+        maximum number of offending lines kept in the report for each type of mismatch
+
+    Return:
+    dict
+        validation report, example :
+            {'file': 'F240308B.TXT', 'rows': 10234, 'empty_lines': 1, 'bytes': 3145728,
+             'sha256': '9f86d08...', 'field_count_mismatches': 0, 'field_count_samples': [],
+             'invalid_tx_dates': 0, 'invalid_tx_date_samples': [], 'decode_errors': 0,
+             'decode_error_samples': [], 'is_valid': True}
+            samples are (line number, found value) tuples.
+    """
+
+    column_count = len(PRELOG_COLUMNS)
+    checksum = hashlib.sha256()
+    report = {
+        'file': None,
+        'rows': 0,
+        'empty_lines': 0,
+        'bytes': 0,
+        'sha256': None,
+        'field_count_mismatches': 0,
+        'field_count_samples': [],
+        'invalid_tx_dates': 0,
+        'invalid_tx_date_samples': [],
+        'decode_errors': 0,
+        'decode_error_samples': [],
+        'is_valid': False
+    }
+
+    with open_prelog(csv_file_path) as prelog:
+        report['file'] = prelog.path
+        report['bytes'] = prelog.size
+
+        # Fields are split on the raw bytes, only TX_DATE is decoded for parsing
+        for line_no, line in prelog.iter_lines(checksum=checksum):
+            if not line.strip():
+                report['empty_lines'] += 1
+                continue
+
+            report['rows'] += 1
+            fields = line.split(b'\t')
+
+            try:
+                line.decode('utf-8')
+            except UnicodeDecodeError as e:
+                report['decode_errors'] += 1
+                if len(report['decode_error_samples']) < max_samples:
+                    report['decode_error_samples'].append((line_no, str(e)))
+                continue
+
+            if len(fields) != column_count:
+                report['field_count_mismatches'] += 1
+                if len(report['field_count_samples']) < max_samples:
+                    report['field_count_samples'].append((line_no, len(fields)))
+
+            tx_date = fields[TX_DATE_INDEX].decode('utf-8') if len(fields) > TX_DATE_INDEX else None
+            if parse_tx_date(tx_date) is None:
+                report['invalid_tx_dates'] += 1
+                if len(report['invalid_tx_date_samples']) < max_samples:
+                    report['invalid_tx_date_samples'].append((line_no, tx_date))
+
+    report['sha256'] = checksum.hexdigest()
+    report['is_valid'] = report['rows'] > 0 \
+        and report['field_count_mismatches'] == 0 \
+        and report['invalid_tx_dates'] == 0 \
+        and report['decode_errors'] == 0
+    return report
+
+
+def format_validation_report(report):
+    """To format the validation report as text lines for the log and the email"""
+
+    lines = [
+        f"File: {report['file']}",
+        f"Rows: {report['rows']} (empty lines skipped: {report['empty_lines']})",
+        f"Bytes: {report['bytes']}",
+        f"SHA256: {report['sha256']}",
+        f"Lines without {len(PRELOG_COLUMNS)} fields: {report['field_count_mismatches']}"
+    ]
+    lines += [f"    line {line_no}: {found} fields" for line_no, found in report['field_count_samples']]
+    lines.append(f"Invalid TX_DATE values: {report['invalid_tx_dates']}")
+    lines += [f"    line {line_no}: {value!r}" for line_no, value in report['invalid_tx_date_samples']]
+    lines.append(f"Lines that are not valid utf-8: {report['decode_errors']}")
+    lines += [f"    line {line_no}: {error}" for line_no, error in report['decode_error_samples']]
+    return '\n'.join(lines)
+
+
+def check_prelog(csv_file_path, max_samples=10):
+    """To validate a F prelog file and raise ExceptionPrelogValidation if it fails
+
+    Return:
+    dict
+        validation report of validate_prelog when the file is valid
+    """
+
+    report = validate_prelog(csv_file_path, max_samples=max_samples)
+    logging.info(f"Validation report:\n{format_validation_report(report)}")
+
+    if not report['is_valid']:
+        raise ExceptionPrelogValidation(f"{report['file']} failed validation:\n{format_validation_report(report)}", report)
+
+    return report
@@ -0,0 +1,299 @@
+import argparse
+from datetime import datetime
+import logging
+import os
+import subprocess
+import sys
+import time
+import OIP_PSB_Weekly_Report_Config as config
+from OIP_PSB_Discovery import PrelogManifest
+from OIP_PSB_JsonFile import read_json, write_json
+
+# Weekly report script started by the watcher, in the same directory
+PIPELINE_SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'OIP_PSB_Weekly_Report.py')
+
+
+class ShareNotifier:
+    """To wake the watcher up as soon as something is created in the download share, with inotify
+
+    The root of the share is watched for new daily folders and the latest daily folder for F files
+    being created, written or moved in. Needs the inotify_simple package and a linux mount that
+    reports changes, changes made from other machines to a network mount may not be reported, so
+    the watcher keeps polling as well and only wakes up earlier when an event comes.
+
+    Example:
+    notifier = ShareNotifier.open('/mnt/prelog')
+    changed = notifier.wait(60) if notifier else False
+    """
+
+    def __init__(self, inotify, flags, directory_path):
+        self.inotify = inotify
+        self.flags = flags
+        self.directory_path = directory_path
+        self.folder = None
+        self._folder_watch = None
+        self.inotify.add_watch(directory_path, flags.CREATE | flags.MOVED_TO)
+
+    @classmethod
+    def open(cls, directory_path):
+        """To start watching the share, None if inotify is not available for it"""
+
+        try:
+            from inotify_simple import INotify, flags
+        except ImportError:
+            logging.info('inotify_simple is not installed, the download share is only polled')
+            return None
+
+        try:
+            return cls(INotify(), flags, directory_path)
+        except OSError as e:
+            logging.info(f'inotify is not supported for {directory_path}, the download share is only polled: {e}')
+            return None
+
+    def watch_folder(self, folder):
+        """To watch the daily folder files are expected in, instead of the previous one"""
+
+        if folder == self.folder or folder is None:
+            return
+
+        if self._folder_watch is not None:
+            try:
+                self.inotify.rm_watch(self._folder_watch)
+            except OSError:
+                # The folder was removed, its watch went with it
+                pass
+        self._folder_watch = self.inotify.add_watch(os.path.join(self.directory_path, folder), self.flags.CREATE | self.flags.CLOSE_WRITE | self.flags.MOVED_TO)
+        self.folder = folder
+
+    def wait(self, timeout):
+        """To wait up to timeout seconds for a change, events coming within a second of each other are read together
+
+        Return:
+        bool
+            True if something changed in the share
+        """
+
+        return bool(self.inotify.read(timeout=int(timeout * 1000), read_delay=1000))
+
+    def close(self):
+        self.inotify.close()
+
+
+class PrelogWatcher:
+    """To start the weekly report as soon as a new or higher-version F file lands in the download share and is stable
+
+    The candidate is the file the weekly report would pick, the latest version of the latest daily
+    folder. A candidate is stable once its size and mtime did not change for stable_seconds, so a
+    file still being copied to the share is never loaded half written. Every poll_interval seconds
+    (or earlier on an inotify event) the manifest is refreshed and the candidate checked again.
+
+    The last candidate the report was started for is kept in state_path with the outcome of the run.
+    A file the report succeeded for is not run again, also after a restart of the watcher. A run
+    exiting with a non-zero code is 'failed' and the same file is run again retry_interval seconds
+    after it finished, up to max_attempts runs in total, after which it is left to be re-run by hand.
+
+    State layout :
+        {'last_run': {'folder': '2024-03-11', 'file_name': 'F240308B.TXT', 'size': 3145728, 'mtime': 1710137107.0,
+                      'started_at': '2024-03-11T14:45:19', 'finished_at': '2024-03-11T14:48:51', 'duration': 212.4,
+                      'returncode': 0, 'status': 'done', 'attempts': 1}}
+
+    Parameter:
+    manifest : PrelogManifest
+        manifest of the download share
+    state_path : str
+        JSON state of the watcher
+    poll_interval : int
+        seconds between two polls of the share
+    stable_seconds : int
+        seconds the size and mtime of a new F file must stay unchanged before the report is started
+    command : list
+        command line of the weekly report
+    retry_interval : int
+        seconds after a failed run before the report is started again for the same file
+    max_attempts : int
+        maximum number of runs for the same file, the first one included
+
+    Example:
+    from OIP_PSB_Watch import PrelogWatcher
+    watcher = PrelogWatcher(PrelogManifest('J:\\', 'prelog_manifest.json'), 'cache/watch_state.json')
+    watcher.run()
+    """
+
+    def __init__(self, manifest, state_path, poll_interval=60, stable_seconds=120, command=None, retry_interval=1800, max_attempts=3):
+        self.manifest = manifest
+        self.state_path = state_path
+        self.poll_interval = poll_interval
+        self.stable_seconds = stable_seconds
+        self.retry_interval = retry_interval
+        self.max_attempts = max_attempts
+        self.command = command or [sys.executable, PIPELINE_SCRIPT]
+        self.state = {}
+        # (folder, file_name, size, mtime) of the candidate and when it was first seen with them
+        self._observed = None
+        self._observed_since = None
+        self.load()
+
+    def load(self):
+        self.state = read_json(self.state_path, 'watch state', {})
+
+    def save(self):
+        write_json(self.state_path, self.state)
+
+    def candidate(self):
+        """To refresh the manifest and get the F file the weekly report would pick
+
+        Return:
+        tuple
+            (folder, file_name, size, mtime), None if the latest daily folder has no F file
+        """
+
+        # The weekly report refreshes the same manifest, start from what it saved
+        self.manifest.load()
+        self.manifest.refresh()
+        folder = self.manifest.latest_folder()
+        if folder is None or not self.manifest.files(folder):
+            return None
+
+        file_name = self.manifest.files(folder)[0]
+        file_info = self.manifest.file_info(folder, file_name)
+        return folder, file_name, file_info['size'], file_info['mtime']
+
+    def is_new(self, candidate):
+        """To check if the report is due for the daily folder and file of the candidate
+
+        It is due if it was not started yet for them, or if its last run for them failed, the retry
+        interval has passed and attempts are left.
+        """
+
+        last_run = self.state.get('last_run')
+        if last_run is None or (last_run['folder'], last_run['file_name']) != candidate[:2]:
+            return True
+
+        if last_run.get('status') != 'failed' or last_run.get('attempts', 1) >= self.max_attempts:
+            return False
+        return (datetime.now() - datetime.fromisoformat(last_run['finished_at'])).total_seconds() >= self.retry_interval
+
+    def poll(self):
+        """To check the share once and start the report if a new candidate is stable
+
+        Return:
+        float
+            seconds until the candidate is due to be stable, None if there is nothing to wait for
+        """
+
+        candidate = self.candidate()
+        if candidate is None or not self.is_new(candidate):
+            self._observed = None
+            return None
+
+        now = time.monotonic()
+        if candidate != self._observed:
+            # New file, or still being written since the last poll
+            logging.info(f'New F file {candidate[0]}/{candidate[1]} seen, {candidate[2]} bytes, waiting for it to be stable')
+            self._observed = candidate
+            self._observed_since = now
+
+        remaining = self.stable_seconds - (now - self._observed_since)
+        if remaining > 0:
+            return remaining
+
+        self.start_report(candidate)
+        self._observed = None
+        return None
+
+    def start_report(self, candidate):
+        """To run the weekly report for a stable candidate and record the outcome in the state"""
+
+        folder, file_name, size, mtime = candidate
+        last_run = self.state.get('last_run')
+        attempts = last_run.get('attempts', 1) + 1 if last_run is not None and (last_run['folder'], last_run['file_name']) == (folder, file_name) else 1
+        print(f'{folder}/{file_name} is stable, starting the weekly report, attempt {attempts}')
+        logging.info(f'{folder}/{file_name} is stable, starting the weekly report, attempt {attempts}: {self.command}')
+
+        started_at = datetime.now().isoformat(timespec='seconds')
+        start = time.perf_counter()
+        returncode = subprocess.run(self.command, cwd=os.path.dirname(PIPELINE_SCRIPT)).returncode
+        duration = round(time.perf_counter() - start, 3)
+
+        self.state['last_run'] = {
+            'folder': folder,
+            'file_name': file_name,
+            'size': size,
+            'mtime': mtime,
+            'started_at': started_at,
+            'finished_at': datetime.now().isoformat(timespec='seconds'),
+            'duration': duration,
+            'returncode': returncode,
+            'status': 'done' if returncode == 0 else 'failed',
+            'attempts': attempts
+        }
+        self.save()
+
+        print(f'Weekly report for {folder}/{file_name} finished in {duration}s with return code {returncode}')
+        if returncode == 0:
+            logging.info(f'Weekly report for {folder}/{file_name} finished in {duration}s')
+        elif attempts < self.max_attempts:
+            logging.error(f'Weekly report for {folder}/{file_name} failed with return code {returncode} after {duration}s, retrying in {self.retry_interval}s')
+        else:
+            logging.error(f'Weekly report for {folder}/{file_name} failed with return code {returncode} after {duration}s, no attempt left, re-run it by hand')
+
+    def baseline(self):
+        """To record the current candidate as already run, so starting the watcher does not run the report again"""
+
+        candidate = self.candidate()
+        if candidate is None or 'last_run' in self.state:
+            return
+
+        folder, file_name, size, mtime = candidate
+        self.state['last_run'] = {'folder': folder, 'file_name': file_name, 'size': size, 'mtime': mtime,
+                                  'started_at': None, 'finished_at': None, 'duration': None, 'returncode': None,
+                                  'status': 'done', 'attempts': 1}
+        self.save()
+        logging.info(f'Watch state started from {folder}/{file_name}, the report is started for the next new F file')
+
+    def run(self, notifier=None):
+        """To watch the share until interrupted, the notifier (ShareNotifier) only wakes the watcher up earlier"""
+
+        while True:
+            remaining = self.poll()
+            timeout = self.poll_interval if remaining is None else min(self.poll_interval, remaining)
+
+            if notifier is None:
+                time.sleep(timeout)
+                continue
+
+            notifier.watch_folder(self.manifest.latest_folder())
+            if notifier.wait(timeout):
+                logging.info('Change notified in the download share')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Watch the download share and start the weekly report as soon as a new or higher-version F file is stable')
+    parser.add_argument('--poll-interval', type=int, default=config.watch_poll_interval, help='seconds between two polls of the share')
+    parser.add_argument('--stable-seconds', type=int, default=config.watch_stable_seconds, help='seconds a new F file must stay unchanged before the report is started')
+    parser.add_argument('--state', default=config.watch_state_path, help='JSON state of the watcher')
+    parser.add_argument('--run-current', action='store_true', help='on the first start, also run the report for the F file already on the share')
+    parser.add_argument('--no-inotify', action='store_true', help='only poll the share')
+    args = parser.parse_args()
+
+    log_filename = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'log', f"Watch_{datetime.now().strftime('%Y-%m-%d %H-%M-%S')}.txt")
+    logging.basicConfig(filename=log_filename, level=logging.INFO)
+
+    watcher = PrelogWatcher(PrelogManifest(config.download_directory, config.prelog_manifest_path), args.state,
+                            poll_interval=args.poll_interval, stable_seconds=args.stable_seconds,
+                            retry_interval=config.watch_retry_interval, max_attempts=config.watch_max_attempts)
+    if not args.run_current:
+        watcher.baseline()
+
+    notifier = None if args.no_inotify or not config.watch_use_inotify else ShareNotifier.open(config.download_directory)
+    print(f"Watching {config.download_directory} every {args.poll_interval}s{' and with inotify' if notifier else ''}, press Ctrl+C to stop")
+    logging.info(f"Watching {config.download_directory} every {args.poll_interval}s{' and with inotify' if notifier else ''}")
+
+    try:
+        watcher.run(notifier)
+    except KeyboardInterrupt:
+        print('Watch stopped')
+        logging.info('Watch stopped')
+    finally:
+        if notifier is not None:
+            notifier.close()
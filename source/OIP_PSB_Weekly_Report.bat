@@ -1,5 +1,5 @@
 pushd "D:\SGTAM_DP\Working Project\Weekly OIP PSB Program Title Report\source\"
 
-python OIP_PSB_Weekly_Report.py
+python OIP_PSB_Weekly_Report.py %*
 
 TIMEOUT 10
@@ -1,16 +1,20 @@
 import os
+import sys
 from datetime import datetime, date
-import shutil
-from pyspark.sql import SparkSession
-from pyspark.sql.types import StructType, StructField, StringType
-from pyspark.sql.functions import lit, current_date, to_date
-import pyodbc
-import pandas as pd
-from SGTAMProdTask import SGTAMProd
+import OIP_PSB_Weekly_Report_Config as config
+from OIP_PSB_Runtime import PipelineRuntime
+from OIP_PSB_Parser import PRELOG_COLUMNS, PrelogFile
+from OIP_PSB_Ingest import ingest_prelog_python, ingest_prelog_delta, ingest_prelog_swap
+from OIP_PSB_Discovery import PrelogManifest
+from OIP_PSB_PrelogCache import PrelogCache
+from OIP_PSB_ColumnarCache import PrelogColumnarCache
+from OIP_PSB_Metrics import RunMetrics
+from OIP_PSB_Profile import StageProfiler, profiling_requested
+from OIP_PSB_ReportCache import ReportResultCache
+from OIP_PSB_ReportModel import REPORTS, NULL_DISPLAY, date_columns, read_reports, shape_report_frame, stream_report
+from OIP_PSB_ReportWriter import ReportWorkbookWriter
+from OIP_PSB_Validate import ExceptionPrelogValidation, check_prelog, format_validation_report
 import logging
-from openpyxl import Workbook
-from openpyxl.styles import NamedStyle, Font, Border, Side
-import openpyxl
 
 ################################################################################################################
 # Declare custom exception for missing F file check
@@ -26,10 +30,7 @@ today_date = datetime.today().date()
 formatted_today_date = today_date.strftime('%Y-%m-%d')
 
 # map directly to programlog download folder
-directory_path = 'J:\\'
-
-# to store the daily folders created in the "downloads"
-folders_downloads = []
+directory_path = config.download_directory
 
 # to store the latest f file name
 latest_F_file = None
@@ -37,45 +38,53 @@ latest_F_file = None
 # Set up logging
 log_filename = f"D:/SGTAM_DP/Working Project/Weekly OIP PSB Program Title Report/source/log/WeeklyPSBProgramTitleReport_{datetime.now().strftime('%Y-%m-%d %H-%M-%S')}.txt"
 logging.basicConfig(filename=log_filename, level=logging.INFO)
-s = SGTAMProd()
+
+# Stage durations, counters and memory of the run, written next to the log and appended to the run history
+metrics = RunMetrics(f'{os.path.splitext(log_filename)[0]}.json', config.run_history_path)
+
+# python OIP_PSB_Weekly_Report.py --profile (or OIP_PSB_PROFILE=1) profiles every stage into the log directory
+profiler = None
+if profiling_requested(sys.argv[1:]):
+    profiler = StageProfiler(os.path.dirname(log_filename), os.path.splitext(os.path.basename(log_filename))[0], top=config.profile_top)
+    metrics.stage_hooks.append(profiler)
+    print('Profiling every stage with cProfile and tracemalloc')
+    logging.info('Profiling every stage with cProfile and tracemalloc')
+
+# Spark, SQL connection and SGTAMProd are created on first use and shared by every stage of the run
+runtime = PipelineRuntime(metrics=metrics)
 
 
 try:
     # -----------------------------------------------------------------------------------------
+    metrics.start_stage('discovery')
 
     print('Start of code block for getting the list of files names in the daily folder in download folder')
     logging.info('Start of code block for getting the list of files names in the daily folder in download folder')
-    # Get a list of all items (files and folders) in the directory
-    items_in_directory = os.listdir(directory_path)
-
-    # Filter out the folders that start with "2024"
-    # folders_starting_with_2023 = [folder for folder in items_in_directory if os.path.isdir(os.path.join(directory_path, folder)) and folder.startswith("2023")]
-    folders_starting_with_2024 = [folder for folder in items_in_directory if os.path.isdir(os.path.join(directory_path, folder)) and folder.startswith("2024")]
-
-    # Display the list of folders starting with "2024"
-    print("Folders starting with '2024':")
-    for folder in folders_starting_with_2024:
-        folders_downloads.append(folder)
-        print(folder)
-
-    # Convert the date strings to datetime objects
-    date_objects = [datetime.strptime(date_str, "%Y-%m-%d") for date_str in folders_downloads]
+    # Bring the manifest of the download share up to date, only new daily folders and the latest known one are scanned
+    manifest = PrelogManifest(directory_path, config.prelog_manifest_path)
+    scanned_folders = manifest.refresh()
+    print(f'Daily folders scanned: {scanned_folders}')
+    logging.info(f'Daily folders scanned: {scanned_folders}')
+    metrics.count('daily_folders_scanned', len(scanned_folders))
 
     # Find the maximum date
-    max_date = str(max(date_objects).strftime("%Y-%m-%d"))
+    max_date = manifest.latest_folder()
+    if max_date is None:
+        raise ExceptionMissingFFile(f'No daily folder available in {directory_path}.')
 
     # Print the maximum date without the time
     print("Max date found in downloads folder:", max_date)
     logging.info(f"Max date found in downloads folder: {max_date}")
 
-    
+
     print('Getting a list of files in the latest daily folder')
     logging.info('Getting a list of files in the latest daily folder')
-    # Get a list of files in the directory
-    files_in_directory = [file for file in os.listdir(f"{directory_path}\\{max_date}") if os.path.isfile(os.path.join(f"{directory_path}\\{max_date}", file)) and file.startswith("F24")]
+    # F files of the latest daily folder, sorted from latest to oldest version
+    files_in_directory = manifest.files(max_date)
 
     print(files_in_directory)
     logging.info(files_in_directory)
+    metrics.count('f_files', len(files_in_directory))
 
 
     print('Checking if the F file is available in the latest daily folder.\nIf it is not available it will raise exception and send out warning email.')
@@ -93,16 +102,7 @@ try:
         print('F file is available, continuing the process.')
         logging.info('F file is available, continuing the process.')
 
-        # Define a function to extract the date and version from the file name
-        def extract_date_and_version(file_name):
-            date_str = file_name[1:7]  # Extract the date part (e.g., '230719') from the file name
-            version_str = file_name[7:-4]  # Extract the version part (e.g., 'A') from the file name
-            return datetime.strptime(date_str, "%d%m%y"), version_str
-
-        print('Getting a list of F files and sort them from latest to oldest version')
-        logging.info('Getting a list of F files and sort them from latest to oldest version')
-        # Sort the files based on date and version
-        sorted_files = sorted(files_in_directory, key=extract_date_and_version, reverse=True)
+        sorted_files = files_in_directory
         print(f'Available F files today: {sorted_files}')
         logging.info(f'Available F files today: {sorted_files}')
 
@@ -114,346 +114,240 @@ try:
         logging.info(f'Latest F prelog file: {latest_F_file}')
         print(f"Copy the latest F file {latest_F_file} to local drive")
         logging.info(f"Copy the latest F file {latest_F_file} to local drive")
-        f_file_source = os.path.join(directory_path, max_date, latest_F_file)
-        f_file_copy_destination = f'D:/SGTAM_DP/Working Project/Weekly OIP PSB Program Title Report/prelogFiles'
-        shutil.copy2(f_file_source, f_file_copy_destination)
-        print(f'Copied {latest_F_file} to {f_file_copy_destination}')
-        logging.info(f'Copied {latest_F_file} to {f_file_copy_destination}')
+        metrics.start_stage('prelog_fetch')
+        f_file_source = manifest.path(max_date, latest_F_file)
+        f_file_info = manifest.file_info(max_date, latest_F_file)
+        # Only copied if the size / mtime on the share changed since the cached copy was made
+        prelog_cache = PrelogCache(config.prelog_cache_directory, chunk_size=config.prelog_cache_chunk_size, max_age_days=config.prelog_cache_max_age_days, max_total_bytes=config.prelog_cache_max_bytes)
+        csv_file_path = prelog_cache.fetch(f_file_source, source_size=f_file_info['size'], source_mtime=f_file_info['mtime'])
+        prelog_cache.evict(keep=[csv_file_path])
+        metrics.count('prelog_bytes', f_file_info['size'])
+
+        # A prelog with the same content that was already parsed and validated is loaded from the columnar cache
+        metrics.start_stage('validation')
+        columnar_cache = PrelogColumnarCache(config.columnar_cache_directory, max_age_days=config.columnar_cache_max_age_days, max_files=config.columnar_cache_max_files)
+        prelog = columnar_cache.load(latest_F_file, prelog_cache.sha256(latest_F_file))
+
+        if prelog is not None and prelog.validation_report is not None:
+            validation_report = prelog.validation_report
+            print(f"{latest_F_file} loaded from columnar cache {prelog.path}, validated before with {validation_report['rows']} rows")
+            logging.info(f"{latest_F_file} loaded from columnar cache {prelog.path}, validated before with {validation_report['rows']} rows")
+        else:
+            # An artifact without validation report is not used, its Parquet file is closed
+            if prelog is not None:
+                prelog.close()
+
+            # Memory map the F file once, the validator and the python ingest engine share it
+            prelog = PrelogFile(csv_file_path)
+
+            # Validate the F file in one pass before anything is written to SQL Server, raises ExceptionPrelogValidation if it fails
+            print(f'Validating {latest_F_file}')
+            logging.info(f'Validating {latest_F_file}')
+            validation_report = check_prelog(prelog, max_samples=config.validation_max_samples)
+            print(f"{latest_F_file} is valid, {validation_report['rows']} rows, sha256 {validation_report['sha256']}")
+            logging.info(f"{latest_F_file} is valid, {validation_report['rows']} rows, sha256 {validation_report['sha256']}")
+
+            # The columnar cache only saves the next run the parsing, a pyarrow or disk error there does not stop this one
+            try:
+                artifact_path = columnar_cache.store(latest_F_file, validation_report['sha256'], prelog, validation_report)
+                columnar_cache.evict(keep=[artifact_path] if artifact_path else [])
+            except Exception as e:
+                print(f'Columnar cache not updated for {latest_F_file}: {e}')
+                logging.warning(f'Columnar cache not updated for {latest_F_file}: {type(e).__name__}: {e}')
+
+        metrics.count('validated_rows', validation_report['rows'])
+        metrics.count('validated_bytes', validation_report['bytes'])
 
 
 
         # Check if the same filename and import date already exist in the table, if exist then will not insert/update the table
-        print('Creating SQL connection to SGTAMProdOIP')
-        logging.info('Creating SQL connection to SGTAMProdOIP')
-        # SQL Connection Infos
-        server = 'xxx'
-        database = 'xxx'
-        username = 'xxx'
-        password = 'xxx'
-        driver = '{ODBC Driver 17 for SQL Server}'
-        # Set up SQL connection
-        cnxn = pyodbc.connect(f"DRIVER={driver};SERVER={server};DATABASE={database};UID={username};PWD={password}")
-        cursor = cnxn.cursor()
-
-        # Check for existing records
-        query_check = """
-        SELECT COUNT(*) FROM tOIPPreLog3
-        WHERE file_name = ? AND import_date = ?
-        """
-
-        print('Executing query to check if there are any records that have the same file_name and import_date as today import')
-        logging.info('Executing query to check if there are any records that have the same file_name and import_date as today import')
-        cursor.execute(query_check, latest_F_file[0:8], formatted_today_date)
-        count = cursor.fetchone()[0]
-
-        if count > 0:
-            print(f"{count} records found in tOIPPreLog3 with file_name={latest_F_file[0:8]} and import_date={formatted_today_date}. Deleting records with these file_name and import_date.")
-            logging.info(f"{count} records found in tOIPPreLog3 with file_name={latest_F_file[0:8]} and import_date={formatted_today_date}. Deleting records with these file_name and import_date.")
-
-            # Delete the records
-            query_delete = """
-            DELETE FROM tOIPPreLog3
+        metrics.start_stage('ingest')
+        cnxn = runtime.cnxn
+        # Delta and swap modes replace the rows themselves, no need to remove them first
+        if config.ingest_engine == 'spark' or config.load_mode == 'reload':
+            cursor = cnxn.cursor()
+
+            # Check for existing records
+            query_check = """
+            SELECT COUNT(*) FROM tOIPPreLog3
             WHERE file_name = ? AND import_date = ?
             """
 
-            print('Removing those records from SGTAMProdOIP')
-            logging.info('Removing those records from SGTAMProdOIP')
-            cursor.execute(query_delete, latest_F_file[0:8], formatted_today_date)
-            cnxn.commit()
-            print("Records deleted")
-            logging.info('Records deleted')
-        else:
-            print(f"No records found with file_name={latest_F_file[0:8]} and import_date={formatted_today_date}.\n Proceeding to insert the data.")
-            logging.info(f"No records found with file_name={latest_F_file[0:8]} and import_date={formatted_today_date}.\n Proceeding to insert the data.")
+            print('Executing query to check if there are any records that have the same file_name and import_date as today import')
+            logging.info('Executing query to check if there are any records that have the same file_name and import_date as today import')
+            cursor.execute(query_check, latest_F_file[0:8], formatted_today_date)
+            count = cursor.fetchone()[0]
 
-        # Close the cursor and connection
-        cursor.close()
-        cnxn.close()
-        print('SQL connection closed.')
-        logging.info('SQL connection closed.')
+            if count > 0:
+                print(f"{count} records found in tOIPPreLog3 with file_name={latest_F_file[0:8]} and import_date={formatted_today_date}. Deleting records with these file_name and import_date.")
+                logging.info(f"{count} records found in tOIPPreLog3 with file_name={latest_F_file[0:8]} and import_date={formatted_today_date}. Deleting records with these file_name and import_date.")
 
+                # Delete the records
+                query_delete = """
+                DELETE FROM tOIPPreLog3
+                WHERE file_name = ? AND import_date = ?
+                """
 
+                print('Removing those records from SGTAMProdOIP')
+                logging.info('Removing those records from SGTAMProdOIP')
+                cursor.execute(query_delete, latest_F_file[0:8], formatted_today_date)
+                cnxn.commit()
+                print("Records deleted")
+                logging.info('Records deleted')
+            else:
+                print(f"No records found with file_name={latest_F_file[0:8]} and import_date={formatted_today_date}.\n Proceeding to insert the data.")
+                logging.info(f"No records found with file_name={latest_F_file[0:8]} and import_date={formatted_today_date}.\n Proceeding to insert the data.")
 
-        # Create a SparkSession
-        print('Create new Sparks session')
-        logging.info('Create new Sparks session')
-        spark = SparkSession.builder \
-            .appName('Read Text File') \
-            .config("spark.driver.extraClassPath", "D:\\SGTAM_DP\\Working Project\\Weekly OIP PSB Program Title Report\\source\\mssql-jdbc-12.4.0.jre11.jar") \
-            .getOrCreate()
-        
-        
-        # create dataframe from the file
-        csv_file_path = os.path.join(f_file_copy_destination, latest_F_file)
-
-        # Define the schema / columns, datatype and if its nullable, must match that of the SQL DATABASE
-        schema = StructType([
-            StructField("CHANNEL_ID", StringType(), True),
-            StructField("CHANNEL_BELT", StringType(), True),
-            StructField("TX_DATE", StringType(), True),
-            StructField("START_TIME", StringType(), True),
-            StructField("SLOT_DURATION", StringType(), True),
-            StructField("SLOT_NAME", StringType(), True),
-            StructField("MAIN_TITLE", StringType(), True),
-            StructField("EPISODE_TITLE", StringType(), True),
-            StructField("GENRE", StringType(), True),
-            StructField("SUB_GENRE", StringType(), True),
-            StructField("REPEAT", StringType(), True),
-            StructField("LIVE_FLAG", StringType(), True),
-            StructField("SUBTITLE_LANGUAGE", StringType(), True),
-            StructField("PROGRAMME_ID", StringType(), True),
-            StructField("COUNTRY_DESC", StringType(), True),
-            StructField("LANGUAGE_DESC", StringType(), True),
-            StructField("PRODUCTION_TYPE_DESC", StringType(), True),
-            StructField("LOADING_FACTOR", StringType(), True),
-            StructField("SPONSORED_FLAG", StringType(), True),
-            StructField("LIVE_PROGRAMME_ID", StringType(), True),
-            StructField("REFERENCE_ID", StringType(), True),
-            StructField("MASTER_REFERENCE_KEY", StringType(), True),
-            StructField("PRODUCTION_SUB_TYPE", StringType(), True),
-            StructField("PSB_SURVEY", StringType(), True),
-            StructField("ALTERNATE_LANGUAGE", StringType(), True)
-        ])
-
-
-        print(f'Creating PySpark dataframe from the F file {latest_F_file}')
-        logging.info(f'Creating PySpark dataframe from the F file {latest_F_file}')
-        # header = false , mean dont treat first line of the file as the headers
-        df = spark.read.format("csv") \
-            .option("delimiter", "\t") \
-            .option("header", "false") \
-            .schema(schema) \
-            .load(csv_file_path)
-
-
-        # Add columns "ref_date" and "import_date" with default values to the DataFrame
-        df = df.withColumn("file_name", lit(latest_F_file[0:8]).cast(StringType())) \
-               .withColumn("import_date", current_date())
-
-        # Reorder the columns to have the new columns at the first and second positions
-        column_order = ["file_name", "import_date"] + df.columns[:-2]
-        df = df.select(*column_order)
-
-        # Converting the TX_DATE date string to a date type 
-        df = df.withColumn("TX_DATE", to_date(df["TX_DATE"], 'yyyyMMdd'))
-        
-        print('PySpark dataframe created.')
-        logging.info('PySpark dataframe created.')
-
-        # check how many records in dataframe
-        row_count = df.count()
-        print(f'\nDataframe has {row_count} rows, please cross check with the data file')
-        logging.info(f'\nDataframe has {row_count} rows, please cross check with the data file')
-
-        #-------------------------------------------------------------------------------------------------------
-        count = 0
-        with open(csv_file_path, 'r', encoding='utf-8') as file:
-            for line in file:
-                if line.strip():  # Check if the line contains any non-whitespace characters
-                    count += 1
-
-        print(f"{latest_F_file} has {count} rows of non-empty lines\n")
-        logging.info(f"{latest_F_file} has {count} rows of non-empty lines\n")
-         #-------------------------------------------------------------------------------------------------------
-
-
-        print(f'Importing the dataframe with file_name:{latest_F_file} and import_date:{formatted_today_date} into tOIPPreLog3')
-        logging.info(f'Importing the dataframe with file_name:{latest_F_file} and import_date:{formatted_today_date} into tOIPPreLog3')
-        df.write \
-          .format("jdbc") \
-          .option("url", "jdbc:sqlserver:xxx:1433;databaseName=xxx;trustServerCertificate=true") \
-          .option("dbtable", "xxx") \
-          .option("user", "xxx") \
-          .option("password", "xxx") \
-          .mode("append") \
-          .save()
-
-        print('Imported completed')
-        logging.info('Imported completed')
-
-        # Closing the SparkSession
-        spark.stop()
-        print('PySpark connection stopped')
-        logging.info('PySpark connection stopped')
+            # Close the cursor, the connection is kept open for the following stages
+            cursor.close()
 
 
-        ##--------------------------------------------------------------------------------------------------------------##
-        ## Get results from stored prod and export to excel file
-        ##--------------------------------------------------------------------------------------------------------------##
-        
-        # Create a Spark session
-        spark = SparkSession.builder \
-            .appName('SQL Server Connection') \
-            .config("spark.driver.extraClassPath", "D:\\SGTAM_DP\\Working Project\\Weekly OIP PSB Program Title Report\\source\\mssql-jdbc-12.4.0.jre11.jar") \
-            .getOrCreate()
-        print('Created spark connection again.')
-        logging.info('Created spark connection again.')
 
-        
-        
-        # Define queries to call the stored procedures
-        query_main_report = f"EXEC SP_OIP_PSB_Weekly_Report_Main '{latest_F_file[0:8]}', '{formatted_today_date}'"
-        query_secondary_report = f"EXEC SP_OIP_PSB_Weekly_Report_Secondary '{latest_F_file[0:8]}', '{formatted_today_date}'"
-
-        # Create a connection using pyodbc
-        print('Creating pandas dataframes from the SQL results for main and secondary reports')
-        logging.info('Creating pandas dataframes from the SQL results for main and secondary reports')
-        with pyodbc.connect(f"DRIVER={driver};SERVER={server};DATABASE={database};UID={username};PWD={password}") as cnxn:
-            pandas_df_main = pd.read_sql(query_main_report, cnxn)
-            pandas_df_secondary = pd.read_sql(query_secondary_report, cnxn)
-            # Replace all NaN or empty values with 'NULL' in the DataFrames
-            pandas_df_main.fillna('NULL', inplace=True)
-            pandas_df_secondary.fillna('NULL', inplace=True)
-
-        # Convert the column to datetime if it's not already
-        pandas_df_main['Broadcast Date'] = pd.to_datetime(pandas_df_main['Broadcast Date'])
-        pandas_df_main['Start Date'] = pd.to_datetime(pandas_df_main['Start Date'])
-        pandas_df_main['End Date'] = pd.to_datetime(pandas_df_main['End Date'])
-        pandas_df_secondary['import_date'] = pd.to_datetime(pandas_df_secondary['import_date'])
-        pandas_df_secondary['TX_DATE'] = pd.to_datetime(pandas_df_secondary['TX_DATE'])
-
-        # # Convert the column from datetime to date 
-        # pandas_df_main['Broadcast Date'] = pandas_df_main['Broadcast Date'].dt.date
-        # pandas_df_main['Start Date'] = pandas_df_main['Start Date'].dt.date
-        # pandas_df_main['End Date'] = pandas_df_main['End Date'].dt.date
-        # pandas_df_secondary['import_date'] = pandas_df_secondary['import_date'].dt.date
-        # pandas_df_secondary['TX_DATE'] = pandas_df_secondary['TX_DATE'].dt.date
-
-        # Change the date format to dd/mm/yyyy
-        pandas_df_main['Broadcast Date'] = pandas_df_main['Broadcast Date'].dt.strftime('%d/%m/%Y')
-        pandas_df_main['Start Date'] = pandas_df_main['Start Date'].dt.strftime('%d/%m/%Y')
-        pandas_df_main['End Date'] = pandas_df_main['End Date'].dt.strftime('%d/%m/%Y')
-        pandas_df_secondary['import_date'] = pandas_df_secondary['import_date'].dt.strftime('%d/%m/%Y')
-        pandas_df_secondary['TX_DATE'] = pandas_df_secondary['TX_DATE'].dt.strftime('%d/%m/%Y')
-
-
-        # Convert these columns to Int64 nullable type to prevent type error in excel
-        pandas_df_main['Program ID'] = pandas_df_main['Program ID'].astype('Int64')
-        pandas_df_main['Content ID'] = pandas_df_main['Content ID'].astype('Int64') 
-        pandas_df_secondary['START_TIME'] = pandas_df_secondary['START_TIME'].astype('Int64')
-        pandas_df_secondary['SLOT_DURATION'] = pandas_df_secondary['SLOT_DURATION'].astype('Int64')
-        # pandas_df_secondary['PROGRAMME_ID'] = pandas_df_secondary['PROGRAMME_ID'].astype('Int64') ##test
-        pandas_df_secondary['PROGRAMME_ID'] = pandas_df_secondary['PROGRAMME_ID'].apply(pd.to_numeric, errors='ignore') ##test #due to Asian Games
-        pandas_df_secondary['LOADING_FACTOR'] = pandas_df_secondary['LOADING_FACTOR'].astype('Int64')
-
-        # # Convert Pandas DataFrames to PySpark DataFrames if needed
-        # df_main = spark.createDataFrame(pandas_df_main)
-        # df_secondary = spark.createDataFrame(pandas_df_secondary)
-        # print('Convereted the pandas dataframe PySpark dataframes')
-        # logging.info('Convereted the pandas dataframe PySpark dataframes')
-
-        # Create an Excel writer with Pandas
-        print('Creating the excel report file.')
-        logging.info('Creating the excel report file.')
-        writer = pd.ExcelWriter("PSB Program Title Report.xlsx", engine='openpyxl', date_format='MM/DD/YYYY')
-                
-        # Write the Pandas DataFrames to two different sheets in the Excel file
-        pandas_df_main.to_excel(writer, sheet_name='Main Report', index=False)
-        print('Main report written to excel file')
-        logging.info('Main report written to excel file')
-        
-        pandas_df_secondary.to_excel(writer, sheet_name=f'{latest_F_file[0:8]}', index=False)
-        print('Secondary report written to excel file')
-        logging.info('Secondary report written to excel file')
+        if config.ingest_engine == 'spark':
+            from pyspark.sql.types import StructType, StructField, StringType
+            from pyspark.sql.functions import lit, current_date, to_date
 
-        # Save the Excel file
-        # writer.save()
-        writer.close()
-        print('Excel report file saved')
-        logging.info('Excel report file saved')
+            spark = runtime.spark
 
-        #-----------------------------------------------------------------------------------------------------------------------------------#
-        # Access excel file and apply format to a few date columns
-        # Define the path and load the workbook
-        excel_file_path = 'D:/SGTAM_DP/Working Project/Weekly OIP PSB Program Title Report/source/PSB Program Title Report.xlsx'
-        workbook = openpyxl.load_workbook(excel_file_path)
 
-        # Define the date columns for each sheet
-        sheet_columns_map = {
-            "Main Report": ['Broadcast Date', 'Start Date', 'End Date'],
-            f'{latest_F_file[0:8]}': ['import_date', 'TX_DATE']
-        }
-        
-        # Define the date style
-        date_style = NamedStyle(name='date_style', number_format='MM/DD/YYYY')
-        
-        # Function to process each sheet and format date columns
-        def format_date_columns(sheet, columns):
-            for col_name in columns:
-                col_index = None
-                for idx, cell in enumerate(sheet[1], 1):
-                    if cell.value == col_name:
-                        col_index = idx
-                        break
-                    
-                # If column is found, process it
-                if col_index:
-                    # Set column width
-                    sheet.column_dimensions[openpyxl.utils.get_column_letter(col_index)].width = 15
-                    
-                    # Process each cell in the column
-                    for row in sheet.iter_rows(min_row=2, min_col=col_index, max_col=col_index):
-                        for cell in row:
-                            cell_value = cell.value
-        
-                            # Convert string to date format
-                            if isinstance(cell_value, str):
-                                try:
-                                    date_value = pd.to_datetime(cell_value, dayfirst=True).date()
-                                    cell.value = date_value
-                                    cell.style = date_style
-                                except ValueError:
-                                    # Silently pass for non-date strings
-                                    pass
-                                
-                            # Convert pd.Timestamp to date format
-                            elif isinstance(cell_value, pd.Timestamp):
-                                date_value = cell_value.date()
-                                cell.value = date_value
-                                cell.style = date_style
-        
-        # Apply formatting to sheets
-        for sheet_name, columns in sheet_columns_map.items():
-            format_date_columns(workbook[sheet_name], columns)
-        
-        
-        
-        # List of strings to populate 'Exclusive Titles' sheet
-        # (You can fill this list with your actual values)
-        titles = ["What on Earth S2", "Let Me Tell You A Story", "Streets Made For Talking : Telok Ayer", "Oh Butterfly!", "Measuring Meritocracy", "Space Farmers", "MasterChef Singapore Season 4", "The Great Migration: New Eden", "Pesuvom Sr 2","Lights. Camera. Action On Caldecott","The Roots Of Our Garden","Untold Legends","Premium Rush: Inside Air Cargo Singapore - Part 1","Premium Rush: Inside Air Cargo Singapore - Part 2","ROOTS: A Greening Journey"]  # Replace ... with your list of strings
+            # Define the schema / columns, datatype and if its nullable, must match that of the SQL DATABASE
+            schema = StructType([StructField(column, StringType(), True) for column in PRELOG_COLUMNS])
 
-        # Create a new sheet 'Exclusive Titles' 
-        if "Exclusive Titles" in workbook.sheetnames:
-            ws_exclusive_titles = workbook["Exclusive Titles"]
-        else:
-            ws_exclusive_titles = workbook.create_sheet("Exclusive Titles")
 
-        # Add the header to column A
-        ws_exclusive_titles["A1"] = "Main Title"
-        bold_font = Font(bold=True)
-        ws_exclusive_titles["A1"].font = bold_font
+            print(f'Creating PySpark dataframe from the F file {latest_F_file}')
+            logging.info(f'Creating PySpark dataframe from the F file {latest_F_file}')
+            # header = false , mean dont treat first line of the file as the headers
+            df = spark.read.format("csv") \
+                .option("delimiter", "\t") \
+                .option("header", "false") \
+                .schema(schema) \
+                .load(csv_file_path)
+
+
+            # Add columns "ref_date" and "import_date" with default values to the DataFrame
+            df = df.withColumn("file_name", lit(latest_F_file[0:8]).cast(StringType())) \
+                   .withColumn("import_date", current_date())
+
+            # Reorder the columns to have the new columns at the first and second positions
+            column_order = ["file_name", "import_date"] + df.columns[:-2]
+            df = df.select(*column_order)
+
+            # Converting the TX_DATE date string to a date type 
+            df = df.withColumn("TX_DATE", to_date(df["TX_DATE"], 'yyyyMMdd'))
+
+            print('PySpark dataframe created.')
+            logging.info('PySpark dataframe created.')
+
+            print(f'Importing the dataframe with file_name:{latest_F_file} and import_date:{formatted_today_date} into tOIPPreLog3')
+            logging.info(f'Importing the dataframe with file_name:{latest_F_file} and import_date:{formatted_today_date} into tOIPPreLog3')
+            df.write \
+              .format("jdbc") \
+              .option("url", "jdbc:sqlserver:xxx:1433;databaseName=xxx;trustServerCertificate=true") \
+              .option("dbtable", "xxx") \
+              .option("user", "xxx") \
+              .option("password", "xxx") \
+              .mode("append") \
+              .save()
 
-        # Define a full border (all sides)
-        all_border = Border(top=Side(style='thin'), bottom=Side(style='thin'), left=Side(style='thin'), right=Side(style='thin'))
-        ws_exclusive_titles["A1"].border = all_border   
+            print(f"Imported completed, {validation_report['rows']} rows in the data file")
+            logging.info(f"Imported completed, {validation_report['rows']} rows in the data file")
 
-        # Populate the cells in column A starting from the second row
-        for idx, title in enumerate(titles, start=2):
-            ws_exclusive_titles[f"A{idx}"] = title
+        elif config.load_mode == 'delta':
+            # Apply only the rows inserted, updated and removed since the previous version of this prelog
+            print(f'Importing {latest_F_file} with file_name:{latest_F_file[0:8]} and import_date:{formatted_today_date} into tOIPPreLog3 as a delta of the previous load')
+            logging.info(f'Importing {latest_F_file} with file_name:{latest_F_file[0:8]} and import_date:{formatted_today_date} into tOIPPreLog3 as a delta of the previous load')
+            delta = ingest_prelog_delta(cnxn, prelog, latest_F_file[0:8], today_date, batch_size=config.ingest_batch_size)
+            metrics.count('ingested_rows', delta['inserted'] + delta['updated'] + delta['removed'])
 
+            print(f"Imported completed, previous load {delta['previous_load']}, {delta['inserted']} rows inserted, {delta['updated']} updated, {delta['removed']} removed, {delta['unchanged']} unchanged, {validation_report['rows']} rows in the data file")
+            logging.info(f"Imported completed, previous load {delta['previous_load']}, {delta['inserted']} rows inserted, {delta['updated']} updated, {delta['removed']} removed, {delta['unchanged']} unchanged, {validation_report['rows']} rows in the data file")
 
-        # Save the changes
-        workbook.save(excel_file_path)
+        elif config.load_mode == 'swap':
+            # Bulk load into a staging table and switch the rows into tOIPPreLog3 in one transaction
+            print(f'Importing {latest_F_file} with file_name:{latest_F_file[0:8]} and import_date:{formatted_today_date} into tOIPPreLog3 through a staging table')
+            logging.info(f'Importing {latest_F_file} with file_name:{latest_F_file[0:8]} and import_date:{formatted_today_date} into tOIPPreLog3 through a staging table')
+            swap = ingest_prelog_swap(cnxn, prelog, latest_F_file[0:8], today_date, batch_size=config.ingest_batch_size)
+            metrics.count('ingested_rows', swap['inserted'])
 
-        #-----------------------------------------------------------------------------------------------------------------------------------#
+            print(f"Imported completed, {swap['removed']} rows replaced by {swap['inserted']} rows, {validation_report['rows']} rows in the data file")
+            logging.info(f"Imported completed, {swap['removed']} rows replaced by {swap['inserted']} rows, {validation_report['rows']} rows in the data file")
 
+        else:
+            # Stream the F file straight into tOIPPreLog3 over pyodbc, no JVM / SparkSession needed
+            print(f'Importing {latest_F_file} with file_name:{latest_F_file[0:8]} and import_date:{formatted_today_date} into tOIPPreLog3 using the python ingest engine')
+            logging.info(f'Importing {latest_F_file} with file_name:{latest_F_file[0:8]} and import_date:{formatted_today_date} into tOIPPreLog3 using the python ingest engine')
+            row_count = ingest_prelog_python(cnxn, prelog, latest_F_file[0:8], today_date, batch_size=config.ingest_batch_size)
+            metrics.count('ingested_rows', row_count)
+
+            print(f"Imported completed, {row_count} rows inserted, {validation_report['rows']} rows in the data file")
+            logging.info(f"Imported completed, {row_count} rows inserted, {validation_report['rows']} rows in the data file")
+
+        prelog.close()
+
+        ##--------------------------------------------------------------------------------------------------------------##
+        ## Get results from stored prod and export to excel file
+        ##--------------------------------------------------------------------------------------------------------------##
+        
+        # Define parameters to call the stored procedures
+        report_params = [latest_F_file[0:8], formatted_today_date]
+
+        # Write every sheet in one streaming pass, date cells get their number format as they are written
+        metrics.start_stage('report')
+        print('Creating the excel report file.')
+        logging.info('Creating the excel report file.')
+        writer = ReportWorkbookWriter(config.report_path, null_value=NULL_DISPLAY)
+
+        if config.report_fetch_mode == 'stream':
+            # Fetch the results in chunks straight into their sheets, memory is bounded by the chunk size instead of the rows of the week
+            for report in REPORTS:
+                sheet_name = report['sheet_name'].format(file_name=latest_F_file[0:8])
+                print(f"Streaming {report['procedure']} to sheet {sheet_name} in chunks of {config.report_fetch_chunk_size} rows")
+                logging.info(f"Streaming {report['procedure']} to sheet {sheet_name} in chunks of {config.report_fetch_chunk_size} rows")
+                row_count = stream_report(cnxn, writer, report, sheet_name, report_params, chunk_size=config.report_fetch_chunk_size)
+                metrics.count('report_rows', row_count)
+                print(f'{sheet_name} report written to excel file, {row_count} rows')
+                logging.info(f'{sheet_name} report written to excel file, {row_count} rows')
+
+        else:
+            # The stored procedures only run again if the rows of this load changed since their results were cached
+            report_cache = ReportResultCache(config.report_cache_directory, max_age_hours=config.report_cache_max_age_hours)
+            load_fingerprint = report_cache.load_fingerprint(cnxn, latest_F_file[0:8], formatted_today_date)
+            print(f'Load fingerprint of file_name:{latest_F_file[0:8]} and import_date:{formatted_today_date} is {load_fingerprint}')
+            logging.info(f'Load fingerprint of file_name:{latest_F_file[0:8]} and import_date:{formatted_today_date} is {load_fingerprint}')
+
+            # Run the stored procedures concurrently on pooled connections
+            print('Creating pandas dataframes from the SQL results for main and secondary reports')
+            logging.info('Creating pandas dataframes from the SQL results for main and secondary reports')
+            report_results = read_reports(runtime.connection, report_cache, REPORTS, report_params, load_fingerprint, max_workers=config.report_query_concurrency)
+            metrics.start_stage('workbook')
+
+            # # Convert Pandas DataFrames to PySpark DataFrames if needed
+            # df_main = spark.createDataFrame(pandas_df_main)
+            # df_secondary = spark.createDataFrame(pandas_df_secondary)
+            # print('Convereted the pandas dataframe PySpark dataframes')
+            # logging.info('Convereted the pandas dataframe PySpark dataframes')
+
+            for report in REPORTS:
+                # Keep dates as datetime64 and ids as nullable Int64 up to the writer, nulls are shown as 'NULL' only in the workbook
+                sheet_name = report['sheet_name'].format(file_name=latest_F_file[0:8])
+                pandas_df = shape_report_frame(report_results.pop(report['procedure']), report['column_types'])
+                writer.write_frame(sheet_name, pandas_df, date_columns=date_columns(report['column_types']))
+                metrics.count('report_rows', len(pandas_df))
+                print(f'{sheet_name} report written to excel file')
+                logging.info(f'{sheet_name} report written to excel file')
+
+        writer.write_list('Exclusive Titles', 'Main Title', config.exclusive_titles)
+        print('Exclusive titles written to excel file')
+        logging.info('Exclusive titles written to excel file')
+
+        writer.save()
+        print('Excel report file saved')
+        logging.info('Excel report file saved')
+        metrics.count('workbook_bytes', os.path.getsize(config.report_path))
 
-        # Stop the Spark session
-        spark.stop()
-        print('PySpark connection stopped')
-        logging.info('PySpark connection stopped')
 
         # Send missing F file email
+        metrics.start_stage('email')
         logging.info("Preparing to send successful email")
         print("Preparing to send successful email")
         email_body = f"<p>Hi all,</p><p>Kindly find the weekly PSB Program Title Report, it was generated based on the latest prelog file {latest_F_file} received today.</p><br><p>*This is an auto-generated email, kindly reply to SGTAMDPTeam@gfk.com instead.*</p>"
@@ -463,14 +357,17 @@ try:
             'subject':f'PSB Program Title Report - {formatted_today_date}',
             'body':email_body,
             'is_html':True,
-            'filename':"D:/SGTAM_DP/Working Project/Weekly OIP PSB Program Title Report/source/PSB Program Title Report.xlsx"
+            'filename':config.report_path
         }
-        s.send_email(**email_kwargs)
-        logging.info("Report sent")
-        print("Report sent")
+        runtime.sgtam.queue_email(**email_kwargs)
+        logging.info("Report queued in the email outbox")
+        print("Report queued in the email outbox")
+        metrics.status = 'success'
 
 # To send WARNING email for missing F file
 except ExceptionMissingFFile as e:
+    metrics.end_stage(error=type(e).__name__)
+    metrics.status = 'missing_f_file'
     print(e)
     logging.info(e)
     # Send missing F file email
@@ -485,11 +382,34 @@ except ExceptionMissingFFile as e:
         'is_html':True,
         'filename':log_filename
     }
-    s.send_email(**email_kwargs)
-    logging.info("Warning email sent")
-    print("Warning email sent")
+    runtime.sgtam.queue_email(**email_kwargs)
+    logging.info("Warning email queued in the email outbox")
+    print("Warning email queued in the email outbox")
+
+# To send ERROR email for a F file that failed validation, nothing has been written to SQL Server
+except ExceptionPrelogValidation as e:
+    metrics.end_stage(error=type(e).__name__)
+    metrics.status = 'validation_failed'
+    print(e)
+    logging.info(e)
+    logging.info("Preparing to send validation error email")
+    print("Preparing to send validation error email")
+    email_body = f"<p>The prelog file {latest_F_file} failed validation and was not imported into tOIPPreLog3:</p><pre>{format_validation_report(e.report)}</pre><p>Please check log at {log_filename}</p><p>*This is an auto generated email, do not reply to this email.</p>"
+    email_kwargs = {
+        'sender':'xxx',
+        'to':'xxx',
+        'subject':f'[ERROR] OIP PSB Weekly Report - {formatted_today_date} - Prelog validation failed',
+        'body':email_body,
+        'is_html':True,
+        'filename':log_filename
+    }
+    runtime.sgtam.queue_email(**email_kwargs)
+    logging.info("Validation error email queued in the email outbox")
+    print("Validation error email queued in the email outbox")
 
 except Exception as e:
+    metrics.end_stage(error=type(e).__name__)
+    metrics.status = 'error'
     print(f'There is an error:\n{e}')
     logging.info(f'There is an error:\n{e}')
     # Send error email
@@ -504,10 +424,34 @@ except Exception as e:
         'is_html':True,
         'filename':log_filename
     }
-    s.send_email(**email_kwargs)
-    logging.info("Error email sent")
-    print("Error email sent")
+    runtime.sgtam.queue_email(**email_kwargs)
+    logging.info("Error email queued in the email outbox")
+    print("Error email queued in the email outbox")
 
 finally:
+    # Emails are delivered in the background, wait once for the ones of this run before closing, mail left by a previous run is sent along but not counted
+    metrics.start_stage('email_delivery')
+    undelivered_emails = runtime.sgtam.flush_outbox(timeout=config.email_flush_timeout)
+    metrics.count('emails_undelivered', undelivered_emails)
+    print(f'Email outbox flushed, {undelivered_emails} emails of this run not delivered')
+    logging.info(f'Email outbox flushed, {undelivered_emails} emails of this run not delivered')
+    if undelivered_emails > 0:
+        # The next run is a week away, an undelivered report or warning must fail this one
+        metrics.status = 'email_failed' if metrics.status == 'success' else metrics.status
+        print(f'{undelivered_emails} emails could not be delivered within {config.email_flush_timeout}s, see the email outbox')
+        logging.error(f'{undelivered_emails} emails could not be delivered within {config.email_flush_timeout}s, see the email outbox')
+
+    # Write the run record next to the log and append it to the run history
+    metrics.finish()
+    if profiler is not None:
+        profiler.close()
+
+    # Stop the Spark session and close the SQL connection once for the whole run
+    runtime.close()
     print('This is the finally clause.')
-    logging.info('This is the finally clause.')
\ No newline at end of file
+    logging.info('This is the finally clause.')
+
+
+# The scheduler and OIP_PSB_Watch.py only see the exit code, a run that did not succeed must not exit with 0
+if metrics.status != 'success':
+    sys.exit(1)
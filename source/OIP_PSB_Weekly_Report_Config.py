@@ -0,0 +1,114 @@
+# Engine used to load the F prelog file into tOIPPreLog3
+# 'python' : stream the file and bulk insert over pyodbc, no JVM / SparkSession needed
+# 'spark'  : read the file with PySpark and append over JDBC (mssql-jdbc jar)
+ingest_engine = 'python'
+
+# Number of rows sent to SQL Server per executemany batch by the python ingest engine
+ingest_batch_size = 10000
+
+# SQL Connection Infos for SGTAMProdOIP
+server = 'xxx'
+database = 'xxx'
+username = 'xxx'
+password = 'xxx'
+driver = '{ODBC Driver 17 for SQL Server}'
+
+# mssql-jdbc driver put on the Spark driver classpath, only used by the 'spark' ingest engine
+spark_jdbc_jar = "D:\\SGTAM_DP\\Working Project\\Weekly OIP PSB Program Title Report\\source\\mssql-jdbc-12.4.0.jre11.jar"
+
+# Maximum number of offending lines listed per check in the prelog validation report
+validation_max_samples = 10
+
+# How the python ingest engine writes the F file into tOIPPreLog3, the spark engine always reloads
+# 'reload' : delete the rows of the same file_name / import_date and insert the whole file
+# 'delta'  : diff against the latest load of the same prelog (any version) keyed by CHANNEL_ID, TX_DATE, START_TIME
+#            and send only the inserted / updated / removed rows, the previous version is kept and copied on the server
+# 'swap'   : bulk load into a staging table, then delete + insert into tOIPPreLog3 in one set-based transaction
+load_mode = 'reload'
+
+# Prelog download share with one yyyy-mm-dd folder per day
+download_directory = 'J:\\'
+
+# Persisted index of the daily folders and F files of the download share
+prelog_manifest_path = 'D:/SGTAM_DP/Working Project/Weekly OIP PSB Program Title Report/source/cache/prelog_manifest.json'
+
+# Local cache of the F files copied from the download share
+prelog_cache_directory = 'D:/SGTAM_DP/Working Project/Weekly OIP PSB Program Title Report/prelogFiles'
+prelog_cache_chunk_size = 8 * 1024 * 1024
+# Cached files not used for this many days are removed, None to keep them
+prelog_cache_max_age_days = 180
+# Least recently used cached files are removed above this total size in bytes, None for no limit
+prelog_cache_max_bytes = 5 * 1024 ** 3
+
+# Typed Parquet artifacts of every parsed and validated prelog, needs pyarrow
+columnar_cache_directory = 'D:/SGTAM_DP/Working Project/Weekly OIP PSB Program Title Report/prelogParquet'
+# Artifacts not used for this many days are removed, None to keep them
+columnar_cache_max_age_days = 730
+# Oldest artifacts are removed above this number of files, None for no limit
+columnar_cache_max_files = None
+
+# Results of the report stored procedures, reused while the rows of the load are unchanged
+report_cache_directory = 'D:/SGTAM_DP/Working Project/Weekly OIP PSB Program Title Report/source/cache/report'
+# Cached results older than this are not used, None to only rely on the load fingerprint
+report_cache_max_age_hours = 24 * 7
+
+# Maximum number of report stored procedures running at the same time, each on its own pooled connection
+report_query_concurrency = 2
+
+# How the report stored procedure results are fetched into the workbook
+# 'frame'  : read each whole result into a DataFrame, procedures run concurrently and results are cached
+# 'stream' : fetch each result in chunks of report_fetch_chunk_size rows straight into its sheet, memory is
+#            bounded by the chunk size, procedures run one after the other and the report cache is not used
+report_fetch_mode = 'frame'
+report_fetch_chunk_size = 50000
+
+# Run records of every run (stage durations, counters, memory), compared with python OIP_PSB_Metrics.py
+run_history_path = 'D:/SGTAM_DP/Working Project/Weekly OIP PSB Program Title Report/source/log/run_history.jsonl'
+
+# Number of functions and allocation lines listed per stage by the --profile mode
+profile_top = 30
+
+# Seconds the run waits for the queued emails to be delivered before exiting
+email_flush_timeout = 300
+
+# python OIP_PSB_Backfill.py --start yyyy-mm-dd --end yyyy-mm-dd loads every F file version of a range of daily folders
+# Worker processes validating and loading files, and how many of them may load into SQL Server at the same time
+backfill_workers = 4
+backfill_db_concurrency = 2
+# Outcome of every file of the backfill, an interrupted backfill resumes from it
+backfill_checkpoint_path = 'D:/SGTAM_DP/Working Project/Weekly OIP PSB Program Title Report/source/cache/backfill_checkpoint.json'
+
+# python OIP_PSB_Watch.py starts the weekly report as soon as a new or higher-version F file lands and is stable
+# Seconds between two polls of the download share
+watch_poll_interval = 60
+# Seconds the size and mtime of a new F file must stay unchanged before the report is started
+watch_stable_seconds = 120
+# Seconds after a failed report before it is started again for the same F file, and runs allowed for one F file
+watch_retry_interval = 1800
+watch_max_attempts = 3
+# Also wake up on inotify events where the mount supports them, needs the inotify_simple package
+watch_use_inotify = True
+# Last F file the report was started for and the outcome of the run
+watch_state_path = 'D:/SGTAM_DP/Working Project/Weekly OIP PSB Program Title Report/source/cache/watch_state.json'
+
+# Report workbook attached to the weekly email
+report_path = 'D:/SGTAM_DP/Working Project/Weekly OIP PSB Program Title Report/source/PSB Program Title Report.xlsx'
+
+# List of strings to populate 'Exclusive Titles' sheet
+exclusive_titles = [
+    "What on Earth S2",
+    "Let Me Tell You A Story",
+    "Streets Made For Talking : Telok Ayer",
+    "Oh Butterfly!",
+    "Measuring Meritocracy",
+    "Space Farmers",
+    "MasterChef Singapore Season 4",
+    "The Great Migration: New Eden",
+    "Pesuvom Sr 2",
+    "Lights. Camera. Action On Caldecott",
+    "The Roots Of Our Garden",
+    "Untold Legends",
+    "Premium Rush: Inside Air Cargo Singapore - Part 1",
+    "Premium Rush: Inside Air Cargo Singapore - Part 2",
+    "ROOTS: A Greening Journey"
+]
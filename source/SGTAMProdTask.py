@@ -1,18 +1,150 @@
 import SGTAMProdTaskConfig as config
 
 import sqlalchemy as sql
+import asyncio
+import atexit
+import base64
+from concurrent.futures import ThreadPoolExecutor
+import datetime
+import email.header
+import email.utils
+import functools
+import json
 import logging
+import os
+import smtplib
 import sys
+import threading
+import time
+import uuid
+
+
+def _read_json(path, description):
+	"""To read a JSON file of the helpers (outbox envelope, holiday calendar cache), None if it is missing or unreadable"""
+
+	if not os.path.isfile(path):
+		return None
+
+	try:
+		with open(path, 'r', encoding='utf-8') as file:
+			return json.load(file)
+	except (OSError, ValueError) as e:
+		logging.warning(f'Ignoring unreadable {description} {path}: {e}')
+		return None
+
+
+def _write_json(path, data):
+	"""To write a JSON file through a temp file replaced in one step, so a stopped process never leaves it half written"""
+
+	os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+	with open(f'{path}.tmp', 'w', encoding='utf-8') as file:
+		json.dump(data, file, indent=1)
+	os.replace(f'{path}.tmp', path)
+
+
+def _is_process_alive(pid):
+	"""To check if a process of this machine is still running, used to recover the outbox claims of stopped runs"""
+
+	if os.name == 'nt':
+		# os.kill would terminate the process on Windows, ask for its exit code instead
+		import ctypes
+		kernel32 = ctypes.windll.kernel32
+		handle = kernel32.OpenProcess(0x1000, False, pid)  # PROCESS_QUERY_LIMITED_INFORMATION
+		if not handle:
+			# Access denied means the process exists but belongs to another user
+			return kernel32.GetLastError() == 5
+		try:
+			exit_code = ctypes.c_ulong()
+			return bool(kernel32.GetExitCodeProcess(handle, ctypes.byref(exit_code))) and exit_code.value == 259  # STILL_ACTIVE
+		finally:
+			kernel32.CloseHandle(handle)
+
+	try:
+		os.kill(pid, 0)
+	except ProcessLookupError:
+		return False
+	except PermissionError:
+		return True
+	return True
+
 
 class SGTAMProd:
 
+	def __init__(self):
+		self.__engines = {}
+		self.__engines_lock = threading.Lock()
+		self.__holiday_calendar = None
+		self.__tlog_writer = None
+		self.__outbox = None
+		self.__outbox_flushed = False
+
+
 	def __init_db_connection(self, database):
-		"""To initialise database connection"""
+		"""To get the engine of database, it is created on first use and its connection pool is reused by every later call
+
+		Pool settings are read from SGTAMProdTaskConfig (db_pool_size, db_max_overflow, db_pool_pre_ping, db_pool_recycle).
+
+		Parameter:
+		database : str
+			database name
+			example :
+				'SGTAMProd'
+
+		Return:
+		sqlalchemy.engine.Engine
+			pooled engine of database
+		"""
+
+		with self.__engines_lock:
+			if database not in self.__engines:
+				server = 'xxx'
+				username = config.db_username
+				password = config.db_password
+				logging.info(f'Creating engine for {database}')
+				self.__engines[database] = sql.create_engine(
+					f"mssql+pymssql://{username}:{password}@{server}/{database}",
+					pool_size=getattr(config, 'db_pool_size', 5),
+					max_overflow=getattr(config, 'db_max_overflow', 5),
+					pool_pre_ping=getattr(config, 'db_pool_pre_ping', True),
+					pool_recycle=getattr(config, 'db_pool_recycle', 1800)
+				)
+			self.engine = self.__engines[database]
+			return self.engine
+
+
+	def close(self):
+		"""To close the pooled connections of every engine created
+
+		Example:
+		from SGTAMProdTask import SGTAMProd
+		with SGTAMProd() as s:
+			s.update_tlog(**SGTAM_log_config)
+			s.send_email(**email)
+		"""
 
-		server = 'xxx'
-		username = config.db_username
-		password = config.db_password
-		self.engine = sql.create_engine(f"mssql+pymssql://{username}:{password}@{server}/{database}")
+		if self.__tlog_writer is not None:
+			self.__tlog_writer.close()
+			self.__tlog_writer = None
+
+		if self.__outbox is not None:
+			# After an explicit flush_outbox the caller already waited for delivery, do not wait a second time
+			self.__outbox.close(timeout=0 if self.__outbox_flushed else getattr(config, 'email_flush_timeout', 300))
+			self.__outbox = None
+
+		with self.__engines_lock:
+			engines, self.__engines = self.__engines, {}
+
+		for database, engine in engines.items():
+			engine.dispose()
+			logging.info(f'Engine for {database} disposed')
+
+
+	def __enter__(self):
+		return self
+
+
+	def __exit__(self, exc_type, exc_value, traceback):
+		self.close()
 
 
 	def execute_query_to_df(self, sql_query, database):
@@ -33,9 +165,9 @@ class SGTAMProd:
 		"""
 
 		import pandas as pd
-		self.__init_db_connection(database=database)
+		engine = self.__init_db_connection(database=database)
 		try:
-			with self.engine.connect() as con:
+			with engine.connect() as con:
 				df = pd.read_sql(sql=sql_query, con=con)
 				return df
 		except Exception as e:
@@ -64,9 +196,9 @@ class SGTAMProd:
 		print(result[0][0])
 		"""
 
-		self.__init_db_connection(database=database)
+		engine = self.__init_db_connection(database=database)
 		try:
-			with self.engine.begin() as con:
+			with engine.begin() as con:
 				rs = con.execute(sql_query)
 				return rs.fetchall()
 		except Exception as e:
@@ -91,9 +223,9 @@ class SGTAMProd:
 		s.execute_query_without_result(sql_query=sql_query)
 		"""
 
-		self.__init_db_connection(database=database)
+		engine = self.__init_db_connection(database=database)
 		try:
-			with self.engine.begin() as con:
+			with engine.begin() as con:
 				con.execute(sql_query)				
 		except Exception as e:
 			logging.exception(f'Error executing query: {e}, {sql_query}')
@@ -210,6 +342,11 @@ class SGTAMProd:
 
 		self.__validate_tlog_kwargs(**kwargs)
 		self.__validate_update_tlog_kwargs(**kwargs)
+
+		if getattr(config, 'buffered_tlog', False):
+			self.tlog_writer.update_tlog(**kwargs)
+			return
+
 		kwargs['logMsg'] = kwargs['logMsg'].replace("'", "''")
 
 		logging.info(f"Updating tLog logID: {kwargs['logID']} with status: {kwargs['statusFlag']}")
@@ -259,6 +396,9 @@ class SGTAMProd:
 		if include_weekend not in valid_include_weekend_code:
 			logging.exception(f"Invalid include_weekend parameter: {include_weekend}, expecting values: {valid_include_weekend_code}")
 			sys.exit(f"Invalid include_weekend parameter: {include_weekend}, expecting values: {valid_include_weekend_code}")
+
+		if getattr(config, 'holiday_calendar', False):
+			return self.holiday_calendar.is_holiday(ref_date=ref_date, include_weekend=include_weekend)
 		
 		sql_query = f"SELECT dbo.fnGetSkipExecutionResultBasedOnHoliday('{ref_date}', {include_weekend}) AS SkipExecution"
 
@@ -272,6 +412,37 @@ class SGTAMProd:
 			return False
 
 
+	@property
+	def tlog_writer(self):
+		"""TLogWriter of this instance, started on first use with the tlog_* settings of SGTAMProdTaskConfig"""
+
+		# Built under the engine lock, AsyncSGTAMProd may ask for it from several threads at once
+		if self.__tlog_writer is None:
+			with self.__engines_lock:
+				if self.__tlog_writer is None:
+					self.__tlog_writer = TLogWriter(
+						self,
+						flush_interval=getattr(config, 'tlog_flush_interval', 2),
+						max_batch=getattr(config, 'tlog_max_batch', 50)
+					)
+		return self.__tlog_writer
+
+
+	@property
+	def holiday_calendar(self):
+		"""HolidayCalendar of this instance, created on first use with the holiday_calendar_* settings of SGTAMProdTaskConfig"""
+
+		if self.__holiday_calendar is None:
+			with self.__engines_lock:
+				if self.__holiday_calendar is None:
+					self.__holiday_calendar = HolidayCalendar(
+						self,
+						cache_directory=getattr(config, 'holiday_calendar_directory', None),
+						ttl_hours=getattr(config, 'holiday_calendar_ttl_hours', 24)
+					)
+		return self.__holiday_calendar
+
+
 	def __validate_pre_requisite_log_kwargs(self, **kwargs):
 		"""To validate pre-requisite log parameters to ensure required keys are there
 		
@@ -341,22 +512,9 @@ class SGTAMProd:
     		print('execute task')
 		"""
 
-		self.__validate_pre_requisite_log_kwargs(**kwargs)		
-		is_passed = True
-
-		for k, v in kwargs.items():
-			logging.info(f"Get logTaskStatus {k}: {v['logTaskID']} on {ref_date}")
-			sql_query = f"EXEC SP_GetLatestLogStatusByLogTaskID {v['logTaskID']}, '{ref_date}'"
-			result = self.execute_query_with_result(sql_query=sql_query, database='SGTAMProd')
-
-			log_status = -1 if len(result) == 0 else int(result[0][2])
+		task_status = self.get_SGTAMProd_log_task_status(ref_date, **kwargs)
+		is_passed = all(v['passed'] for v in task_status.values())
 
-			if log_status in v['allowedStatus']:
-				logging.info(f"LogTask '{k}' : {v['logTaskID']} logStatus {log_status} matched with allowed status: {v['allowedStatus']}!")				
-			else:
-				logging.warning(f"LogTask '{k}' : {v['logTaskID']} logStatus {log_status} does not match with allowed status: {v['allowedStatus']}!")
-				is_passed = False
-		
 		if is_passed:
 			logging.info("SGTAMProd Log passed!")
 			return True
@@ -365,6 +523,91 @@ class SGTAMProd:
 			return False
 
 
+	def get_SGTAMProd_log_task_status(self, ref_date, **kwargs):
+		"""To get the latest logStatus of every pre-requisite SGTAMProd log task on ref_date in a single round trip
+
+		SP_GetLatestLogStatusByLogTaskID stays the only definition of the latest status, one EXEC per task is
+		sent in a single batch and each result set is read in turn, a task the procedure returns no row for
+		has logStatus -1.
+
+		Parameter:
+		ref_date : str
+			reference date you wish to check for the SGTAMProd Log Tasks
+			example : 
+				'2022-04-28'
+
+		kwargs : dict
+			same pre-requisite dicts as is_SGTAMProd_log_task_passed
+			example :
+				pre_requisite_log = {
+					'Prelim PLD V3 SFTP Upload' : {'logTaskID' : 88, 'allowedStatus' : [1,3]},
+					'Check Prelim PLD V3 SFTP' : {'logTaskID' : 89, 'allowedStatus' : [1]},
+				}
+
+		Return:
+		dict
+			pre-requisite task name -> logTaskID, logStatus, allowedStatus and passed
+			example :
+				{'Prelim PLD V3 SFTP Upload' : {'logTaskID' : 88, 'logStatus' : 1, 'allowedStatus' : [1,3], 'passed' : True},
+				 'Check Prelim PLD V3 SFTP' : {'logTaskID' : 89, 'logStatus' : -1, 'allowedStatus' : [1], 'passed' : False}}
+
+		Example:
+		from SGTAMProdTask import SGTAMProd
+		s = SGTAMProd()
+		task_status = s.get_SGTAMProd_log_task_status('2022-04-29', **pre_requisite_log)
+		failed = [k for k, v in task_status.items() if not v['passed']]
+		"""
+
+		self.__validate_pre_requisite_log_kwargs(**kwargs)
+		if len(kwargs) == 0:
+			return {}
+
+		log_task_ids = [int(v['logTaskID']) for v in kwargs.values()]
+		logging.info(f"Get logTaskStatus of logTaskID {log_task_ids} on {ref_date}")
+		# NOCOUNT keeps row counts of the statements inside the procedure from showing up as extra result sets,
+		# it is set back at the end of the batch as the connection goes back to the pool
+		sql_query = 'SET NOCOUNT ON;\n' + '\n'.join('EXEC SP_GetLatestLogStatusByLogTaskID %s, %s;' for _ in log_task_ids) + '\nSET NOCOUNT OFF;'
+		params = tuple(param for log_task_id in log_task_ids for param in (log_task_id, ref_date))
+
+		engine = self.__init_db_connection(database='SGTAMProd')
+		cnxn = engine.raw_connection()
+		try:
+			cursor = cnxn.cursor()
+			cursor.execute(sql_query, params)
+			log_status_list = []
+			while True:
+				if cursor.description is not None:
+					result = cursor.fetchall()
+					log_status_list.append(-1 if len(result) == 0 else int(result[0][2]))
+				if not cursor.nextset():
+					break
+			cursor.close()
+		except Exception as e:
+			# The batch may have stopped before SET NOCOUNT OFF, the connection is not given back to the pool
+			cnxn.invalidate()
+			logging.exception(f'Error executing query: {e}, {sql_query}')
+			sys.exit(f'Error executing query: {e}, {sql_query}')
+		finally:
+			cnxn.close()
+
+		if len(log_status_list) != len(log_task_ids):
+			logging.error(f'SP_GetLatestLogStatusByLogTaskID returned {len(log_status_list)} result sets for {len(log_task_ids)} logTaskID on {ref_date}')
+			sys.exit(f'SP_GetLatestLogStatusByLogTaskID returned {len(log_status_list)} result sets for {len(log_task_ids)} logTaskID on {ref_date}')
+
+		task_status = {}
+		for (k, v), log_status in zip(kwargs.items(), log_status_list):
+			passed = log_status in v['allowedStatus']
+
+			if passed:
+				logging.info(f"LogTask '{k}' : {v['logTaskID']} logStatus {log_status} matched with allowed status: {v['allowedStatus']}!")
+			else:
+				logging.warning(f"LogTask '{k}' : {v['logTaskID']} logStatus {log_status} does not match with allowed status: {v['allowedStatus']}!")
+
+			task_status[k] = {'logTaskID' : v['logTaskID'], 'logStatus' : log_status, 'allowedStatus' : v['allowedStatus'], 'passed' : passed}
+
+		return task_status
+
+
 	def __validate_email_kwargs(self, **kwargs):
 		"""To validate email parameters to ensure required keys are there
 		
@@ -479,5 +722,817 @@ class SGTAMProd:
 				)
 				email.attach(attch)
 
-		with smtplib.SMTP('mailout.gfk.com', 25) as s:
+		with smtplib.SMTP(getattr(config, 'smtp_host', 'mailout.gfk.com'), getattr(config, 'smtp_port', 25)) as s:
 			s.send_message(email)
+
+
+	@property
+	def outbox(self):
+		"""EmailOutbox of this instance, started on first use with the smtp_* and email_* settings of SGTAMProdTaskConfig"""
+
+		if self.__outbox is None:
+			with self.__engines_lock:
+				if self.__outbox is None:
+					self.__outbox = EmailOutbox(
+						getattr(config, 'email_outbox_directory', None) or os.path.join(os.path.dirname(os.path.abspath(__file__)), 'cache', 'outbox'),
+						host=getattr(config, 'smtp_host', 'mailout.gfk.com'),
+						port=getattr(config, 'smtp_port', 25),
+						max_attempts=getattr(config, 'email_max_attempts', 5),
+						retry_backoff=getattr(config, 'email_retry_backoff', 30),
+						close_timeout=getattr(config, 'email_flush_timeout', 300)
+					)
+		return self.__outbox
+
+
+	def queue_email(self, **kwargs):
+		"""To spool an email to the outbox, it is delivered in the background and retried if mailout is not reachable
+
+		Parameter:
+		kwargs : dict
+			same email dict as send_email
+
+		Return:
+		str
+			id of the spooled message
+
+		Example:
+		from SGTAMProdTask import SGTAMProd
+		s = SGTAMProd()
+		s.queue_email(**email)
+		s.flush_outbox(timeout=300)
+		"""
+
+		self.__validate_email_kwargs(**kwargs)
+		return self.outbox.queue_email(**kwargs)
+
+
+	def flush_outbox(self, timeout=None):
+		"""To wait until the emails queued by this instance are delivered, at most timeout seconds
+
+		Return:
+		int
+			number of emails queued by this instance and not delivered, still in the outbox or moved to the failed folder
+		"""
+
+		if self.__outbox is None:
+			return 0
+		self.__outbox_flushed = True
+		return self.__outbox.flush(timeout=timeout)
+
+
+class EmailOutbox:
+	"""To spool emails to disk and deliver them from a background thread
+
+	queue_email writes the message as a ready to send .eml file, attachments are read and base64 encoded
+	in chunks so they are never held in memory, next to a .json envelope (sender, recipients, attempts).
+	A worker thread delivers the spooled messages over one SMTP connection reused for every message
+	and streams each .eml file to the DATA command. A message that fails for a temporary reason is
+	retried with exponential backoff, after max_attempts or a permanent (5xx) refusal it is moved to
+	the failed folder. Messages left in the outbox by a previous run are delivered by the next outbox
+	started on the same directory, a message claimed by a run that stopped while sending it is put
+	back once the process of that run is gone. flush and close only wait for the messages queued by
+	this outbox, messages of previous runs are delivered along but never count against this run.
+
+	Parameter:
+	directory : str
+		spool directory
+	host : str
+		SMTP server, e.g. 'localhost' for a local stand-in (python -m aiosmtpd -n -l localhost:8025)
+	port : int
+		SMTP port
+	max_attempts : int
+		delivery attempts before a message is moved to the failed folder
+	retry_backoff : int
+		seconds before the first retry, doubled at every attempt up to max_backoff
+	close_timeout : int
+		seconds close() waits for delivery when no timeout is given, e.g. when called at interpreter exit
+
+	Example:
+	from SGTAMProdTask import EmailOutbox
+	outbox = EmailOutbox('D:/outbox', host='localhost', port=8025)
+	outbox.queue_email(sender='xxx', to='xxx', subject='test 1234', body='body testing 1234', is_html=False, filename='attachment.txt')
+	outbox.close(timeout=60)
+	"""
+
+	def __init__(self, directory, host='mailout.gfk.com', port=25, max_attempts=5, retry_backoff=30, max_backoff=900, chunk_size=57 * 1024, poll_interval=5, close_timeout=300):
+		self.directory = directory
+		self.failed_directory = os.path.join(directory, 'failed')
+		self.host = host
+		self.port = port
+		self.max_attempts = max_attempts
+		self.retry_backoff = retry_backoff
+		self.max_backoff = max_backoff
+		# base64 turns every 57 bytes into one 76 characters line
+		self.chunk_size = chunk_size - chunk_size % 57
+		self.poll_interval = poll_interval
+		self.close_timeout = close_timeout
+		# Ids of the messages queued by this outbox, the only ones flush waits for
+		self.__queued = set()
+		self.__smtp = None
+		self.__wake = threading.Event()
+		self.__closed = False
+
+		os.makedirs(self.failed_directory, exist_ok=True)
+		self.__recover_claimed()
+		self.__worker = threading.Thread(target=self.__run, name='EmailOutbox', daemon=True)
+		self.__worker.start()
+		atexit.register(self.close)
+
+
+	def __recover_claimed(self, max_age=3600):
+		# Messages claimed by a run that stopped while sending them are put back in the outbox, a claim
+		# is named {id}.json.{pid}.sending, the age only covers a pid reused by another process since
+		for name in os.listdir(self.directory):
+			if not name.endswith('.sending'):
+				continue
+			path = os.path.join(self.directory, name)
+			envelope_name, _, pid = name[:-len('.sending')].rpartition('.')
+			if not pid.isdigit():
+				# Claim of an older outbox, without pid
+				envelope_name, pid = name[:-len('.sending')], None
+			if pid is None or not _is_process_alive(int(pid)) or time.time() - os.path.getmtime(path) > max_age:
+				logging.info(f'Email claim {name} of a stopped run put back in the outbox')
+				os.replace(path, os.path.join(self.directory, envelope_name))
+
+
+	def __write_base64(self, file, source):
+		while True:
+			chunk = source.read(self.chunk_size)
+			if not chunk:
+				break
+			file.write(base64.encodebytes(chunk).replace(b'\n', b'\r\n'))
+
+
+	def __write_message(self, path, kwargs):
+		boundary = f'===============SGTAMProd{uuid.uuid4().hex}=='
+		headers = [
+			('Subject', kwargs['subject'] if kwargs['subject'].isascii() else email.header.Header(kwargs['subject'], 'utf-8').encode()),
+			('From', kwargs.get('sender', 'xxx')),
+			('To', kwargs.get('to')),
+			('CC', kwargs.get('cc')),
+			('Date', email.utils.formatdate(localtime=True)),
+			('Message-ID', email.utils.make_msgid()),
+			('MIME-Version', '1.0'),
+			('Content-Type', f'multipart/mixed; boundary="{boundary}"')
+		]
+		subtype = 'html' if kwargs['is_html'] else 'plain'
+
+		with open(path, 'wb') as file:
+			for name, value in headers:
+				if value:
+					file.write(f'{name}: {value}\r\n'.encode('utf-8'))
+
+			file.write(f'\r\n--{boundary}\r\nContent-Type: text/{subtype}; charset="utf-8"\r\nContent-Transfer-Encoding: base64\r\n\r\n'.encode('ascii'))
+			file.write(base64.encodebytes(kwargs['body'].encode('utf-8')).replace(b'\n', b'\r\n'))
+
+			if len(kwargs.get('filename') or '') > 0:
+				filename = email.utils.encode_rfc2231(os.path.basename(kwargs['filename']), 'utf-8')
+				file.write(f'\r\n--{boundary}\r\nContent-Type: application/octet-stream\r\nContent-Transfer-Encoding: base64\r\nContent-Disposition: attachment; filename*={filename}\r\n\r\n'.encode('ascii'))
+				with open(kwargs['filename'], 'rb') as source:
+					self.__write_base64(file, source)
+
+			file.write(f'\r\n--{boundary}--\r\n'.encode('ascii'))
+
+
+	def queue_email(self, **kwargs):
+		"""To spool an email, same keys as SGTAMProd.send_email
+
+		Return:
+		str
+			id of the spooled message
+		"""
+
+		message_id = f"{time.strftime('%Y%m%d%H%M%S')}_{uuid.uuid4().hex}"
+		message_path = os.path.join(self.directory, f'{message_id}.eml')
+		self.__write_message(f'{message_path}.tmp', kwargs)
+		os.replace(f'{message_path}.tmp', message_path)
+
+		recipients = [address for name, address in email.utils.getaddresses([kwargs.get(key) or '' for key in ['to', 'cc', 'bcc']]) if address]
+		# The envelope is written last, the worker only picks up messages that have one
+		_write_json(os.path.join(self.directory, f'{message_id}.json'), {
+			'id': message_id,
+			'sender': email.utils.parseaddr(kwargs.get('sender', 'xxx'))[1],
+			'recipients': recipients,
+			'subject': kwargs['subject'],
+			'attempts': 0,
+			'next_attempt': time.time(),
+			'last_error': None
+		})
+		logging.info(f"Email '{kwargs['subject']}' spooled to outbox as {message_id}")
+		self.__queued.add(message_id)
+		self.__wake.set()
+		return message_id
+
+
+	def pending(self, message_ids=None):
+		"""Number of messages waiting or being sent in the outbox, only of message_ids if given"""
+
+		pending_ids = {name.split('.', 1)[0] for name in os.listdir(self.directory) if name.endswith('.json') or name.endswith('.sending')}
+		return len(pending_ids) if message_ids is None else len(pending_ids & set(message_ids))
+
+
+	def undelivered(self):
+		"""Number of messages queued by this outbox that are not delivered, still in the outbox or moved to the failed folder"""
+
+		failed_ids = {name[:-len('.json')] for name in os.listdir(self.failed_directory) if name.endswith('.json')}
+		return self.pending(self.__queued) + len(failed_ids & self.__queued)
+
+
+	def __connection(self):
+		if self.__smtp is not None:
+			try:
+				self.__smtp.noop()
+				return self.__smtp
+			except smtplib.SMTPException:
+				self.__disconnect()
+
+		logging.info(f'Connecting to SMTP server {self.host}:{self.port}')
+		self.__smtp = smtplib.SMTP(self.host, self.port, timeout=60)
+		self.__smtp.ehlo_or_helo_if_needed()
+		return self.__smtp
+
+
+	def __disconnect(self):
+		if self.__smtp is None:
+			return
+		try:
+			self.__smtp.quit()
+		except (smtplib.SMTPException, OSError):
+			self.__smtp.close()
+		self.__smtp = None
+
+
+	def __send_data(self, smtp, message_path):
+		code, response = smtp.docmd('DATA')
+		if code != 354:
+			raise smtplib.SMTPDataError(code, response)
+
+		# Stream the spooled message, lines starting with a dot are dot-stuffed (RFC 5321 4.5.2)
+		buffer = bytearray()
+		with open(message_path, 'rb') as file:
+			for line in file:
+				if line.startswith(b'.'):
+					buffer += b'.'
+				buffer += line
+				if len(buffer) >= 65536:
+					smtp.send(bytes(buffer))
+					buffer.clear()
+		buffer += b'.\r\n'
+		smtp.send(bytes(buffer))
+
+		code, response = smtp.getreply()
+		if code != 250:
+			raise smtplib.SMTPDataError(code, response)
+
+
+	def __deliver(self, envelope, message_path):
+		smtp = self.__connection()
+		code, response = smtp.mail(envelope['sender'])
+		if code != 250:
+			smtp.rset()
+			raise smtplib.SMTPSenderRefused(code, response, envelope['sender'])
+
+		refused = {}
+		for recipient in envelope['recipients']:
+			code, response = smtp.rcpt(recipient)
+			if code not in (250, 251):
+				refused[recipient] = (code, response)
+		if len(refused) == len(envelope['recipients']):
+			smtp.rset()
+			raise smtplib.SMTPRecipientsRefused(refused)
+		if refused:
+			logging.warning(f"Email '{envelope['subject']}' refused for {refused}")
+
+		self.__send_data(smtp, message_path)
+
+
+	@staticmethod
+	def __is_permanent(error):
+		if isinstance(error, smtplib.SMTPRecipientsRefused):
+			return all(500 <= code < 600 for code, response in error.recipients.values())
+		return isinstance(error, smtplib.SMTPResponseException) and 500 <= error.smtp_code < 600
+
+
+	def __process(self, envelope_path):
+		# Claim the message, so an outbox of another run on the same directory does not send it too
+		claimed_path = f'{envelope_path}.{os.getpid()}.sending'
+		try:
+			os.replace(envelope_path, claimed_path)
+		except FileNotFoundError:
+			return
+
+		with open(claimed_path, 'r', encoding='utf-8') as file:
+			envelope = json.load(file)
+		message_path = os.path.join(self.directory, f"{envelope['id']}.eml")
+
+		try:
+			self.__deliver(envelope, message_path)
+		except (smtplib.SMTPException, OSError) as e:
+			envelope['attempts'] += 1
+			envelope['last_error'] = str(e)
+			if not isinstance(e, smtplib.SMTPResponseException):
+				self.__disconnect()
+
+			if self.__is_permanent(e) or envelope['attempts'] >= self.max_attempts:
+				logging.error(f"Email '{envelope['subject']}' not delivered after {envelope['attempts']} attempts, moved to {self.failed_directory}: {e}")
+				os.replace(message_path, os.path.join(self.failed_directory, f"{envelope['id']}.eml"))
+				_write_json(os.path.join(self.failed_directory, f"{envelope['id']}.json"), envelope)
+				os.remove(claimed_path)
+			else:
+				envelope['next_attempt'] = time.time() + min(self.max_backoff, self.retry_backoff * 2 ** (envelope['attempts'] - 1))
+				logging.warning(f"Email '{envelope['subject']}' attempt {envelope['attempts']} failed, retrying in {envelope['next_attempt'] - time.time():.0f}s: {e}")
+				_write_json(envelope_path, envelope)
+				os.remove(claimed_path)
+			return
+
+		os.remove(message_path)
+		os.remove(claimed_path)
+		logging.info(f"Email '{envelope['subject']}' sent to {envelope['recipients']}")
+
+
+	def __due(self):
+		due = []
+		for name in sorted(os.listdir(self.directory)):
+			if not name.endswith('.json'):
+				continue
+			path = os.path.join(self.directory, name)
+			try:
+				with open(path, 'r', encoding='utf-8') as file:
+					next_attempt = json.load(file)['next_attempt']
+			except (OSError, ValueError, KeyError):
+				continue
+			if next_attempt <= time.time():
+				due.append(path)
+		return due
+
+
+	def __run(self):
+		while True:
+			try:
+				for envelope_path in self.__due():
+					self.__process(envelope_path)
+			except Exception as e:
+				logging.error(f'Error delivering the outbox: {e}')
+			# The connection is only kept while there are messages to send
+			self.__disconnect()
+
+			if self.__closed:
+				break
+			self.__wake.wait(self.poll_interval)
+			self.__wake.clear()
+
+
+	def flush(self, timeout=None):
+		"""To wait until the messages queued by this outbox are sent, at most timeout seconds
+
+		Return:
+		int
+			number of messages queued by this outbox and not delivered, see undelivered
+		"""
+
+		deadline = None if timeout is None else time.time() + timeout
+		self.__wake.set()
+		while self.pending(self.__queued) > 0 and self.__worker.is_alive() and (deadline is None or time.time() < deadline):
+			time.sleep(0.2)
+		return self.undelivered()
+
+
+	def close(self, timeout=None):
+		"""To flush the outbox for at most timeout seconds (close_timeout if not given) and stop the worker"""
+
+		if self.__closed:
+			return
+
+		undelivered = self.flush(timeout=self.close_timeout if timeout is None else timeout)
+		if undelivered > 0:
+			logging.warning(f'{undelivered} emails of this run not delivered, see outbox {self.directory}')
+		self.__closed = True
+		self.__wake.set()
+		self.__worker.join()
+		atexit.unregister(self.close)
+
+
+class TLogWriter:
+	"""To write tLog updates from a background thread, so progress logging is off the critical path of the job
+
+	update_tlog only queues the update. Repeated updates of the same logID are merged (the latest status
+	and message win) and a worker thread sends the pending updates every flush_interval seconds as one
+	batch of EXEC SP_LogUpd in a single round trip. flush() writes the pending updates right away and
+	close(), also registered with atexit, stops the worker after a last flush so no update is lost.
+	insert_tlog stays synchronous as the logID it returns is needed by the updates.
+
+	Parameter:
+	sgtam : SGTAMProd
+		used to execute the batches
+	flush_interval : int
+		seconds between two flushes of the worker
+	max_batch : int
+		maximum number of updates sent in one batch
+
+	Example:
+	from SGTAMProdTask import SGTAMProd, TLogWriter
+	s = SGTAMProd()
+	tlog = TLogWriter(s, flush_interval=2)
+	SGTAM_log_config['statusFlag'], SGTAM_log_config['logID'] = tlog.insert_tlog(**SGTAM_log_config)
+	SGTAM_log_config['logMsg'] = 'file loaded'
+	tlog.update_tlog(**SGTAM_log_config)
+	tlog.close()
+	"""
+
+	def __init__(self, sgtam, flush_interval=2, max_batch=50):
+		self.sgtam = sgtam
+		self.flush_interval = flush_interval
+		self.max_batch = max_batch
+		self.__pending = {}
+		self.__pending_lock = threading.Lock()
+		self.__write_lock = threading.Lock()
+		self.__wake = threading.Event()
+		self.__closed = False
+		self.__worker = threading.Thread(target=self.__run, name='TLogWriter', daemon=True)
+		self.__worker.start()
+		atexit.register(self.close)
+
+
+	def insert_tlog(self, **kwargs):
+		"""Same as SGTAMProd.insert_tlog, executed right away"""
+
+		return self.sgtam.insert_tlog(**kwargs)
+
+
+	def update_tlog(self, **kwargs):
+		"""To queue an update of tLog, a pending update of the same logID is replaced"""
+
+		if kwargs.get('logID') is None:
+			logging.error('logID is blank!')
+			sys.exit('logID is blank!')
+
+		# Checked and queued under the lock close() takes, an update is either queued before the last flush or written here
+		with self.__pending_lock:
+			# Re-insert so the merged update keeps the order of its latest change
+			self.__pending.pop(kwargs['logID'], None)
+			self.__pending[kwargs['logID']] = dict(kwargs)
+			pending_count = len(self.__pending)
+			closed = self.__closed
+
+		if closed:
+			logging.warning(f"TLogWriter closed, updating tLog logID: {kwargs['logID']} right away")
+			self.flush()
+		elif pending_count >= self.max_batch:
+			self.__wake.set()
+
+
+	def __take_pending(self):
+		with self.__pending_lock:
+			pending, self.__pending = list(self.__pending.values()), {}
+		return pending
+
+
+	def __write(self, updates):
+		for start in range(0, len(updates), self.max_batch):
+			batch = updates[start:start + self.max_batch]
+			statements = []
+			for update in batch:
+				log_msg = update['logMsg'].replace("'", "''")
+				statements.append(f"EXEC SP_LogUpd '{update['logID']}', '{update['statusFlag']}', '{log_msg}'")
+			sql_query = '\n'.join(statements)
+			logging.info(f"Updating tLog logID: {', '.join(str(update['logID']) for update in batch)}")
+			self.sgtam.execute_query_without_result(sql_query=sql_query, database='SGTAMProd')
+
+
+	def flush(self):
+		"""To write the pending updates now"""
+
+		# Updates are taken and written under the same lock, so a later update of a logID is never overtaken by an older one
+		with self.__write_lock:
+			updates = self.__take_pending()
+			try:
+				self.__write(updates)
+			except BaseException:
+				# Queue the updates again for the next flush, unless a newer update of the same logID came in
+				with self.__pending_lock:
+					for update in updates:
+						self.__pending.setdefault(update['logID'], update)
+				raise
+
+
+	def __run(self):
+		while not self.__closed:
+			self.__wake.wait(self.flush_interval)
+			self.__wake.clear()
+			try:
+				self.flush()
+			except BaseException as e:
+				logging.error(f'Error writing tLog updates: {e}')
+
+
+	def close(self):
+		"""To stop the worker and write the pending updates"""
+
+		with self.__pending_lock:
+			if self.__closed:
+				return
+			self.__closed = True
+
+		self.__wake.set()
+		self.__worker.join()
+		self.flush()
+		atexit.unregister(self.close)
+
+
+class HolidayCalendar:
+	"""To answer holiday questions from a preloaded calendar instead of one EvoProd query per date
+
+	A whole year of dbo.fnGetSkipExecutionResultBasedOnHoliday results, for include_weekend 1 and 0, is
+	loaded in one query the first time a date of that year is asked. Years are kept in memory and, if
+	cache_directory is given, in a JSON file per year that is reused by later runs until it is older
+	than ttl_hours.
+
+	Parameter:
+	sgtam : SGTAMProd
+		used to query EvoProd
+	cache_directory : str
+		directory of the on-disk cache, None to only keep the calendar in memory
+	ttl_hours : int
+		a cached year older than this is loaded again, None to never expire
+
+	Example:
+	from SGTAMProdTask import SGTAMProd, HolidayCalendar
+	calendar = HolidayCalendar(SGTAMProd(), cache_directory='D:/holidayCalendar', ttl_hours=24)
+	if not calendar.is_holiday(ref_date='2022-04-28', include_weekend=1):
+		print('execute task')
+	print(calendar.next_business_day('2022-04-29', include_weekend=1))
+	"""
+
+	def __init__(self, sgtam, cache_directory=None, ttl_hours=24):
+		self.sgtam = sgtam
+		self.cache_directory = cache_directory
+		self.ttl_hours = ttl_hours
+		self.__years = {}
+		self.__lock = threading.Lock()
+
+
+	@staticmethod
+	def __to_date(ref_date):
+		if isinstance(ref_date, datetime.datetime):
+			return ref_date.date()
+		if isinstance(ref_date, datetime.date):
+			return ref_date
+		return datetime.date.fromisoformat(str(ref_date)[0:10])
+
+
+	def __cache_path(self, year):
+		return os.path.join(self.cache_directory, f'holiday_calendar_{year}.json')
+
+
+	def __is_expired(self, loaded):
+		return self.ttl_hours is not None and time.time() - loaded > self.ttl_hours * 3600
+
+
+	def __read_cache(self, year):
+		if self.cache_directory is None:
+			return None
+
+		cached = _read_json(self.__cache_path(year), 'holiday calendar cache')
+		if cached is None or self.__is_expired(cached['loaded']):
+			return None
+		return cached
+
+
+	def __write_cache(self, year, cached):
+		if self.cache_directory is None:
+			return
+
+		_write_json(self.__cache_path(year), cached)
+
+
+	def __query_year(self, year):
+		sql_query = f"""
+		WITH calendarDays AS (
+			SELECT CAST('{year}-01-01' AS DATE) AS refDate
+			UNION ALL
+			SELECT DATEADD(DAY, 1, refDate) FROM calendarDays WHERE refDate < CAST('{year}-12-31' AS DATE)
+		)
+		SELECT refDate,
+			dbo.fnGetSkipExecutionResultBasedOnHoliday(refDate, 1) AS SkipExecutionIncludeWeekend,
+			dbo.fnGetSkipExecutionResultBasedOnHoliday(refDate, 0) AS SkipExecution
+		FROM calendarDays
+		OPTION (MAXRECURSION 366)
+		"""
+
+		logging.info(f'Loading holiday calendar of {year}')
+		result = self.sgtam.execute_query_with_result(sql_query=sql_query, database='EvoProd')
+		return {
+			'loaded': time.time(),
+			'holidays': {
+				'1': sorted(self.__to_date(row[0]).isoformat() for row in result if row[1] == 1),
+				'0': sorted(self.__to_date(row[0]).isoformat() for row in result if row[2] == 1)
+			}
+		}
+
+
+	def load_year(self, year, refresh=False):
+		"""To get the holidays of a year from memory, the on-disk cache or EvoProd in this order
+
+		Return:
+		dict
+			include_weekend ('1' / '0') -> set of holiday dates
+		"""
+
+		with self.__lock:
+			entry = self.__years.get(year)
+			if refresh or entry is None or self.__is_expired(entry['loaded']):
+				cached = None if refresh else self.__read_cache(year)
+				if cached is None:
+					cached = self.__query_year(year)
+					self.__write_cache(year, cached)
+				entry = {
+					'loaded': cached['loaded'],
+					'holidays': {mode: set(self.__to_date(value) for value in dates) for mode, dates in cached['holidays'].items()}
+				}
+				self.__years[year] = entry
+			return entry['holidays']
+
+
+	def invalidate(self, year=None):
+		"""To drop a year, or every year if None, from memory and the on-disk cache, e.g. after the holidays are updated"""
+
+		with self.__lock:
+			years = list(self.__years) if year is None else [year]
+			if year is None and self.cache_directory is not None and os.path.isdir(self.cache_directory):
+				years += [int(name[17:21]) for name in os.listdir(self.cache_directory) if name.startswith('holiday_calendar_') and name.endswith('.json')]
+
+			for cached_year in set(years):
+				self.__years.pop(cached_year, None)
+				if self.cache_directory is not None and os.path.isfile(self.__cache_path(cached_year)):
+					os.remove(self.__cache_path(cached_year))
+
+
+	def is_holiday(self, ref_date, include_weekend):
+		"""Same as SGTAMProd.is_holiday, answered from the calendar"""
+
+		ref_date = self.__to_date(ref_date)
+		if ref_date in self.load_year(ref_date.year)[str(include_weekend)]:
+			logging.info(f'{ref_date} is holiday. Include weekend: {include_weekend}')
+			return True
+		else:
+			logging.info(f'{ref_date} is not holiday. Include weekend: {include_weekend}')
+			return False
+
+
+	def holidays(self, start_date, end_date, include_weekend):
+		"""To list the holidays between start_date and end_date, both included
+
+		Example:
+		calendar.holidays('2022-04-01', '2022-04-30', include_weekend=0)
+		"""
+
+		start_date = self.__to_date(start_date)
+		end_date = self.__to_date(end_date)
+		dates = []
+		for year in range(start_date.year, end_date.year + 1):
+			dates += [value for value in self.load_year(year)[str(include_weekend)] if start_date <= value <= end_date]
+		return sorted(dates)
+
+
+	def business_days(self, start_date, end_date, include_weekend=1):
+		"""To list the dates between start_date and end_date, both included, that are not holidays"""
+
+		start_date = self.__to_date(start_date)
+		end_date = self.__to_date(end_date)
+		holidays = set(self.holidays(start_date, end_date, include_weekend))
+		return [start_date + datetime.timedelta(days=offset) for offset in range((end_date - start_date).days + 1)
+			if start_date + datetime.timedelta(days=offset) not in holidays]
+
+
+	def next_business_day(self, ref_date, include_weekend=1, max_days=366):
+		"""To get the first date after ref_date that is not a holiday
+
+		Return:
+		datetime.date
+			next business day, None if there is none within max_days
+		"""
+
+		next_date = self.__to_date(ref_date)
+		for _ in range(max_days):
+			next_date += datetime.timedelta(days=1)
+			if next_date not in self.load_year(next_date.year)[str(include_weekend)]:
+				return next_date
+		return None
+
+
+class AsyncSGTAMProd:
+	"""To use the SGTAMProd helpers as coroutines, so independent checks and notifications of a run can overlap
+
+	Every call runs the blocking SGTAMProd method on a bounded thread pool, all calls share the pooled
+	engines of a single SGTAMProd.
+
+	Parameter:
+	max_workers : int
+		maximum number of helper calls running at the same time
+	sgtam : SGTAMProd
+		instance to wrap, a new one is created (and closed by close) if not given
+
+	Example:
+	import asyncio
+	from SGTAMProdTask import AsyncSGTAMProd
+
+	async def main():
+		async with AsyncSGTAMProd(max_workers=4) as s:
+			is_holiday, is_passed = await asyncio.gather(
+				s.is_holiday(ref_date='2022-04-28', include_weekend=1),
+				s.is_SGTAMProd_log_task_passed('2022-04-28', **pre_requisite_log)
+			)
+
+	asyncio.run(main())
+	"""
+
+	def __init__(self, max_workers=4, sgtam=None):
+		self.__owns_sgtam = sgtam is None
+		self.sgtam = SGTAMProd() if sgtam is None else sgtam
+		self.__executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='SGTAMProd')
+
+
+	async def __run(self, method, *args, **kwargs):
+		loop = asyncio.get_running_loop()
+		return await loop.run_in_executor(self.__executor, functools.partial(method, *args, **kwargs))
+
+
+	async def execute_query_to_df(self, sql_query, database):
+		"""Coroutine of SGTAMProd.execute_query_to_df"""
+
+		return await self.__run(self.sgtam.execute_query_to_df, sql_query=sql_query, database=database)
+
+
+	async def execute_query_with_result(self, sql_query, database):
+		"""Coroutine of SGTAMProd.execute_query_with_result"""
+
+		return await self.__run(self.sgtam.execute_query_with_result, sql_query=sql_query, database=database)
+
+
+	async def execute_query_without_result(self, sql_query, database):
+		"""Coroutine of SGTAMProd.execute_query_without_result"""
+
+		return await self.__run(self.sgtam.execute_query_without_result, sql_query=sql_query, database=database)
+
+
+	async def insert_tlog(self, **kwargs):
+		"""Coroutine of SGTAMProd.insert_tlog
+
+		Example:
+		SGTAM_log_config['statusFlag'], SGTAM_log_config['logID'] = await s.insert_tlog(**SGTAM_log_config)
+		"""
+
+		return await self.__run(self.sgtam.insert_tlog, **kwargs)
+
+
+	async def update_tlog(self, **kwargs):
+		"""Coroutine of SGTAMProd.update_tlog"""
+
+		return await self.__run(self.sgtam.update_tlog, **kwargs)
+
+
+	async def is_holiday(self, ref_date, include_weekend):
+		"""Coroutine of SGTAMProd.is_holiday"""
+
+		return await self.__run(self.sgtam.is_holiday, ref_date=ref_date, include_weekend=include_weekend)
+
+
+	async def is_SGTAMProd_log_task_passed(self, ref_date, **kwargs):
+		"""Coroutine of SGTAMProd.is_SGTAMProd_log_task_passed"""
+
+		return await self.__run(self.sgtam.is_SGTAMProd_log_task_passed, ref_date, **kwargs)
+
+
+	async def get_SGTAMProd_log_task_status(self, ref_date, **kwargs):
+		"""Coroutine of SGTAMProd.get_SGTAMProd_log_task_status"""
+
+		return await self.__run(self.sgtam.get_SGTAMProd_log_task_status, ref_date, **kwargs)
+
+
+	async def send_email(self, **kwargs):
+		"""Coroutine of SGTAMProd.send_email"""
+
+		return await self.__run(self.sgtam.send_email, **kwargs)
+
+
+	async def queue_email(self, **kwargs):
+		"""Coroutine of SGTAMProd.queue_email"""
+
+		return await self.__run(self.sgtam.queue_email, **kwargs)
+
+
+	async def close(self):
+		"""To wait for the running calls, then close the SGTAMProd engines if this instance created it"""
+
+		loop = asyncio.get_running_loop()
+		await loop.run_in_executor(None, self.__executor.shutdown)
+		if self.__owns_sgtam:
+			self.sgtam.close()
+
+
+	async def __aenter__(self):
+		return self
+
+
+	async def __aexit__(self, exc_type, exc_value, traceback):
+		await self.close()
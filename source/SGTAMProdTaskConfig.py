@@ -1,2 +1,33 @@
 db_username = 'xxx'
 db_password = 'xxx'
+
+# Connection pool of each database engine kept by SGTAMProd
+db_pool_size = 5
+db_max_overflow = 5
+db_pool_pre_ping = True
+db_pool_recycle = 1800
+
+# Answer is_holiday from a calendar loaded one year at a time instead of one EvoProd query per date
+holiday_calendar = False
+# Directory of the on-disk holiday calendar, one JSON file per year, None to only cache in memory
+holiday_calendar_directory = None
+# Cached years older than this are loaded again, None to never expire
+holiday_calendar_ttl_hours = 24
+
+# Queue tLog updates and write them in batches from a background thread (TLogWriter)
+buffered_tlog = False
+# Seconds between two flushes of the queued tLog updates
+tlog_flush_interval = 2
+# Maximum number of tLog updates sent in one batch
+tlog_max_batch = 50
+
+# SMTP server of send_email and the email outbox, e.g. 'localhost' and 8025 for a local stand-in
+smtp_host = 'mailout.gfk.com'
+smtp_port = 25
+# Spool directory of queue_email, None for source/cache/outbox
+email_outbox_directory = None
+# Delivery attempts before a spooled email is moved to the failed folder, first retry after email_retry_backoff seconds, doubled every attempt
+email_max_attempts = 5
+email_retry_backoff = 30
+# Seconds close(), also run at interpreter exit, waits for the emails of the run to be delivered, it does not wait again after an explicit flush_outbox()
+email_flush_timeout = 300
@@ -0,0 +1,86 @@
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date
+import threading
+import time
+import unittest
+from unittest import mock
+from OIP_PSB_Backfill import backfill, load_prelog
+from OIP_PSB_Ingest import ingest_prelog_python
+from OIP_PSB_TestSupport import PipelineTestCase, RecordingConnection, prelog_line
+
+
+class LoadPrelogTest(PipelineTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.cnxn = RecordingConnection()
+
+    def loads(self):
+        cursor = self.cnxn.connection.execute('SELECT file_name, import_date, COUNT(*) FROM tOIPPreLog3 GROUP BY file_name, import_date ORDER BY file_name, import_date')
+        return [(file_name, str(import_date), rows) for file_name, import_date, rows in cursor.fetchall()]
+
+    @mock.patch('OIP_PSB_Backfill.config.load_mode', 'reload')
+    def test_file_loaded_by_weekly_run_is_replaced_under_its_import_date(self):
+        # The weekly run found F230818D in the 2023-08-23 folder and imported it on 2023-08-24
+        path = self.write_prelog('F230818D.TXT', [prelog_line(channel_id, 0) for channel_id in range(1, 6)])
+        ingest_prelog_python(self.cnxn, path, 'F230818D', date(2023, 8, 24))
+
+        import_date, rows = load_prelog(self.cnxn, path, 'F230818D', date(2023, 8, 23))
+
+        self.assertEqual(str(import_date), '2023-08-24')
+        self.assertEqual(rows, 5)
+        self.assertEqual(self.loads(), [('F230818D', '2023-08-24', 5)])
+
+    @mock.patch('OIP_PSB_Backfill.config.load_mode', 'reload')
+    def test_file_never_loaded_gets_the_folder_date(self):
+        path = self.write_prelog('F230825A.TXT', [prelog_line(channel_id, 0) for channel_id in range(1, 4)])
+
+        import_date, rows = load_prelog(self.cnxn, path, 'F230825A', date(2023, 8, 28))
+
+        self.assertEqual(import_date, date(2023, 8, 28))
+        self.assertEqual(self.loads(), [('F230825A', '2023-08-28', 3)])
+
+    @mock.patch('OIP_PSB_Backfill.config.load_mode', 'reload')
+    def test_failed_reload_keeps_the_earlier_load(self):
+        path = self.write_prelog('F230818D.TXT', [prelog_line(channel_id, 0) for channel_id in range(1, 6)])
+        ingest_prelog_python(self.cnxn, path, 'F230818D', date(2023, 8, 24))
+
+        with mock.patch('OIP_PSB_Ingest.read_prelog_rows', side_effect=OSError('share went away')), self.assertRaises(OSError):
+            load_prelog(self.cnxn, path, 'F230818D', date(2023, 8, 23))
+
+        self.assertEqual(self.loads(), [('F230818D', '2023-08-24', 5)])
+
+
+class BackfillTest(PipelineTestCase):
+
+    def test_copies_of_a_file_name_in_several_folders_are_not_loaded_at_the_same_time(self):
+        prelogs = [('2023-08-21', 'F230818D.TXT'), ('2023-08-21', 'F230821A.TXT'), ('2023-08-23', 'F230818D.TXT')]
+        running, overlaps, loaded = set(), [], []
+        lock = threading.Lock()
+
+        def backfill_prelog(source_path, file_name, folder_date):
+            with lock:
+                if file_name in running:
+                    overlaps.append(file_name)
+                running.add(file_name)
+            time.sleep(0.2)
+            with lock:
+                running.discard(file_name)
+                loaded.append((file_name, folder_date.isoformat()))
+            return {'status': 'done', 'rows': 1, 'import_date': folder_date.isoformat(), 'bytes': 1, 'sha256': ''}
+
+        manifest = mock.Mock()
+        manifest.file_info.return_value = {'size': 1, 'mtime': 0.0}
+        with mock.patch('OIP_PSB_Backfill.PrelogManifest', return_value=manifest), \
+                mock.patch('OIP_PSB_Backfill.find_prelogs', return_value=prelogs), \
+                mock.patch('OIP_PSB_Backfill.backfill_prelog', backfill_prelog), \
+                mock.patch('OIP_PSB_Backfill.ProcessPoolExecutor', lambda max_workers, **kwargs: ThreadPoolExecutor(max_workers)):
+            summary = backfill(date(2023, 8, 21), date(2023, 8, 23), 4, 4, self.path('checkpoint.json'), self.path('backfill.log'))
+
+        self.assertEqual(summary['done'], 3)
+        self.assertEqual(overlaps, [])
+        self.assertEqual([folder for file_name, folder in loaded if file_name == 'F230818D'], ['2023-08-21', '2023-08-23'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,84 @@
+from datetime import date
+import unittest
+from unittest import mock
+from OIP_PSB_Ingest import ingest_prelog_delta, ingest_prelog_python
+from OIP_PSB_TestSupport import PipelineTestCase, RecordingConnection, prelog_line
+
+class IngestPrelogDeltaTest(PipelineTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.cnxn = RecordingConnection()
+
+    def test_version_change_sends_only_changed_rows_and_keeps_previous_version(self):
+        version_a = [prelog_line(channel_id, start_time) for channel_id in range(1, 11) for start_time in range(0, 2400, 100)]
+        ingest_prelog_python(self.cnxn, self.write_prelog('F240308A.TXT', version_a), 'F240308A', date(2024, 3, 8))
+        self.assertEqual(len(self.cnxn.rows('F240308A', date(2024, 3, 8))), 240)
+
+        # Version B changes 2 titles, removes 1 slot and adds 1 slot
+        version_b = list(version_a)
+        version_b[0] = prelog_line(1, 0, title='Untold Legends')
+        version_b[5] = prelog_line(1, 500, title='Oh Butterfly!')
+        del version_b[10]
+        version_b.append(prelog_line(11, 0))
+
+        self.cnxn.rows_sent = 0
+        with mock.patch('OIP_PSB_Ingest.find_previous_load', return_value=('F240308A', date(2024, 3, 8))):
+            result = ingest_prelog_delta(self.cnxn, self.write_prelog('F240308B.TXT', version_b), 'F240308B', date(2024, 3, 11))
+
+        self.assertFalse(result['full_reload'])
+        self.assertEqual((result['updated'], result['removed'], result['inserted']), (2, 1, 1))
+        self.assertEqual(result['unchanged'], 237)
+        self.assertEqual(result['copied'], 240)
+        # Clear + copy statements, then one row per change
+        self.assertEqual(self.cnxn.rows_sent, 2 + 4)
+
+        self.assertEqual(len(self.cnxn.rows('F240308A', date(2024, 3, 8))), 240)
+        new_rows = self.cnxn.rows('F240308B', date(2024, 3, 11))
+        self.assertEqual(len(new_rows), 240)
+        titles = {(row[2], row[5]): row[8] for row in new_rows}
+        self.assertEqual(titles[(1, 0)], 'Untold Legends')
+        self.assertEqual(titles[(1, 500)], 'Oh Butterfly!')
+        self.assertEqual(titles[(11, 0)], 'Space Farmers')
+        self.assertNotIn((1, 1000), titles)
+
+    def test_same_version_reload_sends_nothing_when_unchanged(self):
+        lines = [prelog_line(channel_id, 0) for channel_id in range(1, 6)]
+        path = self.write_prelog('F240308A.TXT', lines)
+        ingest_prelog_python(self.cnxn, path, 'F240308A', date(2024, 3, 8))
+
+        self.cnxn.rows_sent = 0
+        with mock.patch('OIP_PSB_Ingest.find_previous_load', return_value=('F240308A', date(2024, 3, 8))):
+            result = ingest_prelog_delta(self.cnxn, path, 'F240308A', date(2024, 3, 8))
+
+        self.assertEqual((result['inserted'], result['updated'], result['removed'], result['unchanged']), (0, 0, 0, 5))
+        self.assertEqual(self.cnxn.rows_sent, 0)
+        self.assertEqual(len(self.cnxn.rows('F240308A', date(2024, 3, 8))), 5)
+
+    def test_text_edits_are_not_hidden_by_number_or_space_normalization(self):
+        lines = [prelog_line(1, 0, title='00123'), prelog_line(2, 0, title='1.0'), prelog_line(3, 0, title='ABC'), prelog_line(4, 0)]
+        ingest_prelog_python(self.cnxn, self.write_prelog('F240308A.TXT', lines), 'F240308A', date(2024, 3, 8))
+
+        # Lost leading zeros, 1.0 written as 1 and a trailing space added, SLOT_DURATION is numeric in the table
+        lines = [prelog_line(1, 0, title='123'), prelog_line(2, 0, title='1'), prelog_line(3, 0, title='ABC '), prelog_line(4, 0).replace('\t30\t', '\t030\t')]
+        with mock.patch('OIP_PSB_Ingest.find_previous_load', return_value=('F240308A', date(2024, 3, 8))):
+            result = ingest_prelog_delta(self.cnxn, self.write_prelog('F240308B.TXT', lines), 'F240308B', date(2024, 3, 11))
+
+        self.assertEqual((result['updated'], result['unchanged']), (3, 1))
+        self.assertEqual([row[8] for row in self.cnxn.rows('F240308B', date(2024, 3, 11))], ['123', '1', 'ABC ', 'Space Farmers'])
+
+    def test_delta_is_rolled_back_when_rows_touched_differ_from_the_diff(self):
+        lines = [prelog_line(channel_id, 0) for channel_id in range(1, 4)]
+        ingest_prelog_python(self.cnxn, self.write_prelog('F240308A.TXT', lines), 'F240308A', date(2024, 3, 8))
+
+        # The driver reports the UPDATE of the changed row touched nothing
+        lines[0] = prelog_line(1, 0, title='Untold Legends')
+        with mock.patch('OIP_PSB_Ingest.find_previous_load', return_value=('F240308A', date(2024, 3, 8))), \
+                mock.patch.object(RecordingConnection.Cursor, 'rowcount', 0, create=True):
+            with self.assertRaisesRegex(RuntimeError, 'UPDATE touched 0 rows'):
+                ingest_prelog_delta(self.cnxn, self.write_prelog('F240308A.TXT', lines), 'F240308A', date(2024, 3, 8))
+
+        self.assertEqual([row[8] for row in self.cnxn.rows('F240308A', date(2024, 3, 8))], ['Space Farmers'] * 3)
+
+if __name__ == '__main__':
+    unittest.main()
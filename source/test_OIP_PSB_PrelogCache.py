@@ -0,0 +1,62 @@
+import hashlib
+import os
+import unittest
+from unittest import mock
+from OIP_PSB_JsonFile import write_json
+from OIP_PSB_PrelogCache import PrelogCache
+from OIP_PSB_TestSupport import PipelineTestCase
+
+
+class PrelogCacheResumeTest(PipelineTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.source_path = self.path('F240308B.TXT')
+        self.content = os.urandom(10 * 1024)
+        with open(self.source_path, 'wb') as file:
+            file.write(self.content)
+        stat = os.stat(self.source_path)
+        self.source_size, self.source_mtime = stat.st_size, stat.st_mtime
+        self.cache = PrelogCache(self.path('cache'), chunk_size=1024)
+        self.part_path = os.path.join(self.cache.cache_directory, 'F240308B.TXT.part')
+
+    def interrupted_copy(self, part_content, source_mtime=None):
+        os.makedirs(self.cache.cache_directory, exist_ok=True)
+        with open(self.part_path, 'wb') as file:
+            file.write(part_content)
+        write_json(f'{self.part_path}.json', {'source_size': self.source_size, 'source_mtime': source_mtime or self.source_mtime})
+
+    def fetch(self):
+        with mock.patch('builtins.open', wraps=open) as opened:
+            local_path = self.cache.fetch(self.source_path, source_size=self.source_size, source_mtime=self.source_mtime)
+        modes = [call.args[1] for call in opened.call_args_list if call.args[0] == self.part_path and len(call.args) > 1]
+        return local_path, modes
+
+    def check_copy(self, local_path):
+        with open(local_path, 'rb') as file:
+            self.assertEqual(file.read(), self.content)
+        self.assertEqual(self.cache.sha256('F240308B.TXT'), hashlib.sha256(self.content).hexdigest())
+        self.assertFalse(os.path.exists(self.part_path))
+        self.assertFalse(os.path.exists(f'{self.part_path}.json'))
+
+    def test_interrupted_copy_of_unchanged_source_is_resumed(self):
+        self.interrupted_copy(self.content[:6000])
+        local_path, modes = self.fetch()
+        self.assertIn('ab', modes)
+        self.check_copy(local_path)
+
+    def test_partial_copy_not_matching_the_share_is_started_over(self):
+        self.interrupted_copy(self.content[:5000] + b'\0' * 1000)
+        local_path, modes = self.fetch()
+        self.assertNotIn('ab', modes)
+        self.check_copy(local_path)
+
+    def test_partial_copy_of_another_source_mtime_is_started_over(self):
+        self.interrupted_copy(self.content[:6000], source_mtime=self.source_mtime - 60)
+        local_path, modes = self.fetch()
+        self.assertNotIn('ab', modes)
+        self.check_copy(local_path)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,34 @@
+import os
+import unittest
+import pandas as pd
+from OIP_PSB_ReportCache import ReportResultCache
+from OIP_PSB_TestSupport import PipelineTestCase
+
+
+class ReportResultCacheTest(PipelineTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.cache = ReportResultCache(self.directory.name)
+        self.params = ['F240308B', '2024-03-11']
+
+    def test_put_twice_with_the_same_key_keeps_the_result(self):
+        df = pd.DataFrame({'Program ID': [1, 2]})
+        self.cache.put('SP_OIP_PSB_Weekly_Report_Main', self.params, '2:123', df)
+        self.cache.put('SP_OIP_PSB_Weekly_Report_Main', self.params, '2:123', df)
+
+        cached = ReportResultCache(self.directory.name).get('SP_OIP_PSB_Weekly_Report_Main', self.params, '2:123')
+        self.assertIsNotNone(cached)
+        pd.testing.assert_frame_equal(cached, df)
+
+    def test_put_with_a_new_fingerprint_replaces_the_previous_result(self):
+        self.cache.put('SP_OIP_PSB_Weekly_Report_Main', self.params, '2:123', pd.DataFrame({'Program ID': [1, 2]}))
+        self.cache.put('SP_OIP_PSB_Weekly_Report_Main', self.params, '3:456', pd.DataFrame({'Program ID': [1, 2, 3]}))
+
+        self.assertIsNone(self.cache.get('SP_OIP_PSB_Weekly_Report_Main', self.params, '2:123'))
+        self.assertEqual(len(self.cache.get('SP_OIP_PSB_Weekly_Report_Main', self.params, '3:456')), 3)
+        self.assertEqual(len([name for name in os.listdir(self.directory.name) if name.endswith('.pkl')]), 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,20 @@
+import unittest
+import pandas as pd
+from OIP_PSB_ReportModel import shape_report_frame
+
+
+class ShapeReportFrameTest(unittest.TestCase):
+
+    def test_int_or_text_keeps_values_that_are_not_whole_numbers(self):
+        df = pd.DataFrame({'PROGRAMME_ID': ['123', '12.5', 'ABC', '7.0']})
+        shape_report_frame(df, {'PROGRAMME_ID': 'int_or_text'})
+        self.assertEqual(df['PROGRAMME_ID'].tolist(), [123, '12.5', 'ABC', 7])
+
+    def test_int_raises_on_a_fraction(self):
+        df = pd.DataFrame({'CHANNEL_ID': ['1', '2.5', None]})
+        with self.assertLogs(level='ERROR'), self.assertRaisesRegex(ValueError, r"1 values of CHANNEL_ID cannot be converted, e.g. \['2.5'\]"):
+            shape_report_frame(df, {'CHANNEL_ID': 'int'})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,32 @@
+from datetime import date
+import unittest
+from OIP_PSB_Ingest import parse_tx_date
+from OIP_PSB_TestSupport import PipelineTestCase, prelog_line
+from OIP_PSB_Validate import validate_prelog
+
+
+class ParseTxDateTest(unittest.TestCase):
+
+    def test_only_eight_digits_are_parsed(self):
+        self.assertEqual(parse_tx_date('20240308'), date(2024, 3, 8))
+        # strptime alone reads both as 2024-03-08, Spark to_date(..., 'yyyyMMdd') returns null
+        self.assertIsNone(parse_tx_date('2024038'))
+        self.assertIsNone(parse_tx_date('202438'))
+        self.assertIsNone(parse_tx_date(' 2024038'))
+        self.assertIsNone(parse_tx_date('20240230'))
+        self.assertIsNone(parse_tx_date(None))
+
+
+class ValidatePrelogTest(PipelineTestCase):
+
+    def test_short_tx_dates_fail_validation(self):
+        lines = [prelog_line(1, 0), prelog_line(2, 0).replace('20240308', '2024038'), prelog_line(3, 0).replace('20240308', '202438')]
+        report = validate_prelog(self.write_prelog('F240308A.TXT', lines))
+
+        self.assertFalse(report['is_valid'])
+        self.assertEqual(report['invalid_tx_dates'], 2)
+        self.assertEqual(report['invalid_tx_date_samples'], [(2, '2024038'), (3, '202438')])
+
+
+if __name__ == '__main__':
+    unittest.main()
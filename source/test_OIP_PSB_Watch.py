@@ -0,0 +1,47 @@
+import sys
+import unittest
+from unittest import mock
+from OIP_PSB_TestSupport import PipelineTestCase
+from OIP_PSB_Watch import PrelogWatcher
+
+CANDIDATE = ('2024-03-11', 'F240308B.TXT', 3145728, 1710137107.0)
+
+
+class PrelogWatcherRetryTest(PipelineTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.state_path = self.path('watch_state.json')
+
+    def watcher(self, exit_code, retry_interval=0, max_attempts=2):
+        watcher = PrelogWatcher(mock.Mock(), self.state_path, stable_seconds=0, retry_interval=retry_interval, max_attempts=max_attempts,
+                                command=[sys.executable, '-c', f'import sys; sys.exit({exit_code})'])
+        watcher.candidate = mock.Mock(return_value=CANDIDATE)
+        return watcher
+
+    def test_failed_run_is_retried_until_attempts_are_used(self):
+        watcher = self.watcher(exit_code=1)
+        watcher.poll()
+        self.assertEqual((watcher.state['last_run']['status'], watcher.state['last_run']['attempts']), ('failed', 1))
+
+        # Restarting the watcher keeps the failed state and runs the file again
+        watcher = self.watcher(exit_code=1)
+        self.assertTrue(watcher.is_new(CANDIDATE))
+        watcher.poll()
+        self.assertEqual((watcher.state['last_run']['status'], watcher.state['last_run']['attempts']), ('failed', 2))
+        self.assertFalse(watcher.is_new(CANDIDATE))
+
+    def test_failed_run_waits_for_the_retry_interval(self):
+        watcher = self.watcher(exit_code=1, retry_interval=3600)
+        watcher.poll()
+        self.assertFalse(watcher.is_new(CANDIDATE))
+
+    def test_successful_run_is_not_run_again(self):
+        watcher = self.watcher(exit_code=0)
+        watcher.poll()
+        self.assertEqual((watcher.state['last_run']['status'], watcher.state['last_run']['returncode']), ('done', 0))
+        self.assertFalse(watcher.is_new(CANDIDATE))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,71 @@
+import os
+import subprocess
+import sys
+import tempfile
+import time
+import unittest
+
+try:
+    import sqlalchemy  # noqa: F401
+    from SGTAMProdTask import EmailOutbox
+except ImportError:
+    EmailOutbox = None
+
+EMAIL = {'sender': 'xxx@gfk.com', 'to': 'xxx@gfk.com', 'subject': 'test 1234', 'body': 'body testing 1234', 'is_html': False}
+
+
+@unittest.skipIf(EmailOutbox is None, 'sqlalchemy is not installed')
+class EmailOutboxTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        # Cleanups run last added first, the outboxes are closed before their directory goes
+        self.addCleanup(self.directory.cleanup)
+
+    def outbox(self, **kwargs):
+        # Nothing listens on port 1, every delivery fails and is retried later
+        outbox = EmailOutbox(self.directory.name, host='127.0.0.1', port=1, retry_backoff=3600, **kwargs)
+        self.addCleanup(outbox.close, timeout=0)
+        return outbox
+
+    def spool_previous_run(self, claimed_by=None):
+        outbox = self.outbox()
+        message_id = outbox.queue_email(**EMAIL)
+        outbox.close(timeout=0)
+        if claimed_by is not None:
+            envelope_path = os.path.join(self.directory.name, f'{message_id}.json')
+            os.replace(envelope_path, f'{envelope_path}.{claimed_by}.sending')
+        return message_id
+
+    def test_claim_of_a_stopped_run_is_put_back_at_start(self):
+        stopped = subprocess.Popen([sys.executable, '-c', 'pass'])
+        stopped.wait()
+        message_id = self.spool_previous_run(claimed_by=stopped.pid)
+
+        self.outbox()
+        names = os.listdir(self.directory.name)
+        self.assertNotIn(f'{message_id}.json.{stopped.pid}.sending', names)
+
+    def test_flush_only_waits_for_the_messages_of_this_outbox(self):
+        self.spool_previous_run()
+        self.spool_previous_run(claimed_by=os.getpid())
+
+        outbox = self.outbox()
+        start = time.time()
+        self.assertEqual(outbox.flush(timeout=5), 0)
+        self.assertLess(time.time() - start, 2)
+        self.assertEqual(outbox.pending(), 2)
+
+        outbox.queue_email(**EMAIL)
+        self.assertEqual(outbox.flush(timeout=1), 1)
+
+    def test_close_at_exit_waits_at_most_close_timeout(self):
+        outbox = self.outbox(close_timeout=1)
+        outbox.queue_email(**EMAIL)
+        start = time.time()
+        outbox.close()
+        self.assertLess(time.time() - start, 5)
+
+
+if __name__ == '__main__':
+    unittest.main()